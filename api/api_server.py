@@ -1,11 +1,26 @@
+import argparse
 import asyncio
 import asyncpg
+import datetime
+import hashlib
 import json
+import logging
+import math
+import os
+import signal
+import time
+import traceback
 from aiohttp import web
 
-import shapely.geometry
-import shapely.wkb
-from shapely.geometry.base import BaseGeometry
+import columnar
+from import_data import CRASH_SEVERITIES, DATA_CHANGED_CHANNEL
+from metrics import SIZE_BUCKETS, Registry
+from request_coalescer import RequestCoalescer
+from response_cache import ResponseCache
+
+# Named explicitly, __name__ is __main__ when run as a script
+logger = logging.getLogger('api_server')
+slow_query_logger = logging.getLogger('api_server.slow_queries')
 
 settings = {}
 
@@ -13,10 +28,665 @@ settings = {}
 with open('settings.json') as json_file:
     settings = json.load(json_file)
 
+# Grid cells per 256px map tile width in aggregate mode, i.e. one cell per 64px
+AGGREGATE_CELLS_PER_TILE = 4
+# Upper bound on the grid size across the requested bounding box
+AGGREGATE_MAX_CELLS_PER_SIDE = 128
+
+# vehicle_types values of list_crashes and the column counting that kind of unit
+VEHICLE_TYPE_COLUMNS = {
+    'car': 'InvolvedCar',
+    'motorcycle': 'InvolvedMotorcycle',
+    'truck': 'InvolvedTruck',
+    'bus': 'InvolvedBus',
+    'bicycle': 'InvolvedBicycle',
+    'pedestrian': 'InvolvedPedestrian',
+    'other': 'InvolvedOther',
+}
+
+# list_crashes fields holding a list of lookup IDs, and the column they filter
+CATEGORY_FILTER_COLUMNS = {
+    'severity': 'SeverityID',
+    'nature': 'NatureID',
+    'type': 'TypeID',
+    'weather': 'AtmosphericConditionID',
+}
+
+# list_crashes fields holding True/False, and the column they filter
+BOOLEAN_FILTER_COLUMNS = {
+    'sealed': 'Sealed',
+    'dry': 'Dry',
+    'day': 'Day',
+    'partialday': 'PartialDaylight',
+    'lit': 'Lit',
+}
+
+# lighting values of list_crashes and the condition matching crashes in that
+# light. Daylight crashes are not consistently Lit, so the darkness ones check
+# Day and PartialDaylight as well.
+LIGHTING_CONDITIONS = {
+    'daylight': "Day",
+    'darknesslit': "(NOT Day AND NOT PartialDaylight AND Lit)",
+    'darknessunlit': "(NOT Day AND NOT PartialDaylight AND NOT Lit)",
+    'dawndusk': "PartialDaylight",
+}
+
+# Below this zoom level tiles contain aggregated clusters rather than individual crashes
+TILE_AGGREGATE_BELOW_ZOOM = 12
+# Tile coordinate space, and the number of cluster cells across each tile
+TILE_EXTENT = 4096
+TILE_CLUSTER_GRID = 64
+
+# Page size of list_crashes when no limit is given, and the largest allowed
+DEFAULT_PAGE_SIZE = 1000
+MAX_PAGE_SIZE = 10000
+# Rows written per chunk by stream_crashes
+STREAM_BATCH_ROWS = 1000
+
+# Database connections all workers together open by default, below the
+# max_connections of 100 Postgres ships with. Each worker has a pool and a
+# LISTEN connection.
+DB_CONNECTION_BUDGET = 80
+# Largest pool of a worker unless pool_max_size is set
+DEFAULT_POOL_MAX_SIZE = 10
+
+# Routes not counted against client_max_requests
+UNLIMITED_ROUTES = ('/cache_stats', '/metrics')
+
+# One crash as returned by list_crashes and stream_crashes
+CRASH_JSON = """json_build_object(
+    'id', ID,
+    'severityindex', SeverityIndex,
+    'nearestaadt', NearestAADT,
+    'location', json_build_array(ST_X(Location::geometry), ST_Y(Location::geometry))
+)"""
+
+# A single crash by ID with the names of its lookup IDs, for get_crash
+GET_CRASH_SQL = """
+SELECT (to_jsonb(c) - 'location' || jsonb_build_object(
+    'location', jsonb_build_array(ST_X(c.Location::geometry), ST_Y(c.Location::geometry)),
+    'severity', s.Name,
+    'nature', n.Name,
+    'type', t.Name,
+    'roadwayfeature', rf.Name,
+    'trafficcontrol', tc.Name,
+    'atmosphericcondition', ac.Name
+))::text
+FROM CrashLocations c
+JOIN CrashSeverity s ON s.ID = c.SeverityID
+JOIN CrashNature n ON n.ID = c.NatureID
+JOIN CrashType t ON t.ID = c.TypeID
+LEFT JOIN RoadwayFeature rf ON rf.ID = c.RoadwayFeatureID
+LEFT JOIN TrafficControl tc ON tc.ID = c.TrafficControlID
+LEFT JOIN AtmosphericCondition ac ON ac.ID = c.AtmosphericConditionID
+WHERE c.ID = $1
+LIMIT 1
+"""
+
+# /stats groupby values and the CrashStats column (or joined lookup name) they group by
+STATS_GROUP_COLUMNS = {
+    'year': 'cs.Year',
+    'council': 'cs.Council',
+    'severity': 's.Name',
+    'nature': 'n.Name',
+    'type': 't.Name',
+    'car': 'cs.Car',
+    'motorcycle': 'cs.Motorcycle',
+    'truck': 'cs.Truck',
+    'bus': 'cs.Bus',
+    'bicycle': 'cs.Bicycle',
+    'pedestrian': 'cs.Pedestrian',
+    'other': 'cs.Other',
+}
+
+# /stats totals and the sums they are computed from
+STATS_MEASURES = {
+    'crashes': 'sum(cs.Crashes)',
+    'fatalities': 'sum(cs.CasualtyFatality)',
+    'hospitalised': 'sum(cs.CasualtyHospital)',
+    'medicallytreated': 'sum(cs.CasualtyMedicallyTreated)',
+    'minorinjury': 'sum(cs.CasualtyMinorInjury)',
+    'casualties': 'sum(cs.CasualtyFatality + cs.CasualtyHospital + cs.CasualtyMedicallyTreated + cs.CasualtyMinorInjury)',
+}
+
+# /stats fields holding a list of lookup IDs, and the CrashStats column they filter
+STATS_CATEGORY_COLUMNS = {
+    'severity': 'cs.SeverityID',
+    'nature': 'cs.NatureID',
+    'type': 'cs.TypeID',
+}
+
+# Region x year x severity x vehicle rollup shipped with the repo, served by
+# /stats while CrashStats is empty. It only has these dimensions.
+STATS_ROLLUP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    '..', 'datasets', 'vehicle_crashes_by_type.json')
+STATS_ROLLUP_DIMENSIONS = ('year', 'region', 'severity', 'motorcycle', 'truck', 'bus')
+
+STATS_SQL = """
+SELECT COALESCE(json_agg(row_to_json(g)), '[]')::text
+FROM (
+    SELECT {columns}
+    FROM CrashStats cs
+    JOIN CrashSeverity s ON s.ID = cs.SeverityID
+    JOIN CrashNature n ON n.ID = cs.NatureID
+    JOIN CrashType t ON t.ID = cs.TypeID
+    {where}
+    {group}
+) AS g
+"""
+
+# The response cache snaps the bounding box outwards to a power of two grid
+# with at least this many cells across the view, so nearby pans share entries.
+CACHE_SNAP_CELLS_PER_VIEW = 8
+# list_crashes fields that hold a list of names, sorted and deduplicated for the
+# cache key. The lookup ID lists of CATEGORY_FILTER_COLUMNS are converted to int.
+NAME_LIST_FIELDS = ('vehicle_types', 'lighting')
+
+'''
+Condition and arguments matching Location against the corners of a request,
+for the GiST indexes on Location::geometry
+'''
+def bounding_box_condition(request_json):
+    x1, y1 = request_json['corner1'][:2]
+    x2, y2 = request_json['corner2'][:2]
+    return ("Location::geometry && ST_MakeEnvelope({}, {}, {}, {}, 4283)",
+        [float(min(x1, x2)), float(min(y1, y2)),
+        float(max(x1, x2)), float(max(y1, y2))])
+
+'''
+Turns the filters of a list_crashes request into a WHERE clause (without the
+WHERE keyword) and the list of arguments for its $n placeholders.
+'''
+def compile_crash_filters(request_json):
+    # List of tuples, with first value being the SQL, second being a list of arguments
+    conditions = []
+
+    # Boundaries
+    # Uses the GiST index on Location::geometry, see CREATE_CRASH_LOCATIONS_INDEXES
+    if 'corner1' in request_json and 'corner2' in request_json:
+        conditions.append(bounding_box_condition(request_json))
+
+    # Years, as a half-open range on CrashDate so the index and partition pruning apply
+    if 'yearmax' in request_json:
+        conditions.append(("CrashDate < {}",
+            [datetime.datetime(int(request_json['yearmax']) + 1, 1, 1)]))
+
+    if 'yearmin' in request_json:
+        conditions.append(("CrashDate >= {}",
+            [datetime.datetime(int(request_json['yearmin']), 1, 1)]))
+
+    # Vehicles, a crash matches if it involved any of the requested types.
+    # The zero is inlined so single type requests can use the partial indexes.
+    if 'vehicle_types' in request_json:
+        vehicle_types = set(request_json['vehicle_types'])
+        unknown = vehicle_types - VEHICLE_TYPE_COLUMNS.keys()
+        if unknown:
+            raise web.HTTPBadRequest(text=f"Unknown vehicle types: {', '.join(sorted(unknown))}")
+
+        if vehicle_types != VEHICLE_TYPE_COLUMNS.keys():
+            columns = [VEHICLE_TYPE_COLUMNS[v] for v in sorted(vehicle_types)]
+            conditions.append(("(" + " OR ".join(f"{c} > 0" for c in columns) + ")"
+                if columns else "FALSE", []))
+
+    # Keyset pagination, crashes after the last one of the previous page
+    # in (SeverityIndex DESC, ID DESC) order
+    if 'after' in request_json:
+        severity_index, crash_id = request_json['after'][:2]
+        conditions.append(("(SeverityIndex, ID) < ({}, {})", [int(severity_index), int(crash_id)]))
+
+    # Categories
+    for field, column in CATEGORY_FILTER_COLUMNS.items():
+        if field in request_json:
+            conditions.append((f"{column} = ANY({{}}::smallint[])",
+                [[int(i) for i in request_json[field]]]))
+
+    # Road and lighting conditions
+    for field, column in BOOLEAN_FILTER_COLUMNS.items():
+        if field in request_json:
+            conditions.append((f"{column} = {{}}", [bool(request_json[field])]))
+
+    # Lighting, a crash matches if it happened in any of the requested conditions
+    if 'lighting' in request_json:
+        lighting = set(request_json['lighting'])
+        unknown = lighting - LIGHTING_CONDITIONS.keys()
+        if unknown:
+            raise web.HTTPBadRequest(text=f"Unknown lighting conditions: {', '.join(sorted(unknown))}")
+
+        if lighting != LIGHTING_CONDITIONS.keys():
+            conditions.append(("(" + " OR ".join(LIGHTING_CONDITIONS[l] for l in sorted(lighting)) + ")"
+                if lighting else "FALSE", []))
+
+    conditions_compiled = "\nAND ".join([c[0] for c in conditions])
+
+    current_var = 1
+    condition_variables = []
+    for condition in conditions:
+        condition_variables.extend(condition[1])
+        current_var += len(condition[1])
+
+    conditions_compiled = conditions_compiled.format(*[f'${n}' for n in range(1, current_var)])
+
+    return conditions_compiled, condition_variables
+
+'''
+Turns the filters of a list_census_sites request into a WHERE clause (without
+the WHERE keyword) and the list of arguments for its $n placeholders.
+'''
+def compile_census_filters(request_json):
+    conditions = []
+
+    if 'corner1' in request_json and 'corner2' in request_json:
+        conditions.append(bounding_box_condition(request_json))
+
+    if 'yearmax' in request_json:
+        conditions.append(("Year <= {}", [int(request_json['yearmax'])]))
+
+    if 'yearmin' in request_json:
+        conditions.append(("Year >= {}", [int(request_json['yearmin'])]))
+
+    condition_variables = []
+    for condition in conditions:
+        condition_variables.extend(condition[1])
+
+    conditions_compiled = "\nAND ".join([c[0] for c in conditions])
+    conditions_compiled = conditions_compiled.format(*[f'${n}' for n in range(1, len(condition_variables) + 1)])
+
+    return conditions_compiled, condition_variables
+
+'''
+Normalises a /stats request, validating groupby against the dimensions of the
+source it will be answered from
+'''
+def normalise_stats_request(request_json, dimensions):
+    if not isinstance(request_json, dict):
+        raise web.HTTPBadRequest(text="Expected a JSON object")
+    try:
+        return normalise_stats_fields(request_json, dimensions)
+    except (TypeError, ValueError, OverflowError) as e:
+        raise web.HTTPBadRequest(text=f"Invalid filters: {e}")
+
+def normalise_stats_fields(request_json, dimensions):
+    groupby = list(dict.fromkeys(request_json.get('groupby', [])))
+    unknown = [g for g in groupby if g not in dimensions]
+    if unknown:
+        raise web.HTTPBadRequest(text=f"Can't group by: {', '.join(unknown)}")
+
+    normalised = {'stats': True, 'groupby': groupby}
+
+    for field in ('yearmin', 'yearmax'):
+        if field in request_json:
+            normalised[field] = int(request_json[field])
+
+    for field in STATS_CATEGORY_COLUMNS:
+        if field in request_json:
+            normalised[field] = sorted(set(int(i) for i in request_json[field]))
+
+    for field in ('council', 'region'):
+        if field in request_json:
+            normalised[field] = sorted({str(name) for name in request_json[field]})
+
+    for field in ('car', 'motorcycle', 'truck', 'bus', 'bicycle', 'pedestrian', 'other'):
+        if field in request_json:
+            normalised[field] = bool(request_json[field])
+
+    return normalised
+
+'''
+Turns the filters of a normalised /stats request into a WHERE clause (without
+the WHERE keyword) on CrashStats and the list of arguments for its placeholders.
+'''
+def compile_stats_filters(request_json):
+    conditions = []
+
+    if 'yearmax' in request_json:
+        conditions.append(("cs.Year <= {}", [request_json['yearmax']]))
+
+    if 'yearmin' in request_json:
+        conditions.append(("cs.Year >= {}", [request_json['yearmin']]))
+
+    for field, column in STATS_CATEGORY_COLUMNS.items():
+        if field in request_json:
+            conditions.append((f"{column} = ANY({{}}::smallint[])", [request_json[field]]))
+
+    if 'council' in request_json:
+        conditions.append(("cs.Council = ANY({}::varchar[])", [request_json['council']]))
+
+    for field in ('car', 'motorcycle', 'truck', 'bus', 'bicycle', 'pedestrian', 'other'):
+        if field in request_json:
+            conditions.append((STATS_GROUP_COLUMNS[field] + " = {}", [request_json[field]]))
+
+    condition_variables = []
+    for condition in conditions:
+        condition_variables.extend(condition[1])
+
+    conditions_compiled = "\nAND ".join([c[0] for c in conditions])
+    conditions_compiled = conditions_compiled.format(*[f'${n}' for n in range(1, len(condition_variables) + 1)])
+
+    return conditions_compiled, condition_variables
+
+'''
+Reads the bundled rollup into one dict per record, with the same keys as the
+/stats response
+'''
+def load_stats_rollup(path=STATS_ROLLUP_PATH):
+    with open(path) as json_file:
+        rollup = json.load(json_file)
+
+    fields = [f['id'] for f in rollup['fields']]
+    records = []
+    for values in rollup['records']:
+        r = dict(zip(fields, values))
+        records.append({
+            'year': int(r['Crash_Year']),
+            'region': r['Crash_Police_Region'],
+            'severity': r['Crash_Severity'],
+            'motorcycle': r['Involving_Motorcycle_Moped'] == "Yes",
+            'truck': r['Involving_Truck'] == "Yes",
+            'bus': r['Involving_Bus'] == "Yes",
+            'crashes': int(r['Count_Crashes']),
+            'fatalities': int(r['Count_Casualty_Fatality']),
+            'hospitalised': int(r['Count_Casualty_Hospitalised']),
+            'medicallytreated': int(r['Count_Casualty_MedicallyTreated']),
+            'minorinjury': int(r['Count_Casualty_MinorInjury']),
+            'casualties': int(r['Count_Casualty_All']),
+        })
+    return records
+
+'''
+Answers a normalised /stats request from the rollup records, grouped and
+ordered the same way as STATS_SQL
+'''
+def aggregate_stats_rollup(records, request_json):
+    severities = None
+    if 'severity' in request_json:
+        severities = {CRASH_SEVERITIES.get(i) for i in request_json['severity']}
+
+    groups = {}
+    for r in records:
+        if r['year'] > request_json.get('yearmax', r['year']) or r['year'] < request_json.get('yearmin', r['year']):
+            continue
+        if severities is not None and r['severity'] not in severities:
+            continue
+        if 'region' in request_json and r['region'] not in request_json['region']:
+            continue
+        if any(field in request_json and r[field] != request_json[field] for field in ('motorcycle', 'truck', 'bus')):
+            continue
+
+        key = tuple(r[g] for g in request_json['groupby'])
+        totals = groups.get(key)
+        if totals is None:
+            totals = groups[key] = dict.fromkeys(STATS_MEASURES, 0)
+        for measure in STATS_MEASURES:
+            totals[measure] += r[measure]
+
+    return [dict(zip(request_json['groupby'], key), **groups[key]) for key in sorted(groups)]
+
+'''
+Normalises a list_crashes request so equivalent requests compare equal: list
+filters are sorted and deduplicated, flags are booleans, the bounding box is
+snapped outwards to a grid (see CACHE_SNAP_CELLS_PER_VIEW) and zoom is rounded
+and only kept for aggregate requests. The query is run for the normalised
+request, so a cached response is exactly what the query would return.
+
+Values of the wrong type raise HTTPBadRequest.
+'''
+def normalise_crash_request(request_json):
+    if not isinstance(request_json, dict):
+        raise web.HTTPBadRequest(text="Expected a JSON object")
+    try:
+        return normalise_crash_fields(request_json)
+    except (TypeError, ValueError, OverflowError) as e:
+        raise web.HTTPBadRequest(text=f"Invalid filters: {e}")
+
+def normalise_crash_fields(request_json):
+    normalised = {}
+
+    if 'corner1' in request_json and 'corner2' in request_json:
+        x1, y1 = request_json['corner1'][:2]
+        x2, y2 = request_json['corner2'][:2]
+        span = max(abs(x2 - x1), abs(y2 - y1), 1e-6)
+        cell = 2.0 ** math.floor(math.log2(span / CACHE_SNAP_CELLS_PER_VIEW))
+        normalised['corner1'] = [math.floor(min(x1, x2) / cell) * cell, math.floor(min(y1, y2) / cell) * cell]
+        normalised['corner2'] = [math.ceil(max(x1, x2) / cell) * cell, math.ceil(max(y1, y2) / cell) * cell]
+
+    for field in ('yearmin', 'yearmax'):
+        if field in request_json:
+            normalised[field] = int(request_json[field])
+
+    for field in CATEGORY_FILTER_COLUMNS:
+        if field in request_json:
+            normalised[field] = sorted({int(i) for i in request_json[field]})
+
+    # Unknown names are rejected by compile_crash_filters
+    for field in NAME_LIST_FIELDS:
+        if field in request_json:
+            normalised[field] = sorted({str(name) for name in request_json[field]})
+
+    for field in BOOLEAN_FILTER_COLUMNS:
+        if field in request_json:
+            normalised[field] = bool(request_json[field])
+
+    if 'after' in request_json:
+        severity_index, crash_id = request_json['after'][:2]
+        normalised['after'] = [int(severity_index), int(crash_id)]
+
+    if 'limit' in request_json:
+        normalised['limit'] = max(1, min(int(request_json['limit']), MAX_PAGE_SIZE))
+
+    if request_json.get('aggregate'):
+        normalised['aggregate'] = True
+        if 'zoom' in request_json:
+            normalised['zoom'] = round(float(request_json['zoom']))
+
+    return normalised
+
+'''
+Grid cell size in degrees for aggregate mode, based on the web mercator zoom
+level and capped so the bounding box never spans more than
+AGGREGATE_MAX_CELLS_PER_SIDE cells.
+'''
+def aggregate_cell_size(request_json):
+    cell_size = 0.0
+    if 'zoom' in request_json:
+        cell_size = 360.0 / (2 ** float(request_json['zoom']) * AGGREGATE_CELLS_PER_TILE)
+
+    if 'corner1' in request_json and 'corner2' in request_json:
+        span = max(abs(request_json['corner2'][0] - request_json['corner1'][0]),
+            abs(request_json['corner2'][1] - request_json['corner1'][1]))
+    else:
+        # Roughly the extent of Queensland
+        span = 20.0
+
+    return max(cell_size, span / AGGREGATE_MAX_CELLS_PER_SIDE)
+
+'''
+Whether the client asked for the columnar encoding of list_crashes, see columnar.py
+'''
+def accepts_columns(request):
+    for media_range in request.headers.get('Accept', '').split(','):
+        media_type, *params = [part.strip() for part in media_range.split(';')]
+        if media_type.lower() == columnar.COLUMNS_CONTENT_TYPE:
+            return 'q=0' not in params and 'q=0.0' not in params
+    return False
+
+'''
+Address requests are counted against client_max_requests under. Behind a
+reverse proxy set client_address_header to the header it appends the client's
+address to, e.g. X-Forwarded-For; the last address in it is used as earlier
+ones come from the client and can be made up.
+'''
+def client_address(request):
+    header = settings.get('client_address_header')
+    if header and header in request.headers:
+        return request.headers[header].split(',')[-1].strip()
+    return request.remote
+
+'''
+Stable hash of a set of list_crashes filters, used as part of cache keys
+'''
+def filter_hash(filters):
+    return hashlib.sha1(json.dumps(filters, sort_keys=True).encode("utf-8")).hexdigest()
+
 class Webserver:
     def __init__(self, pool, loop):
         self.pool = pool
         self.loop = loop
+        # normalised request hash -> JSON body of list_crashes
+        self.response_cache = ResponseCache(settings.get('response_cache_bytes', 64 * 1024 * 1024),
+            settings.get('response_cache_ttl', 300))
+        # (z, x, y, filter hash) -> encoded tile
+        self.tile_cache = ResponseCache(settings.get('tile_cache_bytes', 64 * 1024 * 1024))
+        # crash ID -> JSON body of get_crash
+        self.crash_cache = ResponseCache(settings.get('crash_cache_bytes', 8 * 1024 * 1024))
+        # Whether CrashStats has rows, checked on the first /stats request after an import
+        self.crash_stats_loaded = None
+        # Records of the bundled rollup, read when first needed
+        self.stats_rollup = None
+        # crash_index.CrashIndex answering list_crashes instead of Postgres, if enabled
+        self.crash_index = None
+        # Cache misses being answered, shared by identical requests arriving meanwhile
+        self.coalescer = RequestCoalescer(loop)
+        # Bumped whenever the caches are cleared, so builds started before then
+        # are neither shared with later requests nor cached
+        self.data_generation = 0
+        # client address -> requests in progress, and the most allowed (none if not set)
+        self.client_requests = {}
+        self.client_max_requests = settings.get('client_max_requests', 8) or None
+        # Set by build_server and start_webserver
+        self.runner = None
+        self.listener = None
+
+        # Queries taking longer than this many seconds are logged with their plan, if set
+        slow_query_ms = settings.get('slow_query_ms')
+        self.slow_query_seconds = slow_query_ms / 1000 if slow_query_ms is not None else None
+
+        self.metrics = Registry()
+        self.request_seconds = self.metrics.histogram('http_request_duration_seconds',
+            "Time to handle a request, by route, method and status")
+        self.response_bytes = self.metrics.histogram('http_response_bytes',
+            "Size of response bodies, by route", SIZE_BUCKETS)
+        self.db_acquire_seconds = self.metrics.histogram('db_acquire_wait_seconds',
+            "Time waiting for a pool connection, by query")
+        self.db_query_seconds = self.metrics.histogram('db_query_duration_seconds',
+            "Time running a query once a connection was acquired, by query")
+        self.query_rows = self.metrics.histogram('query_rows',
+            "Rows returned to the server, for queries that return rows rather than one JSON value", SIZE_BUCKETS)
+        self.serialisation_seconds = self.metrics.histogram('serialisation_duration_seconds',
+            "Time encoding response bodies, by query")
+        self.slow_queries = self.metrics.counter('db_slow_queries_total',
+            "Queries over slow_query_ms, by query")
+        self.cancelled_queries = self.metrics.counter('db_queries_cancelled_total',
+            "Queries cancelled before finishing, e.g. as every client waiting for them disconnected, by query")
+        self.client_rejections = self.metrics.counter('http_client_rejections_total',
+            "Requests refused with 429 as the client already had client_max_requests in progress, by route")
+        self.metrics.callback('coalesced_requests_total', "Cache misses answered by a build started for an "
+            "identical request", 'counter', lambda: [({}, self.coalescer.coalesced)])
+        caches = {'responses': self.response_cache, 'tiles': self.tile_cache, 'crashes': self.crash_cache}
+        for stat, type, help in (('hits', 'counter', "Cache hits"), ('misses', 'counter', "Cache misses"),
+                ('evictions', 'counter', "Entries evicted to stay under the size bound"),
+                ('hit_rate', 'gauge', "Hits over lookups since startup"),
+                ('entries', 'gauge', "Cached entries"), ('bytes', 'gauge', "Size of the cached bodies")):
+            name = f'cache_{stat}_total' if type == 'counter' else f'cache_{stat}'
+            self.metrics.callback(name, help + ", by cache", type,
+                lambda stat=stat: [({'cache': n}, c.stats()[stat]) for n, c in caches.items()])
+        self.metrics.callback('db_pool_connections', "Pool connections, by state", 'gauge',
+            lambda: [({'state': 'idle'}, self.pool.get_idle_size()),
+                ({'state': 'busy'}, self.pool.get_size() - self.pool.get_idle_size())])
+
+    '''
+    Called when an import finishes, see DATA_CHANGED_CHANNEL
+    '''
+    def on_data_changed(self, connection, pid, channel, payload):
+        logger.info("data_changed: clearing caches")
+        self.data_generation += 1
+        self.response_cache.clear()
+        self.tile_cache.clear()
+        self.crash_cache.clear()
+        self.crash_stats_loaded = None
+        if self.crash_index is not None:
+            self.loop.create_task(self.refresh_crash_index())
+
+    '''
+    (Re)loads the in-memory crash index. The previous index keeps answering
+    until the new one is built, then responses cached from it are dropped.
+    '''
+    async def refresh_crash_index(self):
+        from crash_index import CrashIndex
+
+        start = time.perf_counter()
+        self.crash_index = await CrashIndex.load(self.pool, self.loop)
+        self.data_generation += 1
+        self.response_cache.clear()
+        logger.info("crash_index loaded rows=%d seconds=%.1f", self.crash_index.size, time.perf_counter() - start)
+
+    '''
+    Runs a query returning a single value on a pool connection, recording the
+    wait for the connection and the query time under the name query. Slow
+    queries are explained in the background, see explain_slow_query.
+    '''
+    async def fetchval(self, query, sql, *args):
+        return await self.run_query(query, 'fetchval', sql, args)
+
+    '''
+    Same as fetchval for a query returning a single row
+    '''
+    async def fetchrow(self, query, sql, *args):
+        return await self.run_query(query, 'fetchrow', sql, args)
+
+    async def run_query(self, query, method, sql, args):
+        start = time.perf_counter()
+        try:
+            async with self.pool.acquire() as con:
+                acquired = time.perf_counter()
+                # Cancelling this sends Postgres a cancel request, and the
+                # connection is reset before going back to the pool
+                value = await getattr(con, method)(sql, *args)
+        except asyncio.CancelledError:
+            self.cancelled_queries.inc(query=query)
+            raise
+        elapsed = time.perf_counter() - acquired
+
+        self.db_acquire_seconds.observe(acquired - start, query=query)
+        self.db_query_seconds.observe(elapsed, query=query)
+        self.check_slow_query(query, elapsed, sql, args)
+        return value
+
+    def check_slow_query(self, query, elapsed, sql, args):
+        if self.slow_query_seconds is not None and elapsed >= self.slow_query_seconds:
+            self.slow_queries.inc(query=query)
+            self.loop.create_task(self.explain_slow_query(query, elapsed, sql, args))
+
+    '''
+    Logs the EXPLAIN (ANALYZE, BUFFERS) plan of a query that went over
+    slow_query_ms. This runs the query again, so it is opt-in.
+    '''
+    async def explain_slow_query(self, query, elapsed, sql, args):
+        try:
+            async with self.pool.acquire() as con:
+                plan = await con.fetch("EXPLAIN (ANALYZE, BUFFERS) " + sql, *args)
+        except Exception:
+            slow_query_logger.exception("slow_query query=%s ms=%.1f explain failed", query, elapsed * 1000)
+            return
+
+        slow_query_logger.warning("slow_query query=%s ms=%.1f args=%r\n%s", query, elapsed * 1000, args,
+            "\n".join(row[0] for row in plan))
+
+    '''
+    Prometheus metrics of this process, see the metrics module
+    '''
+    async def get_metrics(self, request):
+        return web.Response(text=self.metrics.render(), status=200,
+            headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+    '''
+    Hit/miss counters and sizes of the caches, to help size them
+    '''
+    async def cache_stats(self, request):
+        return web.json_response({
+            'responses': self.response_cache.stats(),
+            'tiles': self.tile_cache.stats(),
+            'crashes': self.crash_cache.stats(),
+        }, status=200)
 
     '''
     List crashes given filters and lat/long
@@ -37,70 +707,374 @@ class Webserver:
         "weather": [list of IDs],
         "day": True/False,
         "partialday": True/False,
-        "lit": True/False
+        "lit": True/False,
+        "lighting": ['daylight', 'darknesslit', 'darknessunlit', 'dawndusk'],
+        "aggregate": True/False,
+        "zoom": map zoom level,
+        "limit": page size,
+        "after": [severityindex, id]
     }
     If any fields are not used, they will not be filtered. This will return the top X number of records,
     ordered from least to most severe in JSON format.
+
+    If limit or after is given, the response is instead {"crashes": [...], "next": [severityindex, id]},
+    where next is null on the last page and otherwise is the "after" value for the next page.
+
+    If aggregate is true, crashes are instead bucketed into grid cells sized to the zoom level
+    (or the bounding box if no zoom is given) and a list of {"count", "severity", "location"}
+    is returned, where severity is the sum of the severity indexes and location the centroid.
+
+    With "query_engine": "memory" in settings.json the crashes come from the in-memory
+    crash_index.CrashIndex instead of Postgres, with the same responses.
+
+    Clients sending "Accept: application/vnd.crashmap.columns" get the same data in the
+    binary columnar encoding described in columnar.py instead of JSON. Either is gzip or
+    brotli compressed if the Accept-Encoding header allows it.
     '''
     async def list_crashes(self, request):
-        request_json = await request.json()
+        request_json = normalise_crash_request(await request.json())
+        columns = accepts_columns(request)
+
+        async def build():
+            conditions_compiled, condition_variables = compile_crash_filters(request_json)
+
+            if self.crash_index is not None:
+                # Filtering and encoding are not separate steps here
+                if request_json.get('aggregate'):
+                    with self.db_query_seconds.time(query='memory_list_crash_clusters'):
+                        return self.crash_index.list_crash_clusters(request_json,
+                            aggregate_cell_size(request_json), columns)
+                else:
+                    with self.db_query_seconds.time(query='memory_list_crash_points'):
+                        return self.crash_index.list_crash_points(request_json,
+                            request_json.get('limit', DEFAULT_PAGE_SIZE), columns)
+            elif request_json.get('aggregate'):
+                return await self.list_crash_clusters(request_json, conditions_compiled, condition_variables, columns)
+            else:
+                return await self.list_crash_points(request_json, conditions_compiled, condition_variables, columns)
+
+        key = filter_hash(dict(request_json, columns=columns))
+        return await self.cached_response(request, key, build,
+            columnar.COLUMNS_CONTENT_TYPE if columns else 'application/json')
+
+    '''
+    Response with the body cached under key, built by calling build on a miss.
+    Compressed variants of bodies large enough to be compressed are cached as
+    well, under (key, content coding), and only counted as part of key's lookup.
+    Identical requests arriving while the body is built wait for the same build.
+    '''
+    async def cached_response(self, request, key, build, content_type):
+        encoding = columnar.choose_encoding(request.headers.get('Accept-Encoding', ''))
+        headers = {'Vary': 'Accept, Accept-Encoding'}
+        generation = self.data_generation
+
+        body = self.response_cache.get(key)
+        if body is None:
+            body = await self.coalesce(key, self.response_cache, build)
+        elif encoding is not None and len(body) >= columnar.COMPRESS_MIN_BYTES:
+            compressed = self.response_cache.get((key, encoding), count=False)
+            if compressed is not None:
+                headers['Content-Encoding'] = encoding
+                return web.Response(body=compressed, status=200, content_type=content_type, headers=headers)
+
+        with self.serialisation_seconds.time(query='compress'):
+            compressed, coding = columnar.compress(body, encoding)
+        if coding is not None:
+            # Not for a body built from data that has changed since
+            if self.data_generation == generation:
+                self.response_cache.put((key, coding), compressed)
+            headers['Content-Encoding'] = coding
+
+        return web.Response(body=compressed, status=200, content_type=content_type, headers=headers)
+
+    '''
+    Builds the body cached under key in cache, sharing the build with identical
+    requests already waiting for it. A client disconnecting only cancels the
+    build, and with it the query, if it was the last one waiting.
+    '''
+    async def coalesce(self, key, cache, build):
+        generation = self.data_generation
+
+        async def build_and_cache():
+            body = await build()
+            # Caches cleared while building may have been answered from old data
+            if self.data_generation == generation:
+                cache.put(key, body)
+            return body
+
+        return await self.coalescer.run((generation, id(cache), key), build_and_cache)
+
+    '''
+    Top crashes by severity index matching the compiled filters, as JSON. Ties
+    are broken by ID so pages from the "after" cursor never overlap.
+    '''
+    async def list_crash_points(self, request_json, conditions_compiled, condition_variables, columns=False):
+        if columns:
+            return await self.list_crash_point_columns(request_json, conditions_compiled, condition_variables)
+
+        crashes_json = f"COALESCE(json_agg({CRASH_JSON} ORDER BY SeverityIndex DESC, ID DESC), '[]')"
+        limit_variable = f'${len(condition_variables) + 1}'
+
+        if 'limit' in request_json or 'after' in request_json:
+            select = f"""json_build_object(
+                'crashes', {crashes_json},
+                'next', CASE WHEN COUNT(*) = {limit_variable}
+                    THEN (array_agg(json_build_array(SeverityIndex, ID) ORDER BY SeverityIndex, ID))[1]
+                END
+            )"""
+        else:
+            select = crashes_json
+
+        sql = """
+        SELECT {select}::text
+        FROM (
+            SELECT ID, SeverityIndex, NearestAADT, Location
+            FROM CrashLocations
+            {where}
+            ORDER BY SeverityIndex DESC, ID DESC
+            LIMIT {limit}
+        ) AS crashes
+        """
+
+        sql = sql.format(select=select, limit=limit_variable,
+            where=conditions_compiled and "WHERE " + conditions_compiled or ' ')
+        condition_variables = condition_variables + [request_json.get('limit', DEFAULT_PAGE_SIZE)]
+
+        logger.debug("list_crash_points sql=%s args=%r", sql, condition_variables)
+
+        # The JSON is built by Postgres, so no per-row objects are created here
+        body = await self.fetchval('list_crash_points', sql, *condition_variables)
+
+        with self.serialisation_seconds.time(query='list_crash_points'):
+            return body.encode("utf-8")
+
+    '''
+    list_crash_points in the columnar encoding. Postgres returns one array per
+    column, so there are no per-row objects here either.
+    '''
+    async def list_crash_point_columns(self, request_json, conditions_compiled, condition_variables):
+        order = "ORDER BY SeverityIndex DESC, ID DESC"
+        sql = f"""
+        SELECT
+            array_agg(ID {order}),
+            array_agg(COALESCE(NearestAADT, -1) {order}),
+            array_agg(ST_X(Location::geometry) {order}),
+            array_agg(ST_Y(Location::geometry) {order}),
+            array_agg(SeverityIndex {order})
+        FROM (
+            SELECT ID, SeverityIndex, NearestAADT, Location
+            FROM CrashLocations
+            {conditions_compiled and "WHERE " + conditions_compiled or ' '}
+            {order}
+            LIMIT ${len(condition_variables) + 1}
+        ) AS crashes
+        """
+
+        limit = request_json.get('limit', DEFAULT_PAGE_SIZE)
+        row = await self.fetchrow('list_crash_point_columns', sql, *condition_variables, limit)
+        ids, nearest_aadts, longitudes, latitudes, severity_indexes = (column or [] for column in row)
+
+        next = None
+        if ('limit' in request_json or 'after' in request_json) and len(ids) == limit:
+            next = (severity_indexes[-1], ids[-1])
+
+        with self.serialisation_seconds.time(query='list_crash_point_columns'):
+            return columnar.encode_crashes(ids, nearest_aadts, longitudes, latitudes, severity_indexes, next)
+
+    '''
+    Stream every crash matching the filters
+
+    Same JSON Post request as list_crashes (aggregate, zoom and limit are ignored).
+    Returns newline delimited JSON, one crash per line in the same format as
+    list_crashes, ordered from most to least severe. The rows are read through a
+    server side cursor and written in chunks, so memory use does not depend on
+    the number of crashes. An interrupted download can be resumed by passing the
+    severityindex and id of the last crash received as "after".
+    '''
+    async def stream_crashes(self, request):
+        request_json = normalise_crash_request(await request.json())
+        request_json.pop('limit', None)
+        conditions_compiled, condition_variables = compile_crash_filters(request_json)
 
         sql = """
-        SELECT ID, SeverityIndex, NearestAADT, ST_Transform(Location::geometry, 4283)::geography AS Location
+        SELECT {crash}::text
         FROM CrashLocations
-        {}
-        ORDER BY SeverityIndex DESC
-        LIMIT 1000
+        {where}
+        ORDER BY SeverityIndex DESC, ID DESC
         """
+        sql = sql.format(crash=CRASH_JSON,
+            where=conditions_compiled and "WHERE " + conditions_compiled or ' ')
+
+        response = web.StreamResponse(status=200, headers={'Content-Type': 'application/x-ndjson'})
+        await response.prepare(request)
 
-        # List of tuples, with first value being the SQL, second being a list of arguments
-        conditions = []
+        start = time.perf_counter()
+        rows = 0
+        size = 0
+        try:
+            async with self.pool.acquire() as con:
+                acquired = time.perf_counter()
+                self.db_acquire_seconds.observe(acquired - start, query='stream_crashes')
 
-        # Boundaries
-        if 'corner1' in request_json and 'corner2' in request_json:
-            conditions.append(
-                ("ST_X(ST_Transform(Location::geometry, 4283)) <= {} AND ST_X(ST_Transform(Location::geometry, 4283)) >= {} AND ST_Y(ST_Transform(Location::geometry, 4283)) <= {} AND ST_Y(ST_Transform(Location::geometry, 4283)) >= {}",
-                    [request_json['corner2'][0], request_json['corner1'][0],
-                    request_json['corner2'][1], request_json['corner1'][1]]))
+                # Cursors only exist inside a transaction
+                async with con.transaction():
+                    lines = []
+                    async for row in con.cursor(sql, *condition_variables, prefetch=STREAM_BATCH_ROWS):
+                        lines.append(row[0])
+                        if len(lines) >= STREAM_BATCH_ROWS:
+                            chunk = ("\n".join(lines) + "\n").encode("utf-8")
+                            await response.write(chunk)
+                            rows += len(lines)
+                            size += len(chunk)
+                            lines = []
 
-        # Years
-        if 'yearmax' in request_json:
-            conditions.append(("EXTRACT(YEAR FROM CrashDate) <= {}",
-                [request_json['yearmax']]))
+                    if lines:
+                        chunk = ("\n".join(lines) + "\n").encode("utf-8")
+                        await response.write(chunk)
+                        rows += len(lines)
+                        size += len(chunk)
+        except asyncio.CancelledError:
+            # The client went away, rolling back closes the cursor
+            self.cancelled_queries.inc(query='stream_crashes')
+            raise
 
-        if 'yearmin' in request_json:
-            conditions.append(("EXTRACT(YEAR FROM CrashDate) >= {}",
-                [request_json['yearmin']]))
+        # Includes the time spent writing to the client
+        self.db_query_seconds.observe(time.perf_counter() - acquired, query='stream_crashes')
+        self.query_rows.observe(rows, query='stream_crashes')
+        self.response_bytes.observe(size, route='/stream_crashes')
 
-        conditions_compiled = "\nAND ".join([c[0] for c in conditions])
+        await response.write_eof()
+        return response
 
-        current_var = 1
-        condition_variables = []
-        for condition in conditions:
-            condition_variables.extend(condition[1])
-            current_var += len(condition[1])
+    '''
+    Aggregation mode of list_crashes. The number of cells returned is bounded by
+    AGGREGATE_MAX_CELLS_PER_SIDE squared regardless of how many crashes are in view.
+    '''
+    async def list_crash_clusters(self, request_json, conditions_compiled, condition_variables, columns=False):
+        if columns:
+            select = "array_agg(count), array_agg(severity), array_agg(x), array_agg(y)"
+        else:
+            select = """COALESCE(json_agg(json_build_object(
+            'count', count,
+            'severity', severity,
+            'location', json_build_array(x, y)
+        )), '[]')::text"""
+
+        sql = """
+        SELECT {select}
+        FROM (
+            SELECT
+                COUNT(*) AS count,
+                SUM(SeverityIndex) AS severity,
+                AVG(ST_X(Location::geometry)) AS x,
+                AVG(ST_Y(Location::geometry)) AS y
+            FROM CrashLocations
+            {}
+            GROUP BY
+                FLOOR(ST_X(Location::geometry) / {cell}),
+                FLOOR(ST_Y(Location::geometry) / {cell})
+        ) AS cells
+        """
 
-        conditions_compiled = conditions_compiled.format(*[f'${n}' for n in range(1, current_var)])
+        cell_variable = f'${len(condition_variables) + 1}'
+        sql = sql.format(conditions_compiled and "WHERE " + conditions_compiled or ' ',
+            select=select, cell=cell_variable)
 
-        sql = sql.format(conditions_compiled and "WHERE " + conditions_compiled or ' ')
+        if columns:
+            row = await self.fetchrow('list_crash_cluster_columns', sql, *condition_variables,
+                aggregate_cell_size(request_json))
+            with self.serialisation_seconds.time(query='list_crash_cluster_columns'):
+                return columnar.encode_cells(*(column or [] for column in row))
+
+        body = await self.fetchval('list_crash_clusters', sql, *condition_variables, aggregate_cell_size(request_json))
+
+        with self.serialisation_seconds.time(query='list_crash_clusters'):
+            return body.encode("utf-8")
+
+    '''
+    Mapbox Vector Tile of crashes
+
+    GET /tiles/{z}/{x}/{y}.mvt?filters=<JSON>
+
+    filters takes the same fields as list_crashes, except that the corners are
+    ignored as the tile defines the area. Below TILE_AGGREGATE_BELOW_ZOOM the tile
+    has a "clusters" layer with count and severity (sum of severity indexes) per
+    grid cell, otherwise a "crashes" layer with id, severityindex and nearestaadt.
+    '''
+    async def get_tile(self, request):
+        z = int(request.match_info['z'])
+        x = int(request.match_info['x'])
+        y = int(request.match_info['y'])
+
+        if z > 30 or x >= 2 ** z or y >= 2 ** z:
+            raise web.HTTPNotFound()
+
+        try:
+            filters = json.loads(request.query.get('filters', '{}'))
+        except ValueError:
+            raise web.HTTPBadRequest(text="filters must be JSON")
+        # The tile coordinates replace any viewport in the filters
+        filters = normalise_crash_request(filters)
+        filters.pop('corner1', None)
+        filters.pop('corner2', None)
+
+        key = (z, x, y, filter_hash(filters))
+        tile = self.tile_cache.get(key)
+        if tile is None:
+            tile = await self.coalesce(key, self.tile_cache, lambda: self.build_tile(z, x, y, filters))
+
+        return web.Response(body=tile, status=200,
+            content_type='application/vnd.mapbox-vector-tile',
+            headers={'Cache-Control': 'public, max-age=3600'})
+
+    '''
+    Encodes a single tile with ST_AsMVT. The tile envelope is transformed to the
+    storage SRID so the GiST index on Location::geometry is used.
+    '''
+    async def build_tile(self, z, x, y, filters):
+        conditions_compiled, condition_variables = compile_crash_filters(filters)
 
-        # Debugging
-        print(condition_variables)
-        print(conditions)
-        print(conditions_compiled)
-        print(sql)
-        # print([f'${n}' for n in range(1, current_var)])
+        if z < TILE_AGGREGATE_BELOW_ZOOM:
+            sql = """
+            WITH bounds AS (SELECT ST_TileEnvelope({z}, {x}, {y}) AS geom),
+            points AS (
+                SELECT SeverityIndex,
+                    ST_AsMVTGeom(ST_Transform(Location::geometry, 3857), bounds.geom, {extent}) AS geom
+                FROM CrashLocations, bounds
+                WHERE Location::geometry && ST_Transform(bounds.geom, 4283)
+                {conditions}
+            )
+            SELECT ST_AsMVT(tile, 'clusters', {extent}, 'geom') FROM (
+                SELECT
+                    COUNT(*)::integer AS count,
+                    SUM(SeverityIndex)::integer AS severity,
+                    ST_SnapToGrid(ST_Centroid(ST_Collect(geom)), 1) AS geom
+                FROM points
+                WHERE geom IS NOT NULL
+                GROUP BY ST_SnapToGrid(geom, {grid})
+            ) AS tile
+            """
+        else:
+            sql = """
+            WITH bounds AS (SELECT ST_TileEnvelope({z}, {x}, {y}) AS geom)
+            SELECT ST_AsMVT(tile, 'crashes', {extent}, 'geom') FROM (
+                SELECT ID AS id, SeverityIndex AS severityindex, NearestAADT AS nearestaadt,
+                    ST_AsMVTGeom(ST_Transform(Location::geometry, 3857), bounds.geom, {extent}) AS geom
+                FROM CrashLocations, bounds
+                WHERE Location::geometry && ST_Transform(bounds.geom, 4283)
+                {conditions}
+            ) AS tile
+            WHERE geom IS NOT NULL
+            """
 
-        async with self.pool.acquire() as con:
-            results = await con.fetch(sql, *condition_variables)
+        n = len(condition_variables)
+        sql = sql.format(z=f'${n + 1}', x=f'${n + 2}', y=f'${n + 3}',
+            extent=TILE_EXTENT, grid=TILE_EXTENT // TILE_CLUSTER_GRID,
+            conditions=conditions_compiled and "AND " + conditions_compiled or '')
 
-        parse_to_json = []
-        for result in results:
-            result = dict(result)
-            result['location'] = (result['location'].x, result['location'].y)
-            parse_to_json.append(result)
+        tile = await self.fetchval('build_tile', sql, *condition_variables, z, x, y)
 
-        return web.json_response(parse_to_json, status=200)
+        return tile or b''
 
     '''
     Get a specific crash by ID
@@ -112,13 +1086,35 @@ class Webserver:
     }
     id required
 
-    Returns all data with the same keys as the database.
+    Returns all data with the same keys as the database, with location as [long, lat] and the
+    names of the lookup IDs as severity, nature, type, roadwayfeature, trafficcontrol and
+    atmosphericcondition. Popular crashes are served from memory.
     '''
     async def get_crash(self, request):
-        pass
+        request_json = await request.json()
+        try:
+            crash_id = int(request_json['id'])
+        except (KeyError, TypeError, ValueError):
+            raise web.HTTPBadRequest(text="id is required")
+
+        body = self.crash_cache.get(crash_id)
+        if body is None:
+            async def build():
+                # The SQL never changes, so asyncpg's statement cache keeps it
+                # prepared on every pool connection.
+                body = await self.fetchval('get_crash', GET_CRASH_SQL, crash_id)
+
+                if body is None:
+                    raise web.HTTPNotFound(text=f"No crash with id {crash_id}")
+
+                return body.encode("utf-8")
+
+            body = await self.coalesce(crash_id, self.crash_cache, build)
+
+        return web.Response(body=body, status=200, content_type='application/json')
 
     '''
-    List crashes given filters and lat/long
+    List census sites given filters and lat/long
 
     JSON Post request with format:
 
@@ -131,54 +1127,323 @@ class Webserver:
     }
 
     Returns a list of the top X most used census sites. If onlylatest is true, only the most recent data at that site is sent.
-    The returned values are
+    The returned values are id, siteid, year, aadt, pcnthv and location as [long, lat], ordered by aadt.
+
+    With onlylatest and no yearmax the sites come from the LatestCensusLocations materialized view,
+    otherwise the most recent record up to yearmax is picked per site.
     '''
     async def list_census_sites(self, request):
-        pass
+        request_json = await request.json()
+
+        normalised = {k: v for k, v in normalise_crash_request(request_json).items()
+            if k in ('corner1', 'corner2', 'yearmin', 'yearmax')}
+        normalised['census'] = True
+        normalised['onlylatest'] = bool(request_json.get('onlylatest'))
+
+        key = filter_hash(normalised)
+        body = self.response_cache.get(key)
+        if body is None:
+            async def build():
+                conditions_compiled, condition_variables = compile_census_filters(normalised)
+                where = conditions_compiled and "WHERE " + conditions_compiled or ' '
+
+                if normalised['onlylatest'] and 'yearmax' not in normalised:
+                    sites = f"SELECT * FROM LatestCensusLocations {where}"
+                elif normalised['onlylatest']:
+                    sites = f"""
+                    SELECT DISTINCT ON (SiteID) * FROM CensusLocations {where}
+                    ORDER BY SiteID, Year DESC, ID DESC
+                    """
+                else:
+                    sites = f"SELECT * FROM CensusLocations {where}"
+
+                sql = """
+                SELECT COALESCE(json_agg(json_build_object(
+                    'id', ID,
+                    'siteid', SiteID,
+                    'year', Year,
+                    'aadt', AADT,
+                    'pcnthv', PcntHV,
+                    'location', json_build_array(ST_X(Location::geometry), ST_Y(Location::geometry))
+                ) ORDER BY AADT DESC), '[]')::text
+                FROM (
+                    {}
+                    ORDER BY AADT DESC
+                    LIMIT 1000
+                ) AS sites
+                """.format(sites)
+
+                body = await self.fetchval('list_census_sites', sql, *condition_variables)
+                with self.serialisation_seconds.time(query='list_census_sites'):
+                    return body.encode("utf-8")
+
+            body = await self.coalesce(key, self.response_cache, build)
+
+        return web.Response(body=body, status=200, content_type='application/json')
+
+    '''
+    Crash totals grouped by any of the dimensions of the CrashStats summary table
+
+    JSON Post request with format:
+
+    {
+        "groupby": ["year", "council", "severity", "nature", "type", "car", "motorcycle", "truck", "bus", "bicycle",
+            "pedestrian", "other"],
+        "yearmax": year,
+        "yearmin": year,
+        "severity": [severity IDs],
+        "nature": [nature IDs],
+        "type": [type IDs],
+        "council": [council names],
+        "motorcycle": True/False, (same for car, truck, bus, bicycle, pedestrian, other)
+    }
+
+    Returns {"source": "crashes", "stats": [...]} with one object per group holding the groupby values and
+    crashes, fatalities, hospitalised, medicallytreated, minorinjury and casualties, ordered by the groupby values.
+
+    While no crashes have been imported the bundled vehicle_crashes_by_type.json rollup is used instead and source
+    is "rollup". It can only be grouped by year, region (police region), severity, motorcycle, truck and bus, and
+    filtered by those plus a "region" list.
+    '''
+    async def stats(self, request):
+        request_json = await request.json()
+
+        if self.crash_stats_loaded is None:
+            self.crash_stats_loaded = await self.fetchval('stats_loaded', "SELECT EXISTS (SELECT 1 FROM CrashStats)")
+
+        if self.crash_stats_loaded:
+            normalised = normalise_stats_request(request_json, STATS_GROUP_COLUMNS)
+        else:
+            normalised = normalise_stats_request(request_json, STATS_ROLLUP_DIMENSIONS)
+            normalised['rollup'] = True
+
+        key = filter_hash(normalised)
+        body = self.response_cache.get(key)
+        if body is None:
+            async def build():
+                if self.crash_stats_loaded:
+                    conditions_compiled, condition_variables = compile_stats_filters(normalised)
+                    groupby = normalised['groupby']
+                    columns = [f"{STATS_GROUP_COLUMNS[g]} AS {g}" for g in groupby]
+                    columns += [f"{sql} AS {measure}" for measure, sql in STATS_MEASURES.items()]
+                    positions = ", ".join(str(i) for i in range(1, len(groupby) + 1))
+
+                    sql = STATS_SQL.format(columns=",\n        ".join(columns),
+                        where=conditions_compiled and "WHERE " + conditions_compiled or '',
+                        group=groupby and f"GROUP BY {positions}\n    ORDER BY {positions}" or '')
+
+                    stats = await self.fetchval('stats', sql, *condition_variables)
+                    with self.serialisation_seconds.time(query='stats'):
+                        return f'{{"source": "crashes", "stats": {stats}}}'.encode("utf-8")
+                else:
+                    if self.stats_rollup is None:
+                        self.stats_rollup = load_stats_rollup()
+                    stats = aggregate_stats_rollup(self.stats_rollup, normalised)
+                    with self.serialisation_seconds.time(query='stats_rollup'):
+                        return json.dumps({'source': 'rollup', 'stats': stats}).encode("utf-8")
+
+            body = await self.coalesce(key, self.response_cache, build)
+
+        return web.Response(body=body, status=200, content_type='application/json')
+
+    '''
+    Records the latency of every request by route, and the size of in-memory
+    response bodies (streamed ones record their own)
+    '''
+    @web.middleware
+    async def metrics_middleware(self, request, handler):
+        resource = request.match_info.route.resource
+        route = resource.canonical if resource is not None else 'unmatched'
+        status = 500
+        start = time.perf_counter()
+        try:
+            response = await handler(request)
+            status = response.status
+            if isinstance(response, web.Response) and isinstance(response.body, bytes):
+                self.response_bytes.observe(len(response.body), route=route)
+            return response
+        except web.HTTPException as e:
+            status = e.status
+            raise
+        finally:
+            self.request_seconds.observe(time.perf_counter() - start, route=route,
+                method=request.method, status=status)
+
+    '''
+    Refuses requests with 429 Too Many Requests while the same client already
+    has client_max_requests in progress, so one client cannot hold every pool
+    connection. Clients are told apart by client_address, see there.
+    '''
+    @web.middleware
+    async def client_limit_middleware(self, request, handler):
+        resource = request.match_info.route.resource
+        route = resource.canonical if resource is not None else 'unmatched'
+        if self.client_max_requests is None or route in UNLIMITED_ROUTES:
+            return await handler(request)
+
+        client = client_address(request)
+        in_progress = self.client_requests.get(client, 0)
+        if in_progress >= self.client_max_requests:
+            self.client_rejections.inc(route=route)
+            raise web.HTTPTooManyRequests(text="Too many requests in progress", headers={'Retry-After': '1'})
+
+        self.client_requests[client] = in_progress + 1
+        try:
+            return await handler(request)
+        finally:
+            self.client_requests[client] -= 1
+            if not self.client_requests[client]:
+                del self.client_requests[client]
 
     '''
     Build the web server and setup routes
     '''
-    async def build_server(self, address, port):
-        app = web.Application(loop=self.loop)
+    async def build_server(self, address, port, reuse_port=False):
+        app = web.Application(middlewares=[self.metrics_middleware, self.client_limit_middleware])
         app.router.add_route('POST', "/list_crashes", self.list_crashes)
-        app.router.add_route('POST', "/get_crash", self.list_crashes)
-        app.router.add_route('POST', "/list_census_sites", self.list_crashes)
+        app.router.add_route('POST', "/stream_crashes", self.stream_crashes)
+        app.router.add_route('POST', "/get_crash", self.get_crash)
+        app.router.add_route('POST', "/list_census_sites", self.list_census_sites)
+        app.router.add_route('POST', "/stats", self.stats)
+        app.router.add_route('GET', r"/tiles/{z:\d+}/{x:\d+}/{y:\d+}.mvt", self.get_tile)
+        app.router.add_route('GET', "/cache_stats", self.cache_stats)
+        app.router.add_route('GET', "/metrics", self.get_metrics)
 
-        return await self.loop.create_server(app.make_handler(), address, port)
+        # On shutdown requests in progress get shutdown_timeout seconds to finish. A
+        # client disconnecting cancels its handler, and with it any query it waits for.
+        self.runner = web.AppRunner(app, shutdown_timeout=settings.get('shutdown_timeout', 30),
+            handler_cancellation=True)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, address, port, reuse_port=reuse_port)
+        await site.start()
 
-async def start_webserver(loop):
-    async def init_connection(conn):
-        def encode_geometry(geometry):
-            if not hasattr(geometry, '__geo_interface__'):
-                raise TypeError('{g} does not conform to '
-                                'the geo interface'.format(g=geometry))
-            shape = shapely.geometry.asShape(geometry)
-            return shapely.wkb.dumps(shape)
+    '''
+    Stops accepting connections, waits for the requests in progress and closes
+    the database connections
+    '''
+    async def stop(self):
+        await self.runner.cleanup()
+        if self.listener is not None:
+            await self.listener.close()
+        await self.pool.close()
 
-        def decode_geometry(wkb):
-            return shapely.wkb.loads(wkb)
+'''
+Connection arguments for asyncpg from settings.json. The pool sizes, the
+per-connection prepared statement cache and the default query timeout (in
+seconds, none unless set) can be tuned there as well.
+'''
+def connection_settings():
+    return dict(user=settings['psql_user'], password=settings['psql_pass'],
+        database=settings['psql_dbname'], host=settings['psql_host'],
+        statement_cache_size=settings.get('statement_cache_size', 100),
+        command_timeout=settings.get('command_timeout'))
 
-        await conn.set_type_codec(
-            'geography',
-            encoder=encode_geometry,
-            decoder=decode_geometry,
-            format='binary',
-        )
+'''
+(min_size, max_size) of the pool of each of workers processes. Unless
+pool_max_size is set, db_connection_budget (default DB_CONNECTION_BUDGET) is
+split between the workers, less their LISTEN connections, and capped at
+DEFAULT_POOL_MAX_SIZE. Pools start with pool_min_size connections (default 1)
+and grow as needed.
+'''
+def pool_sizes(workers):
+    max_size = settings.get('pool_max_size')
+    if max_size is None:
+        budget = settings.get('db_connection_budget', DB_CONNECTION_BUDGET)
+        max_size = max(min(budget // workers - 1, DEFAULT_POOL_MAX_SIZE), 1)
+    return min(settings.get('pool_min_size', 1), max_size), max_size
 
-    pool = await asyncpg.create_pool(user=settings['psql_user'], password=settings['psql_pass'],
-        database=settings['psql_dbname'], host=settings['psql_host'], init=init_connection)
+async def start_webserver(loop, address='localhost', port=9999, reuse_port=False, workers=1):
+    min_size, max_size = pool_sizes(workers)
+    pool = await asyncpg.create_pool(**connection_settings(), min_size=min_size, max_size=max_size,
+        max_inactive_connection_lifetime=settings.get('pool_max_inactive_connection_lifetime', 300))
 
     webserver = Webserver(pool, loop)
-    await webserver.build_server('localhost', 9999)
+    if settings.get('query_engine', 'postgres') == 'memory':
+        await webserver.refresh_crash_index()
+    await webserver.build_server(address, port, reuse_port)
+
+    # Dedicated connection, as listeners stop when a connection goes back to the pool
+    webserver.listener = await asyncpg.connect(**connection_settings())
+    await webserver.listener.add_listener(DATA_CHANGED_CHANNEL, webserver.on_data_changed)
+
+    return webserver
+
+'''
+Runs one server process until SIGINT or SIGTERM, then shuts it down gracefully
+'''
+def run_worker(address, port, reuse_port=False, workers=1):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    webserver = loop.run_until_complete(start_webserver(loop, address, port, reuse_port, workers))
+    logger.info("server ready address=%s port=%d", address, port)
+
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, loop.stop)
+    loop.run_forever()
+
+    # Further signals, e.g. the SIGTERM run_prefork passes on after a Ctrl-C
+    # already reached the whole process group, must not cut the shutdown short
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, logger.info, "already shutting down")
+    logger.info("shutting down")
+    loop.run_until_complete(webserver.stop())
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.remove_signal_handler(signum)
+    loop.close()
+
+'''
+Forks a worker per CPU (or as many as asked for), all listening on the same
+port with SO_REUSEPORT so the kernel spreads connections between them. Every
+worker has its own pool and caches. SIGINT or SIGTERM to the parent is passed
+on to the workers, and the parent exits once they have all finished.
+'''
+def run_prefork(address, port, workers):
+    children = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            # Never return into the parent's code, exit with the worker's status
+            try:
+                run_worker(address, port, reuse_port=True, workers=workers)
+                os._exit(0)
+            except BaseException:
+                traceback.print_exc()
+                os._exit(1)
+        children.append(pid)
+
+    def stop_children(signum, frame):
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop_children)
+    signal.signal(signal.SIGTERM, stop_children)
+
+    for pid in children:
+        os.waitpid(pid, 0)
 
 if __name__ == '__main__':
-    loop = asyncio.get_event_loop()
-    loop.run_until_complete(start_webserver(loop))
-    print("Server ready!")
+    parser = argparse.ArgumentParser(description="Road crash API server")
+    parser.add_argument('--host', default=settings.get('host', 'localhost'),
+        help="address to listen on (default: host in settings.json or localhost)")
+    parser.add_argument('--port', type=int, default=settings.get('port', 9999),
+        help="port to listen on (default: port in settings.json or 9999)")
+    parser.add_argument('--workers', type=int, default=settings.get('workers', 1),
+        help="server processes sharing the port, 0 for one per CPU (default: workers in settings.json or 1)")
+    args = parser.parse_args()
 
-    try:
-        loop.run_forever()
-    except KeyboardInterrupt:
-        print("Shutting Down!")
-        loop.close()
\ No newline at end of file
+    logging.basicConfig(level=settings.get('log_level', 'INFO'),
+        format="%(asctime)s %(levelname)s pid=%(process)d %(name)s %(message)s")
+
+    workers = args.workers or os.cpu_count() or 1
+    connections = workers * (pool_sizes(workers)[1] + 1)
+    logger.info("workers=%d database connections up to %d", workers, connections)
+    if connections > settings.get('db_connection_budget', DB_CONNECTION_BUDGET):
+        logger.warning("%d workers can open %d database connections, over db_connection_budget; "
+            "check max_connections in Postgres", workers, connections)
+    if workers > 1:
+        run_prefork(args.host, args.port, workers)
+    else:
+        run_worker(args.host, args.port)
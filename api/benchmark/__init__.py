@@ -0,0 +1,5 @@
+'''
+Benchmarks for the API server and the importer.
+
+Run from the api directory, e.g. python -m benchmark.list_crashes
+'''
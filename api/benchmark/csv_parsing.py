@@ -0,0 +1,51 @@
+'''
+Throughput of import_data.read_csv_batches on a synthetic crash CSV, compared
+with the previous line-by-line split(',') parser.
+
+Usage: python -m benchmark.csv_parsing [rows] [path]
+'''
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+import import_data
+from benchmark.synthetic import write_crash_csv
+
+async def parse_batches(path):
+    num = 0
+    async for columns, rows in import_data.read_csv_batches(path):
+        num += len(rows)
+    return num
+
+async def parse_split_lines(path):
+    num = 0
+    keys = None
+    with open(path, 'rb') as f:
+        for line in f:
+            dataline = line.decode("utf-8").strip().split(',')
+            if keys == None:
+                keys = dataline
+            else:
+                data = dict(zip(keys, dataline))
+                num += 1
+    return num
+
+async def run(rows, path):
+    if not os.path.exists(path):
+        print(f"Writing {rows} rows to {path}")
+        write_crash_csv(path, rows)
+    size_mb = os.path.getsize(path) / 1e6
+
+    for name, parse in (("read_csv_batches", parse_batches), ("split lines", parse_split_lines)):
+        start = time.perf_counter()
+        num = await parse(path)
+        elapsed = time.perf_counter() - start
+        print(f"{name:>16}: {num} rows in {elapsed:.2f}s, "
+            f"{num / elapsed:,.0f} rows/sec, {size_mb / elapsed:.1f} MB/s")
+
+if __name__ == '__main__':
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 2000000
+    path = sys.argv[2] if len(sys.argv) > 2 else os.path.join(tempfile.gettempdir(), f"crashes_{rows}.csv")
+    asyncio.get_event_loop().run_until_complete(run(rows, path))
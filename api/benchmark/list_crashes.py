@@ -0,0 +1,51 @@
+'''
+Measures list_crashes latency against a running API server at a few
+representative map zoom levels.
+
+Usage: python -m benchmark.list_crashes [url] [iterations]
+'''
+import asyncio
+import aiohttp
+import sys
+import time
+
+DEFAULT_URL = "http://localhost:9999/list_crashes"
+
+# corner1/corner2 as sent by index.js, [long, lat]
+ZOOM_LEVELS = {
+    "statewide": ([137.9, -29.2], [153.6, -10.0]),
+    "city": ([152.85, -27.65], [153.25, -27.30]),
+    "suburb": ([153.02, -27.47], [153.05, -27.45]),
+}
+
+'''
+Returns the value at the given percentile (0-100) of a sorted list
+'''
+def percentile(sorted_values, pct):
+    index = round(pct / 100 * (len(sorted_values) - 1))
+    return sorted_values[index]
+
+async def time_requests(session, url, body, iterations):
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        async with session.post(url, json=body) as r:
+            await r.read()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return timings
+
+async def run(url, iterations):
+    async with aiohttp.ClientSession(raise_for_status=True) as session:
+        for name, (corner1, corner2) in ZOOM_LEVELS.items():
+            body = {"corner1": corner1, "corner2": corner2}
+            # Warm up the connection pool and Postgres caches
+            await time_requests(session, url, body, 3)
+            timings = await time_requests(session, url, body, iterations)
+            print(f"{name:>10}: p50 {percentile(timings, 50):8.2f} ms  "
+                f"p99 {percentile(timings, 99):8.2f} ms  ({iterations} requests)")
+
+if __name__ == '__main__':
+    url = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_URL
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    asyncio.get_event_loop().run_until_complete(run(url, iterations))
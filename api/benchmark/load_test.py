@@ -0,0 +1,82 @@
+'''
+Requests/sec of list_crashes as the number of server workers grows. For each
+worker count the API server is started on its own port, loaded with
+concurrent requests for random viewports (so most miss the response cache)
+for a fixed time, then stopped. Needs the database from settings.json.
+
+The load is generated from this process, so on small machines the client can
+become the bottleneck before the server does; compare the p50 latency too.
+
+Usage: python -m benchmark.load_test [workers,...] [seconds] [connections]
+'''
+import asyncio
+import aiohttp
+import random
+import subprocess
+import sys
+import time
+
+from benchmark.list_crashes import percentile
+
+PORT = 9998
+STARTUP_TIMEOUT = 60
+
+'''
+A bounding box of a random size somewhere over south east Queensland
+'''
+def random_viewport(rng):
+    span = rng.choice((0.02, 0.1, 0.4, 1.5))
+    x = rng.uniform(151.5, 153.5 - span)
+    y = rng.uniform(-28.2, -26.0 - span)
+    return {"corner1": [x, y], "corner2": [x + span, y + span]}
+
+async def wait_until_up(session, url):
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while True:
+        try:
+            async with session.get(url) as r:
+                await r.read()
+                return
+        except aiohttp.ClientConnectionError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.2)
+
+async def client(session, url, rng, deadline, timings):
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        async with session.post(url, json=random_viewport(rng)) as r:
+            await r.read()
+        timings.append((time.perf_counter() - start) * 1000)
+
+async def measure(workers, seconds, connections):
+    server = subprocess.Popen([sys.executable, "api_server.py", "--port", str(PORT), "--workers", str(workers)])
+    try:
+        connector = aiohttp.TCPConnector(limit=connections)
+        async with aiohttp.ClientSession(connector=connector, raise_for_status=True) as session:
+            await wait_until_up(session, f"http://localhost:{PORT}/cache_stats")
+
+            timings = []
+            deadline = time.monotonic() + seconds
+            start = time.perf_counter()
+            await asyncio.gather(*[client(session, f"http://localhost:{PORT}/list_crashes",
+                random.Random(n), deadline, timings) for n in range(connections)])
+            elapsed = time.perf_counter() - start
+    finally:
+        # SIGTERM shuts the workers down gracefully
+        server.terminate()
+        server.wait()
+
+    timings.sort()
+    print(f"{workers:>3} workers: {len(timings) / elapsed:8.1f} req/s  "
+        f"p50 {percentile(timings, 50):8.2f} ms  p99 {percentile(timings, 99):8.2f} ms")
+
+async def run(worker_counts, seconds, connections):
+    for workers in worker_counts:
+        await measure(workers, seconds, connections)
+
+if __name__ == '__main__':
+    worker_counts = [int(n) for n in sys.argv[1].split(',')] if len(sys.argv) > 1 else [1, 2, 4]
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 10
+    connections = int(sys.argv[3]) if len(sys.argv) > 3 else 32
+    asyncio.get_event_loop().run_until_complete(run(worker_counts, seconds, connections))
@@ -0,0 +1,74 @@
+'''
+Compares list_crashes on the Postgres path against the in-memory
+crash_index.CrashIndex for the same requests, without HTTP in between. Needs
+the database from settings.json with crashes imported.
+
+Usage: python -m benchmark.query_engine [iterations]
+'''
+import asyncio
+import asyncpg
+import json
+import sys
+import time
+
+from api_server import (DEFAULT_PAGE_SIZE, Webserver, aggregate_cell_size, compile_crash_filters,
+    normalise_crash_request, settings)
+from benchmark.list_crashes import ZOOM_LEVELS, percentile
+from crash_index import CrashIndex
+
+REQUESTS = {}
+for zoom_name, (corner1, corner2) in ZOOM_LEVELS.items():
+    REQUESTS[zoom_name] = {"corner1": corner1, "corner2": corner2}
+REQUESTS["city, fatal since 2015"] = dict(REQUESTS["city"], severity=[1], yearmin=2015)
+REQUESTS["statewide, bicycles, dry"] = dict(REQUESTS["statewide"], vehicle_types=["bicycle"], dry=True)
+REQUESTS["statewide, page 2"] = dict(REQUESTS["statewide"], limit=1000, after=[50, 0])
+REQUESTS["statewide, aggregate"] = dict(REQUESTS["statewide"], aggregate=True, zoom=6)
+
+async def time_calls(call, iterations):
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        await call()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return timings
+
+async def run(iterations):
+    pool = await asyncpg.create_pool(user=settings['psql_user'], password=settings['psql_pass'],
+        database=settings['psql_dbname'], host=settings['psql_host'])
+    webserver = Webserver(pool, asyncio.get_event_loop())
+
+    start = time.perf_counter()
+    index = await CrashIndex.load(pool, asyncio.get_event_loop())
+    print(f"Loaded {index.size} crashes in {time.perf_counter() - start:.1f}s")
+
+    for name, request_json in REQUESTS.items():
+        request_json = normalise_crash_request(request_json)
+        conditions_compiled, condition_variables = compile_crash_filters(request_json)
+
+        if request_json.get('aggregate'):
+            async def postgres():
+                return await webserver.list_crash_clusters(request_json, conditions_compiled, condition_variables)
+            async def memory():
+                return index.list_crash_clusters(request_json, aggregate_cell_size(request_json))
+        else:
+            async def postgres():
+                return await webserver.list_crash_points(request_json, conditions_compiled, condition_variables)
+            async def memory():
+                return index.list_crash_points(request_json, request_json.get('limit', DEFAULT_PAGE_SIZE))
+
+        # Same rows in the same order, the JSON formatting differs
+        if not request_json.get('aggregate') and json.loads(await postgres()) != json.loads(await memory()):
+            print(f"{name:>26}: responses differ")
+
+        await time_calls(postgres, 3)
+        results = [(engine, await time_calls(call, iterations)) for engine, call in
+            (("postgres", postgres), ("memory", memory))]
+        print(f"{name:>26}: " + "  ".join(f"{engine} p50 {percentile(timings, 50):8.2f} ms "
+            f"p99 {percentile(timings, 99):8.2f} ms" for engine, timings in results))
+
+    await pool.close()
+
+if __name__ == '__main__':
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    asyncio.get_event_loop().run_until_complete(run(iterations))
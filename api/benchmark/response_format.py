@@ -0,0 +1,60 @@
+'''
+Size and encoding time of a list_crashes response as JSON and in the columnar
+encoding, raw and compressed, for synthetic crashes. Needs no database.
+
+Usage: python -m benchmark.response_format [crashes,...]
+'''
+import gzip
+import json
+import random
+import sys
+import time
+
+import columnar
+from benchmark.synthetic import SEVERITY_WEIGHTS, random_location
+
+def synthetic_columns(count, seed=0):
+    rng = random.Random(seed)
+    ids, nearest_aadts, longitudes, latitudes, severity_indexes = [], [], [], [], []
+    for n in range(count):
+        _, _, _, longitude, latitude = random_location(rng)
+        ids.append(n + 1)
+        nearest_aadts.append(rng.choice((-1, rng.randint(100, 120000))))
+        longitudes.append(longitude)
+        latitudes.append(latitude)
+        severity_indexes.append(rng.choices(range(1, len(SEVERITY_WEIGHTS) + 1), SEVERITY_WEIGHTS)[0] * 10)
+    return ids, nearest_aadts, longitudes, latitudes, severity_indexes
+
+def encode_json(ids, nearest_aadts, longitudes, latitudes, severity_indexes):
+    return json.dumps([{
+        'id': crash_id,
+        'severityindex': severity_index,
+        'nearestaadt': None if nearest_aadt < 0 else nearest_aadt,
+        'location': [x, y],
+    } for crash_id, severity_index, nearest_aadt, x, y in zip(
+        ids, severity_indexes, nearest_aadts, longitudes, latitudes)]).encode("utf-8")
+
+def timed(call):
+    start = time.perf_counter()
+    result = call()
+    return result, (time.perf_counter() - start) * 1000
+
+def run(counts):
+    codings = [('gzip', lambda body: gzip.compress(body, compresslevel=6))]
+    if columnar.brotli is not None:
+        codings.append(('br', lambda body: columnar.brotli.compress(body, quality=5)))
+
+    for count in counts:
+        columns = synthetic_columns(count)
+        for name, encode, decode in (
+                ("json", lambda: encode_json(*columns), json.loads),
+                ("columns", lambda: columnar.encode_crashes(*columns), columnar.decode)):
+            body, encode_ms = timed(encode)
+            _, decode_ms = timed(lambda: decode(body))
+            sizes = "  ".join(f"{coding} {len(compress(body)) / 1024:9.1f} KiB" for coding, compress in codings)
+            print(f"{count:>8} crashes {name:>8}: raw {len(body) / 1024:9.1f} KiB  {sizes}  "
+                f"encode {encode_ms:8.2f} ms  decode {decode_ms:8.2f} ms")
+
+if __name__ == '__main__':
+    counts = [int(n) for n in sys.argv[1].split(',')] if len(sys.argv) > 1 else [1000, 10000, 100000]
+    run(counts)
@@ -0,0 +1,157 @@
+'''
+The list_crashes response path before (rows fetched with a Shapely geography
+codec, a dict per row, serialised with json) and after (JSON built by
+Postgres with json_agg, only encoded here).
+
+With --database both paths run end to end against the database in
+settings.json, which needs crashes imported: query, transfer, decoding and
+encoding. For each zoom level of benchmark.list_crashes this reports the wall
+time per response, the CPU time spent in this process (the handler's share:
+asyncpg decoding rows or the JSON text, Shapely, json.dumps, encoding) and the
+rest, which is time waiting on Postgres and the connection.
+
+Without it only the Python side is timed on synthetic rows, with the JSON text
+built ahead of time. That leaves out the json_agg work moved into Postgres and
+receiving the text, so the "after" figure there is not a response time.
+
+Usage: python -m benchmark.serialisation [--database] [--rows N] [--iterations N]
+'''
+import argparse
+import asyncio
+import asyncpg
+import json
+import random
+import struct
+import time
+import tracemalloc
+
+import shapely.wkb
+
+from api_server import DEFAULT_PAGE_SIZE, Webserver, compile_crash_filters, normalise_crash_request, settings
+from benchmark.list_crashes import ZOOM_LEVELS
+
+# The list_crashes query before the JSON moved into Postgres
+BEFORE_SQL = """
+SELECT ID AS id, SeverityIndex AS severityindex, NearestAADT AS nearestaadt, Location AS location
+FROM CrashLocations
+{where}
+ORDER BY SeverityIndex DESC, ID DESC
+LIMIT {limit}
+"""
+
+'''
+Rows as asyncpg returned them before: location as WKB, decoded by the
+geography codec the server used to register
+'''
+def make_rows(rows):
+    rng = random.Random(0)
+    return [{
+        'id': i,
+        'severityindex': rng.randint(1, 100),
+        'nearestaadt': rng.randint(100, 50000),
+        'location': struct.pack('<BIdd', 1, 1, rng.uniform(138.0, 153.5), rng.uniform(-29.0, -10.7)),
+    } for i in range(rows)]
+
+def before(rows):
+    parse_to_json = []
+    for row in rows:
+        result = dict(row)
+        location = result['location']
+        if isinstance(location, bytes):
+            location = shapely.wkb.loads(location)
+        result['location'] = (location.x, location.y)
+        parse_to_json.append(result)
+    return json.dumps(parse_to_json).encode("utf-8")
+
+def after(body):
+    return body.encode("utf-8")
+
+'''
+Returns the CPU time per call in ms and the allocated blocks and peak bytes
+of a single call
+'''
+def measure(function, argument, iterations):
+    start = time.process_time()
+    for _ in range(iterations):
+        function(argument)
+    cpu_ms = (time.process_time() - start) * 1000 / iterations
+
+    tracemalloc.start()
+    before_blocks = len(tracemalloc.take_snapshot().traces)
+    result = function(argument)
+    blocks = len(tracemalloc.take_snapshot().traces) - before_blocks
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return cpu_ms, blocks, peak
+
+def python_side(num_rows, iterations):
+    rows = make_rows(num_rows)
+    # What json_agg in list_crash_points hands back
+    postgres_json = json.dumps([{**row, 'location': list(shapely.wkb.loads(row['location']).coords[0])}
+        for row in rows])
+
+    print(f"Python side only, {num_rows} synthetic rows (excludes Postgres and the transfer):")
+    for name, function, argument in (("before", before, rows), ("after", after, postgres_json)):
+        cpu_ms, blocks, peak = measure(function, argument, iterations)
+        print(f"{name:>6}: {cpu_ms:8.3f} ms CPU per response, {blocks} live blocks, {peak / 1024:.0f} KiB peak")
+
+'''
+Returns the mean wall time and CPU time of this process per call of call, in ms
+'''
+async def time_end_to_end(call, iterations):
+    await call()
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    for _ in range(iterations):
+        await call()
+    return ((time.perf_counter() - wall_start) * 1000 / iterations,
+        (time.process_time() - cpu_start) * 1000 / iterations)
+
+async def end_to_end(iterations):
+    connection = dict(user=settings['psql_user'], password=settings['psql_pass'],
+        database=settings['psql_dbname'], host=settings['psql_host'])
+
+    # One connection each, so the codec of the old path does not apply to the new one
+    old_connection = await asyncpg.connect(**connection)
+    await old_connection.set_type_codec('geography', encoder=shapely.wkb.dumps, decoder=shapely.wkb.loads,
+        format='binary')
+    pool = await asyncpg.create_pool(**connection, min_size=1, max_size=1)
+    webserver = Webserver(pool, asyncio.get_event_loop())
+
+    print(f"End to end, up to {DEFAULT_PAGE_SIZE} crashes per response from {settings['psql_dbname']}:")
+    for zoom_name, (corner1, corner2) in ZOOM_LEVELS.items():
+        request_json = normalise_crash_request({"corner1": corner1, "corner2": corner2})
+        conditions_compiled, condition_variables = compile_crash_filters(request_json)
+
+        sql = BEFORE_SQL.format(where=conditions_compiled and "WHERE " + conditions_compiled or ' ',
+            limit=f'${len(condition_variables) + 1}')
+
+        async def old_path():
+            return before(await old_connection.fetch(sql, *condition_variables, DEFAULT_PAGE_SIZE))
+
+        async def new_path():
+            return await webserver.list_crash_points(request_json, conditions_compiled, condition_variables)
+
+        for name, call in (("before", old_path), ("after", new_path)):
+            wall_ms, cpu_ms = await time_end_to_end(call, iterations)
+            print(f"{zoom_name:>10} {name:>6}: {wall_ms:8.2f} ms per response, {cpu_ms:8.2f} ms handler CPU, "
+                f"{max(wall_ms - cpu_ms, 0):8.2f} ms waiting on Postgres")
+
+    await old_connection.close()
+    await pool.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare the list_crashes serialisation before and after "
+        "the JSON was built in Postgres")
+    parser.add_argument('--database', action='store_true',
+        help="run both paths end to end against the database in settings.json")
+    parser.add_argument('--rows', type=int, default=1000,
+        help="synthetic rows per response without --database (default 1000)")
+    parser.add_argument('--iterations', type=int, default=50, help="responses per measurement (default 50)")
+    args = parser.parse_args()
+
+    if args.database:
+        asyncio.get_event_loop().run_until_complete(end_to_end(args.iterations))
+    else:
+        python_side(args.rows, args.iterations)
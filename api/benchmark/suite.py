@@ -0,0 +1,241 @@
+'''
+Scripted benchmark scenarios on synthetic data, with the results written as
+JSON so runs on different commits can be compared.
+
+  import   generates crash and census CSVs (kept in benchmark/data for reuse),
+           loads them into empty tables and times every stage in rows/sec
+  latency  starts the API server with its response caches disabled and times
+           list_crashes at each of ZOOM_LEVELS with each of FILTER_MIXES
+
+The import scenario EMPTIES the crash and census tables of the database in
+settings.json, so point that at a scratch PostGIS database.
+
+Usage: python -m benchmark.suite [--rows N] [--census-rows N] [--scenarios import,latency]
+           [--output results.json] [--compare previous.json]
+'''
+import argparse
+import asyncio
+import aiohttp
+import asyncpg
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import import_data
+from benchmark.list_crashes import ZOOM_LEVELS, percentile
+from benchmark.load_test import wait_until_up
+from benchmark.synthetic import write_census_csv, write_crash_csv
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BENCHMARK_DIR, 'data')
+RESULTS_DIR = os.path.join(BENCHMARK_DIR, 'results')
+API_DIR = os.path.dirname(BENCHMARK_DIR)
+
+PORT = 9997
+CENSUS_YEARS = (2018, 2019, 2020)
+
+# Extra list_crashes fields combined with every zoom level
+FILTER_MIXES = {
+    "all": {},
+    "fatal": {"severity": [1]},
+    "recent": {"yearmin": 2016},
+    "bicycle, dry, lit": {"vehicle_types": ["bicycle"], "dry": True, "lit": True},
+    "paged": {"limit": 500, "after": [40, 0]},
+    "aggregate": {"aggregate": True},
+}
+# Map zoom of each of ZOOM_LEVELS, sent with aggregate requests
+ZOOMS = {"statewide": 6, "city": 11, "suburb": 15}
+
+'''
+Parses 100k, 2.5M, 10000 etc.
+'''
+def row_count(text):
+    multiplier = {'k': 1000, 'm': 1000000}.get(text[-1:].lower(), 1)
+    return int(float(text.rstrip('kKmM')) * multiplier)
+
+def generate_data(rows, census_rows):
+    os.makedirs(DATA_DIR, exist_ok=True)
+    crashes = os.path.join(DATA_DIR, f'crashes-{rows}.csv')
+    census = os.path.join(DATA_DIR, f'census-{census_rows}.csv')
+
+    if not os.path.exists(crashes):
+        print(f"Writing {rows} crashes to {crashes}")
+        write_crash_csv(crashes + '.tmp', rows)
+        os.rename(crashes + '.tmp', crashes)
+    if not os.path.exists(census):
+        print(f"Writing {census_rows} census sites for {len(CENSUS_YEARS)} years to {census}")
+        write_census_csv(census + '.tmp', census_rows, CENSUS_YEARS)
+        os.rename(census + '.tmp', census)
+
+    return crashes, census
+
+def stage_result(rows, seconds):
+    return {'rows': rows, 'seconds': round(seconds, 3), 'rows_per_sec': round(rows / seconds, 1) if seconds else None}
+
+async def import_scenario(args):
+    crashes, census = generate_data(args.rows, args.census_rows)
+    settings = import_data.settings
+    connection = dict(user=settings['psql_user'], password=settings['psql_pass'],
+        database=settings['psql_dbname'], host=settings['psql_host'])
+
+    db = await asyncpg.connect(**connection)
+    await import_data.create_tables(db)
+    await db.execute("TRUNCATE CrashLocations, CrashRowHashes, CrashStats, CensusLocations, CensusImports")
+
+    pool = await asyncpg.create_pool(**connection, min_size=1, max_size=max(args.jobs, 1),
+        init=import_data.set_ewkb_codec)
+
+    results = {}
+
+    start = time.perf_counter()
+    rows = await import_data.import_crashdata(db, args.loader, args.workers, crashes)
+    await db.execute("ANALYZE CrashLocations;")
+    results['crashes'] = dict(stage_result(rows, time.perf_counter() - start), loader=args.loader)
+
+    start = time.perf_counter()
+    rows = await import_data.import_censusdata(pool, {CENSUS_YEARS[-1]: census})
+    await db.execute("ANALYZE CensusLocations;")
+    await db.execute(import_data.REFRESH_LATEST_CENSUS_LOCATIONS_VIEW)
+    results['census'] = stage_result(rows, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await import_data.update_nearest_aadt(pool)
+    results['nearest_aadt'] = stage_result(args.rows, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await import_data.build_crash_stats(db)
+    results['crash_stats'] = stage_result(args.rows, time.perf_counter() - start)
+
+    await pool.close()
+    await db.execute(f"NOTIFY {import_data.DATA_CHANGED_CHANNEL};")
+    await db.close()
+    return results
+
+async def time_requests(session, url, body, iterations):
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        async with session.post(url, json=body) as r:
+            await r.read()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return timings
+
+async def latency_scenario(args):
+    # The server reads settings.json from its working directory, so it is
+    # started from a temporary one with the caches turned off
+    with open(os.path.join(API_DIR, 'settings.json')) as f:
+        settings = json.load(f)
+    settings.update(response_cache_bytes=0, tile_cache_bytes=0, crash_cache_bytes=0,
+        port=PORT, workers=1, log_level='WARNING')
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, 'settings.json'), 'w') as f:
+            json.dump(settings, f)
+
+        server = subprocess.Popen([sys.executable, os.path.join(API_DIR, 'api_server.py')], cwd=directory)
+        try:
+            async with aiohttp.ClientSession(raise_for_status=True) as session:
+                await wait_until_up(session, f"http://localhost:{PORT}/cache_stats")
+                url = f"http://localhost:{PORT}/list_crashes"
+
+                for zoom_name, (corner1, corner2) in ZOOM_LEVELS.items():
+                    for mix_name, mix in FILTER_MIXES.items():
+                        body = dict(mix, corner1=corner1, corner2=corner2)
+                        if mix.get('aggregate'):
+                            body['zoom'] = ZOOMS[zoom_name]
+
+                        await time_requests(session, url, body, 3)
+                        timings = await time_requests(session, url, body, args.iterations)
+                        name = f"{zoom_name}/{mix_name}"
+                        results[name] = {
+                            'p50_ms': round(percentile(timings, 50), 3),
+                            'p99_ms': round(percentile(timings, 99), 3),
+                            'mean_ms': round(sum(timings) / len(timings), 3),
+                            'requests': len(timings),
+                        }
+                        print(f"{name:>28}: p50 {results[name]['p50_ms']:8.2f} ms  p99 {results[name]['p99_ms']:8.2f} ms")
+        finally:
+            server.terminate()
+            server.wait()
+
+    return results
+
+def git_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=API_DIR,
+            capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=API_DIR,
+            capture_output=True, text=True, check=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, dirty
+
+'''
+Prints every numeric result next to the same one in a previous results file
+'''
+def compare(results, previous):
+    print(f"\nCompared with {previous.get('commit')} ({previous.get('timestamp')}):")
+    for scenario in ('import', 'latency'):
+        for name, values in results.get(scenario, {}).items():
+            old_values = previous.get(scenario, {}).get(name, {})
+            for key in ('rows_per_sec', 'p50_ms', 'p99_ms'):
+                if values.get(key) and old_values.get(key):
+                    change = (values[key] / old_values[key] - 1) * 100
+                    print(f"{scenario + ' ' + name:>36} {key:>12}: {old_values[key]:>10} -> {values[key]:>10} ({change:+.1f}%)")
+
+async def run(args):
+    commit, dirty = git_commit()
+    results = {
+        'commit': commit,
+        'dirty': dirty,
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'cpus': os.cpu_count(),
+        'rows': args.rows,
+        'census_rows': args.census_rows,
+    }
+
+    scenarios = args.scenarios.split(',')
+    if 'import' in scenarios:
+        results['import'] = await import_scenario(args)
+    if 'latency' in scenarios:
+        results['latency'] = await latency_scenario(args)
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{results['timestamp'].replace(':', '')}-{commit or 'unknown'}.json")
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the importer and the API on synthetic data")
+    parser.add_argument('--rows', type=row_count, default=row_count('100k'),
+        help="crashes to generate and import, e.g. 100k, 2.5M, 10M (default 100k)")
+    parser.add_argument('--census-rows', type=row_count, default=row_count('10k'),
+        help="census sites per year (default 10k)")
+    parser.add_argument('--scenarios', default='import,latency',
+        help="comma separated scenarios to run (default import,latency)")
+    parser.add_argument('--loader', choices=("copy", "incremental", "insert"), default="copy",
+        help="crash loader of the import scenario (default copy)")
+    parser.add_argument('--workers', type=int, default=max((os.cpu_count() or 1) - 1, 0),
+        help="crash CSV parsing processes (default: one less than the number of CPUs)")
+    parser.add_argument('--jobs', type=int, default=4, help="concurrent NearestAADT jobs (default 4)")
+    parser.add_argument('--iterations', type=int, default=50, help="requests per latency case (default 50)")
+    parser.add_argument('--output', help="results file (default: benchmark/results/<time>-<commit>.json)")
+    parser.add_argument('--compare', metavar='RESULTS', help="results file of an earlier run to compare against")
+    args = parser.parse_args()
+
+    asyncio.get_event_loop().run_until_complete(run(args))
@@ -0,0 +1,189 @@
+'''
+Synthetic datasets in the layout of the open data files, for benchmarking the
+importer and the API without downloading anything.
+
+Crashes and census sites are scattered around Queensland population centres,
+weighted roughly by population, so viewport queries see realistic densities.
+
+Usage: python -m benchmark.synthetic crashes|census rows path [seed]
+'''
+import csv
+import random
+import sys
+
+import import_data
+
+CRASH_CSV_COLUMNS = (
+    'Crash_Ref_Number',
+    'Crash_Severity',
+    'Crash_Year',
+    'Crash_Month',
+    'Crash_Day_Of_Week',
+    'Crash_Hour',
+    'Crash_Nature',
+    'Crash_Type',
+    'Crash_Longitude_GDA94',
+    'Crash_Latitude_GDA94',
+    'Crash_Street',
+    'Crash_Street_Intersecting',
+    'State_Road_Name',
+    'Loc_Suburb',
+    'Loc_Local_Government_Area',
+    'Loc_Post_Code',
+    'Crash_Roadway_Feature',
+    'Crash_Traffic_Control',
+    'Crash_Speed_Limit',
+    'Crash_Road_Surface_Condition',
+    'Crash_Atmospheric_Condition',
+    'Crash_Lighting_Condition',
+    'Crash_DCA_Code',
+    'Crash_DCA_Description',
+    'Crash_DCA_Group_Description',
+    'DCA_Key_Approach_Dir',
+    'Count_Casualty_Fatality',
+    'Count_Casualty_Hospitalised',
+    'Count_Casualty_MedicallyTreated',
+    'Count_Casualty_MinorInjury',
+    'Count_Casualty_Total',
+    'Count_Unit_Car',
+    'Count_Unit_Motorcycle_Moped',
+    'Count_Unit_Truck',
+    'Count_Unit_Bus',
+    'Count_Unit_Bicycle',
+    'Count_Unit_Pedestrian',
+    'Count_Unit_Other',
+)
+
+MONTHS = ('January', 'February', 'March', 'April', 'May', 'June', 'July',
+    'August', 'September', 'October', 'November', 'December')
+DAYS = ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday')
+SPEED_LIMITS = ('0 - 50 km/h', '60 km/h', '70 km/h', '80 - 90 km/h', '100 - 110 km/h')
+SURFACES = ('Sealed - Dry', 'Sealed - Wet', 'Unsealed - Dry', 'Unsealed - Wet')
+STREETS = ('Queen St', 'Bruce Hwy', 'Gympie Rd', 'Pacific Mwy', 'Ipswich Rd', 'Logan Rd')
+# (council, suburb, postcode, longitude, latitude, spread in degrees, weight)
+REGIONS = (
+    ('Brisbane City', 'Brisbane City', 4000, 153.02, -27.47, 0.12, 30),
+    ('Gold Coast City', 'Surfers Paradise', 4217, 153.40, -28.00, 0.10, 14),
+    ('Moreton Bay Regional', 'Caboolture', 4510, 152.98, -27.15, 0.12, 10),
+    ('Logan City', 'Logan Central', 4114, 153.10, -27.64, 0.08, 7),
+    ('Sunshine Coast Regional', 'Maroochydore', 4558, 153.08, -26.65, 0.12, 7),
+    ('Ipswich City', 'Ipswich', 4305, 152.76, -27.61, 0.08, 5),
+    ('Townsville City', 'Townsville City', 4810, 146.82, -19.26, 0.08, 4),
+    ('Cairns Regional', 'Cairns City', 4870, 145.77, -16.92, 0.08, 4),
+    ('Toowoomba Regional', 'Toowoomba City', 4350, 151.95, -27.56, 0.10, 4),
+    ('Mackay Regional', 'Mackay', 4740, 149.19, -21.14, 0.08, 3),
+    ('Rockhampton Regional', 'Rockhampton City', 4700, 150.51, -23.38, 0.08, 2),
+    ('Bundaberg Regional', 'Bundaberg Central', 4670, 152.35, -24.87, 0.08, 2),
+    ('Fraser Coast Regional', 'Hervey Bay', 4655, 152.85, -25.29, 0.08, 2),
+    ('Gladstone Regional', 'Gladstone Central', 4680, 151.26, -23.85, 0.06, 1),
+    ('Mount Isa City', 'Mount Isa', 4825, 139.49, -20.73, 0.05, 1),
+)
+REGION_WEIGHTS = [region[6] for region in REGIONS]
+# Share of rural crashes, anywhere between the coast and the border
+RURAL_SHARE = 0.05
+RURAL_REGION = ('Unincorporated', 'Rural', 4000)
+
+SEVERITY_WEIGHTS = (2, 35, 25, 18, 20)
+
+# Descriptions in the real file contain commas, so fields have to be quoted
+DESCRIPTIONS = (
+    ('001', 'Ped, crossing from near side', 'Pedestrian'),
+    ('202', 'Veh, rear end', 'Rear-end'),
+    ('301', 'Veh, right turn, thru', 'Intersection'),
+    ('701', 'Off carriageway, on straight', 'Off path on straight'),
+)
+
+'''
+Returns (council, suburb, postcode, longitude, latitude) of a random location
+'''
+def random_location(rng):
+    if rng.random() < RURAL_SHARE:
+        # Along the band of highways between the coast and the ranges
+        latitude = rng.uniform(-28.9, -16.0)
+        longitude = 153.3 - (latitude + 28.0) * 0.68 - rng.uniform(0.0, 3.0)
+        return (*RURAL_REGION, longitude, latitude)
+
+    council, suburb, postcode, longitude, latitude, spread, _ = rng.choices(REGIONS, REGION_WEIGHTS)[0]
+    return (council, suburb, postcode, rng.gauss(longitude, spread), rng.gauss(latitude, spread))
+
+'''
+Writes a crash locations CSV with the given number of rows to path
+'''
+def write_crash_csv(path, rows, seed=0):
+    rng = random.Random(seed)
+    severities = list(import_data.CRASH_SEVERITIES.values())
+    natures = list(import_data.CRASH_NATURE.values())
+    types = list(import_data.CRASH_TYPES.values())
+    features = list(import_data.CRASH_ROADWAY_FEATURES.values())
+    controls = list(import_data.CRASH_TRAFFIC_CONTROL.values())
+    weather = list(import_data.CRASH_ATMOSPHERIC_CONDITIONS.values())
+    lighting = list(import_data.CRASH_LIGHTING_CONDITIONS.keys())
+
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(CRASH_CSV_COLUMNS)
+        for ref in range(1, rows + 1):
+            casualties = [rng.choice((0, 0, 0, 1)) for _ in range(4)]
+            units = [rng.choice((0, 0, 1, 2)) for _ in range(7)]
+            dca = rng.choice(DESCRIPTIONS)
+            council, suburb, postcode, longitude, latitude = random_location(rng)
+            writer.writerow((
+                ref,
+                rng.choices(severities, SEVERITY_WEIGHTS)[0],
+                rng.randint(2001, 2020),
+                rng.choice(MONTHS),
+                rng.choice(DAYS),
+                rng.randint(0, 23),
+                rng.choice(natures),
+                rng.choice(types),
+                f"{longitude:.6f}",
+                f"{latitude:.6f}",
+                rng.choice(STREETS),
+                rng.choice(STREETS),
+                '',
+                suburb,
+                council,
+                postcode,
+                rng.choice(features),
+                rng.choice(controls),
+                rng.choice(SPEED_LIMITS),
+                rng.choice(SURFACES),
+                rng.choice(weather),
+                rng.choice(lighting),
+                dca[0],
+                dca[1],
+                dca[2],
+                rng.choice('NESW'),
+                *casualties,
+                sum(casualties),
+                *units,
+            ))
+
+CENSUS_CSV_COLUMNS = ('SITE_ID', 'AADT_YEAR', 'AADT', 'PC_HV', 'LONGITUDE', 'LATITUDE')
+
+'''
+Writes a traffic census CSV with rows count sites for each of years to path.
+Sites keep their ID and location across years, as in the real files.
+'''
+def write_census_csv(path, rows, years=(2020,), seed=0):
+    rng = random.Random(seed)
+    sites = []
+    for site_id in range(1, rows + 1):
+        _, _, _, longitude, latitude = random_location(rng)
+        sites.append((site_id, longitude, latitude, int(rng.lognormvariate(8.5, 1.0)), rng.uniform(2.0, 30.0)))
+
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(CENSUS_CSV_COLUMNS)
+        for year in years:
+            for site_id, longitude, latitude, aadt, pcnt_hv in sites:
+                writer.writerow((site_id, year, int(aadt * rng.uniform(0.9, 1.1)), f"{pcnt_hv:.2f}",
+                    f"{longitude:.6f}", f"{latitude:.6f}"))
+
+if __name__ == '__main__':
+    kind, rows, path = sys.argv[1], int(float(sys.argv[2])), sys.argv[3]
+    seed = int(sys.argv[4]) if len(sys.argv) > 4 else 0
+    if kind == 'crashes':
+        write_crash_csv(path, rows, seed)
+    else:
+        write_census_csv(path, rows, seed=seed)
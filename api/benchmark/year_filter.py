@@ -0,0 +1,64 @@
+'''
+Compares the EXTRACT(YEAR FROM CrashDate) predicate that list_crashes used to
+send with the half-open CrashDate range it sends now, directly against the
+database.
+
+Usage: python -m benchmark.year_filter [iterations]
+'''
+import asyncio
+import asyncpg
+import datetime
+import json
+import sys
+import time
+
+from benchmark.list_crashes import percentile
+
+settings = {}
+
+# Read SQL Auth data
+with open('settings.json') as json_file:
+    settings = json.load(json_file)
+
+QUERY = """
+SELECT ID, SeverityIndex
+FROM CrashLocations
+WHERE {}
+ORDER BY SeverityIndex DESC
+LIMIT 1000
+"""
+
+PREDICATES = {
+    "extract": ("EXTRACT(YEAR FROM CrashDate) >= $1 AND EXTRACT(YEAR FROM CrashDate) <= $2",
+        lambda yearmin, yearmax: (yearmin, yearmax)),
+    "range": ("CrashDate >= $1 AND CrashDate < $2",
+        lambda yearmin, yearmax: (datetime.datetime(yearmin, 1, 1), datetime.datetime(yearmax + 1, 1, 1))),
+}
+
+YEAR_RANGES = [(2019, 2019), (2015, 2019), (2001, 2020)]
+
+async def run(iterations):
+    db = await asyncpg.connect(user=settings['psql_user'], password=settings['psql_pass'],
+        database=settings['psql_dbname'], host=settings['psql_host'])
+
+    for yearmin, yearmax in YEAR_RANGES:
+        for name, (predicate, make_args) in PREDICATES.items():
+            stmt = await db.prepare(QUERY.format(predicate))
+            args = make_args(yearmin, yearmax)
+            await stmt.fetch(*args)
+
+            timings = []
+            for _ in range(iterations):
+                start = time.perf_counter()
+                await stmt.fetch(*args)
+                timings.append((time.perf_counter() - start) * 1000)
+            timings.sort()
+
+            print(f"{yearmin}-{yearmax} {name:>8}: p50 {percentile(timings, 50):8.2f} ms  "
+                f"p99 {percentile(timings, 99):8.2f} ms")
+
+    await db.close()
+
+if __name__ == '__main__':
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    asyncio.get_event_loop().run_until_complete(run(iterations))
@@ -0,0 +1,127 @@
+'''
+Compact binary encoding of list_crashes responses, sent instead of JSON when
+the client accepts COLUMNS_CONTENT_TYPE. Decoded by decodeCrashColumns in
+html/js/index.js.
+
+All values are little-endian. A 20 byte header:
+
+    bytes 0-3    magic "CRSH"
+    byte  4      format version, 1
+    byte  5      kind, 0 for crashes and 1 for aggregated cells
+    byte  6      1 if the next page cursor is set
+    byte  7      unused
+    bytes 8-11   uint32 number of rows
+    bytes 12-19  int32 severityindex and int32 id of the next page cursor
+
+is followed by one packed array per column, longest element first so every
+array starts 4 byte aligned and can be viewed as a typed array directly:
+
+    crashes      int32 id, int32 nearestaadt (-1 for none), float32 longitude,
+                 float32 latitude, uint16 severityindex
+    cells        uint32 count, uint32 severity, float32 longitude, float32 latitude
+
+float32 keeps locations to within about a metre.
+'''
+import array
+import gzip
+import struct
+import sys
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COLUMNS_CONTENT_TYPE = 'application/vnd.crashmap.columns'
+
+MAGIC = b'CRSH'
+VERSION = 1
+KIND_CRASHES = 0
+KIND_CELLS = 1
+HEADER = struct.Struct('<4sBBBxIii')
+
+CRASH_COLUMNS = (('id', 'i'), ('nearestaadt', 'i'), ('longitude', 'f'), ('latitude', 'f'), ('severityindex', 'H'))
+CELL_COLUMNS = (('count', 'I'), ('severity', 'I'), ('longitude', 'f'), ('latitude', 'f'))
+
+# Bodies smaller than this are sent uncompressed
+COMPRESS_MIN_BYTES = 1024
+
+# NumPy dtypes of the array typecodes, for columns given as NumPy arrays
+NUMPY_TYPES = {'i': '<i4', 'I': '<u4', 'H': '<u2', 'f': '<f4'}
+
+def column_bytes(values, typecode):
+    if hasattr(values, 'astype'):
+        return values.astype(NUMPY_TYPES[typecode]).tobytes()
+
+    column = array.array(typecode, values)
+    if sys.byteorder == 'big':
+        column.byteswap()
+    return column.tobytes()
+
+def encode(kind, columns, values, next=None):
+    count = len(values[0]) if values else 0
+    severity_index, crash_id = next if next is not None else (0, 0)
+    parts = [HEADER.pack(MAGIC, VERSION, kind, next is not None, count, severity_index, crash_id)]
+    for (_, typecode), column in zip(columns, values):
+        parts.append(column_bytes(column, typecode))
+    return b''.join(parts)
+
+'''
+Encodes crashes given as columns, in the order of CRASH_COLUMNS
+'''
+def encode_crashes(ids, nearest_aadts, longitudes, latitudes, severity_indexes, next=None):
+    return encode(KIND_CRASHES, CRASH_COLUMNS, (ids, nearest_aadts, longitudes, latitudes, severity_indexes), next)
+
+'''
+Encodes aggregated cells given as columns, in the order of CELL_COLUMNS
+'''
+def encode_cells(counts, severities, longitudes, latitudes):
+    return encode(KIND_CELLS, CELL_COLUMNS, (counts, severities, longitudes, latitudes))
+
+'''
+Decodes a body back into (kind, {column: list}, next), for tests and benchmarks
+'''
+def decode(body):
+    magic, version, kind, has_next, count, severity_index, crash_id = HEADER.unpack_from(body)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Not a version 1 crash columns body")
+
+    offset = HEADER.size
+    columns = {}
+    for name, typecode in (CRASH_COLUMNS if kind == KIND_CRASHES else CELL_COLUMNS):
+        column = array.array(typecode)
+        size = column.itemsize * count
+        column.frombytes(body[offset:offset + size])
+        if sys.byteorder == 'big':
+            column.byteswap()
+        columns[name] = column.tolist()
+        offset += size
+
+    return kind, columns, [severity_index, crash_id] if has_next else None
+
+'''
+Picks the content coding for a response from an Accept-Encoding header:
+brotli when the brotli package is installed, then gzip, otherwise None
+'''
+def choose_encoding(accept_encoding):
+    accepted = set()
+    for coding in accept_encoding.split(','):
+        coding, *params = [part.strip() for part in coding.split(';')]
+        if 'q=0' not in params and 'q=0.0' not in params:
+            accepted.add(coding.lower())
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return None
+
+'''
+Compresses body with the given content coding. Small bodies are returned as
+they are, with None as the coding.
+'''
+def compress(body, encoding):
+    if encoding is None or len(body) < COMPRESS_MIN_BYTES:
+        return body, None
+    if encoding == 'br':
+        return brotli.compress(body, quality=5), 'br'
+    return gzip.compress(body, compresslevel=6), 'gzip'
@@ -0,0 +1,322 @@
+'''
+In-memory columnar copy of CrashLocations, an alternative to Postgres for
+answering list_crashes.
+
+Every column list_crashes filters or returns is held in a NumPy array, with
+the rows sorted from most to least severe (SeverityIndex DESC, ID DESC) so the
+top N matches of a filter are simply its first N matching rows. Bounding boxes
+are narrowed down with a uniform grid over the crash locations, the lookup ID
+columns have one bitmap per value, and everything else is a vectorised
+comparison over the remaining rows.
+
+Enabled with "query_engine": "memory" in settings.json. Needs NumPy.
+'''
+import json
+import math
+
+import numpy as np
+
+import columnar
+
+# Columns of the load query, in the order of the arrays built from it
+LOAD_CRASHES_SQL = """
+SELECT ID, SeverityIndex, NearestAADT,
+    ST_X(Location::geometry), ST_Y(Location::geometry),
+    EXTRACT(YEAR FROM CrashDate)::smallint,
+    SeverityID, NatureID, TypeID, AtmosphericConditionID,
+    Sealed, Dry, Day, PartialDaylight, Lit,
+    InvolvedCar, InvolvedMotorcycle, InvolvedTruck, InvolvedBus,
+    InvolvedBicycle, InvolvedPedestrian, InvolvedOther
+FROM CrashLocations
+"""
+
+LOAD_COLUMNS = ('id', 'severityindex', 'nearestaadt', 'x', 'y', 'year',
+    'severity', 'nature', 'type', 'weather',
+    'sealed', 'dry', 'day', 'partialday', 'lit',
+    'car', 'motorcycle', 'truck', 'bus', 'bicycle', 'pedestrian', 'other')
+
+# list_crashes fields that are lookup ID lists, each gets a bitmap per ID
+CATEGORY_FIELDS = ('severity', 'nature', 'type', 'weather')
+# list_crashes fields that are True/False, stored as 1/0 with -1 for NULL
+BOOLEAN_FIELDS = ('sealed', 'dry', 'day', 'partialday', 'lit')
+# lighting values, matched on the day, partialday and lit flags as in api_server.LIGHTING_CONDITIONS
+LIGHTING_FIELDS = ('daylight', 'darknesslit', 'darknessunlit', 'dawndusk')
+# vehicle_types values, stored as a flag per crash of whether any was involved
+VEHICLE_FIELDS = ('car', 'motorcycle', 'truck', 'bus', 'bicycle', 'pedestrian', 'other')
+
+# Grid cells along the longer side of the extent of the crashes
+GRID_CELLS_PER_SIDE = 256
+# Above this fraction of the rows a bounding box is checked with a full scan
+# rather than by gathering the rows of its grid cells
+GRID_MAX_FRACTION = 0.25
+# Rows checked at a time by top N queries
+SCAN_CHUNK_ROWS = 16384
+
+class CrashIndex:
+    '''
+    columns maps each of LOAD_COLUMNS to a sequence, with None for NULL
+    '''
+    def __init__(self, columns):
+        severity_index = np.asarray(columns['severityindex'], dtype=np.int64)
+        ids = np.asarray(columns['id'], dtype=np.int64)
+        # Most severe first, ties broken by the larger ID as in list_crash_points
+        order = np.lexsort((-ids, -severity_index))
+
+        self.size = len(order)
+        self.id = ids[order]
+        self.severity_index = severity_index[order]
+        # Descending (SeverityIndex, ID) as one ascending key for the "after" cursor
+        self.sort_key = -((self.severity_index << 32) | self.id)
+
+        nearest_aadt = np.array([-1 if v is None else v for v in columns['nearestaadt']], dtype=np.int64)
+        self.nearest_aadt = nearest_aadt[order]
+        self.x = np.asarray(columns['x'], dtype=np.float64)[order]
+        self.y = np.asarray(columns['y'], dtype=np.float64)[order]
+        self.year = np.asarray(columns['year'], dtype=np.int16)[order]
+
+        # field -> {lookup ID: bool array}
+        self.bitmaps = {}
+        for field in CATEGORY_FIELDS:
+            values = np.array([-1 if v is None else v for v in columns[field]], dtype=np.int16)[order]
+            self.bitmaps[field] = {int(v): values == v for v in np.unique(values) if v >= 0}
+
+        self.flags = {}
+        for field in BOOLEAN_FIELDS:
+            self.flags[field] = np.array([-1 if v is None else int(v) for v in columns[field]], dtype=np.int8)[order]
+
+        self.involved = {}
+        for field in VEHICLE_FIELDS:
+            self.involved[field] = (np.asarray(columns[field], dtype=np.int16) > 0)[order]
+
+        self.build_grid()
+
+    '''
+    Loads every crash from Postgres. The query runs on the pool, the arrays are
+    built in the default executor so the event loop is not blocked.
+    '''
+    @classmethod
+    async def load(cls, pool, loop):
+        async with pool.acquire() as con:
+            rows = await con.fetch(LOAD_CRASHES_SQL)
+        return await loop.run_in_executor(None, cls.from_rows, rows)
+
+    @classmethod
+    def from_rows(cls, rows):
+        return cls({name: [row[i] for row in rows] for i, name in enumerate(LOAD_COLUMNS)})
+
+    '''
+    Uniform grid over the extent of the crashes. Row positions are grouped by
+    cell, ascending within a cell, so the cells of one grid row that fall in a
+    bounding box are a single contiguous slice of grid_rows.
+    '''
+    def build_grid(self):
+        if self.size == 0:
+            self.grid_origin = (0.0, 0.0)
+            self.grid_cell = 1.0
+            self.grid_shape = (1, 1)
+            self.grid_rows = np.zeros(0, dtype=np.int64)
+            self.grid_offsets = np.zeros(2, dtype=np.int64)
+            return
+
+        x0, y0 = float(self.x.min()), float(self.y.min())
+        span = max(float(self.x.max()) - x0, float(self.y.max()) - y0, 1e-9)
+        self.grid_origin = (x0, y0)
+        self.grid_cell = span / GRID_CELLS_PER_SIDE
+        nx = int((float(self.x.max()) - x0) / self.grid_cell) + 1
+        ny = int((float(self.y.max()) - y0) / self.grid_cell) + 1
+        self.grid_shape = (nx, ny)
+
+        cells = self.grid_cells(self.x, self.y)
+        self.grid_rows = np.argsort(cells, kind='stable')
+        self.grid_offsets = np.searchsorted(cells[self.grid_rows], np.arange(nx * ny + 1))
+
+    def grid_cells(self, x, y):
+        nx, ny = self.grid_shape
+        ix = np.clip(((x - self.grid_origin[0]) / self.grid_cell).astype(np.int64), 0, nx - 1)
+        iy = np.clip(((y - self.grid_origin[1]) / self.grid_cell).astype(np.int64), 0, ny - 1)
+        return iy * nx + ix
+
+    '''
+    Positions of the rows that can be inside the bounding box, in severity
+    order, or None if the box covers too much of the grid to be worth it
+    '''
+    def grid_candidates(self, x1, y1, x2, y2):
+        nx, ny = self.grid_shape
+        ox, oy = self.grid_origin
+        ix1 = max(int(math.floor((x1 - ox) / self.grid_cell)), 0)
+        iy1 = max(int(math.floor((y1 - oy) / self.grid_cell)), 0)
+        ix2 = min(int(math.floor((x2 - ox) / self.grid_cell)), nx - 1)
+        iy2 = min(int(math.floor((y2 - oy) / self.grid_cell)), ny - 1)
+        if ix1 > ix2 or iy1 > iy2:
+            return np.zeros(0, dtype=np.int64)
+
+        starts = self.grid_offsets[np.arange(iy1, iy2 + 1) * nx + ix1]
+        ends = self.grid_offsets[np.arange(iy1, iy2 + 1) * nx + ix2 + 1]
+        if (ends - starts).sum() > self.size * GRID_MAX_FRACTION:
+            return None
+
+        return np.sort(np.concatenate([self.grid_rows[s:e] for s, e in zip(starts, ends)]))
+
+    '''
+    Positions of the first limit (or all) rows matching a normalised
+    list_crashes request, most severe first. The candidates are checked in
+    chunks of SCAN_CHUNK_ROWS so a top N query stops once it has N rows.
+    '''
+    def matching_rows(self, request_json, limit=None):
+        rows = self.candidate_rows(request_json)
+        if limit is None:
+            return rows[self.filter_mask(request_json, rows)]
+
+        matches = []
+        found = 0
+        for chunk_start in range(0, len(rows), SCAN_CHUNK_ROWS):
+            chunk = rows[chunk_start:chunk_start + SCAN_CHUNK_ROWS]
+            chunk = chunk[self.filter_mask(request_json, chunk)]
+            matches.append(chunk)
+            found += len(chunk)
+            if found >= limit:
+                break
+
+        return np.concatenate(matches)[:limit] if matches else rows
+
+    '''
+    Rows that can match the bounding box and "after" cursor, from the grid when
+    the box is small enough
+    '''
+    def candidate_rows(self, request_json):
+        rows = None
+        start = 0
+
+        if 'after' in request_json:
+            severity_index, crash_id = (int(v) for v in request_json['after'][:2])
+            start = int(np.searchsorted(self.sort_key, -((severity_index << 32) | crash_id), side='right'))
+
+        if 'corner1' in request_json and 'corner2' in request_json:
+            x1, y1 = request_json['corner1'][:2]
+            x2, y2 = request_json['corner2'][:2]
+            rows = self.grid_candidates(min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2))
+            if rows is not None:
+                rows = rows[rows >= start]
+
+        if rows is None:
+            rows = np.arange(start, self.size)
+
+        return rows
+
+    '''
+    Vectorised check of the filters of a normalised list_crashes request
+    against the given rows. Vehicle types and lighting conditions are expected
+    to be validated already, see compile_crash_filters.
+    '''
+    def filter_mask(self, request_json, rows):
+        mask = np.ones(len(rows), dtype=bool)
+
+        if 'corner1' in request_json and 'corner2' in request_json:
+            x1, y1 = request_json['corner1'][:2]
+            x2, y2 = request_json['corner2'][:2]
+            x1, x2 = min(x1, x2), max(x1, x2)
+            y1, y2 = min(y1, y2), max(y1, y2)
+            x = self.x[rows]
+            y = self.y[rows]
+            mask &= (x >= x1) & (x <= x2) & (y >= y1) & (y <= y2)
+
+        if 'yearmax' in request_json:
+            mask &= self.year[rows] <= int(request_json['yearmax'])
+
+        if 'yearmin' in request_json:
+            mask &= self.year[rows] >= int(request_json['yearmin'])
+
+        if 'vehicle_types' in request_json and set(request_json['vehicle_types']) != set(VEHICLE_FIELDS):
+            involved = np.zeros(len(rows), dtype=bool)
+            for vehicle_type in request_json['vehicle_types']:
+                involved |= self.involved[vehicle_type][rows]
+            mask &= involved
+
+        for field in CATEGORY_FIELDS:
+            if field in request_json:
+                matches = np.zeros(len(rows), dtype=bool)
+                for value in request_json[field]:
+                    bitmap = self.bitmaps[field].get(int(value))
+                    if bitmap is not None:
+                        matches |= bitmap[rows]
+                mask &= matches
+
+        for field in BOOLEAN_FIELDS:
+            if field in request_json:
+                mask &= self.flags[field][rows] == int(bool(request_json[field]))
+
+        if 'lighting' in request_json and set(request_json['lighting']) != set(LIGHTING_FIELDS):
+            day = self.flags['day'][rows]
+            partial_day = self.flags['partialday'][rows]
+            lit = self.flags['lit'][rows]
+            dark = (day == 0) & (partial_day == 0)
+            conditions = {
+                'daylight': day == 1,
+                'darknesslit': dark & (lit == 1),
+                'darknessunlit': dark & (lit == 0),
+                'dawndusk': partial_day == 1,
+            }
+            matches = np.zeros(len(rows), dtype=bool)
+            for lighting in request_json['lighting']:
+                matches |= conditions[lighting]
+            mask &= matches
+
+        return mask
+
+    '''
+    Same response body as Webserver.list_crash_points, as JSON or with columns
+    in the columnar encoding
+    '''
+    def list_crash_points(self, request_json, limit, columns=False):
+        rows = self.matching_rows(request_json, limit)
+
+        if columns:
+            next = None
+            if ('limit' in request_json or 'after' in request_json) and len(rows) == limit:
+                next = (int(self.severity_index[rows[-1]]), int(self.id[rows[-1]]))
+            return columnar.encode_crashes(self.id[rows], self.nearest_aadt[rows],
+                self.x[rows], self.y[rows], self.severity_index[rows], next)
+
+        crashes = [{
+            'id': crash_id,
+            'severityindex': severity_index,
+            'nearestaadt': None if nearest_aadt < 0 else nearest_aadt,
+            'location': [x, y],
+        } for crash_id, severity_index, nearest_aadt, x, y in zip(
+            self.id[rows].tolist(), self.severity_index[rows].tolist(),
+            self.nearest_aadt[rows].tolist(), self.x[rows].tolist(), self.y[rows].tolist())]
+
+        if 'limit' in request_json or 'after' in request_json:
+            last = crashes[-1] if len(crashes) == limit else None
+            body = {'crashes': crashes,
+                'next': last and [last['severityindex'], last['id']]}
+        else:
+            body = crashes
+
+        return json.dumps(body).encode("utf-8")
+
+    '''
+    Same response body as Webserver.list_crash_clusters, for grid cells of
+    cell degrees, as JSON or with columns in the columnar encoding
+    '''
+    def list_crash_clusters(self, request_json, cell, columns=False):
+        rows = self.matching_rows(request_json)
+        x = self.x[rows]
+        y = self.y[rows]
+
+        cells = np.stack((np.floor(x / cell), np.floor(y / cell)), axis=1)
+        cells, inverse = np.unique(cells, axis=0, return_inverse=True)
+        inverse = inverse.ravel()
+        count = np.bincount(inverse, minlength=len(cells))
+        severity = np.bincount(inverse, weights=self.severity_index[rows], minlength=len(cells))
+        sum_x = np.bincount(inverse, weights=x, minlength=len(cells))
+        sum_y = np.bincount(inverse, weights=y, minlength=len(cells))
+
+        if columns:
+            return columnar.encode_cells(count, severity, sum_x / count, sum_y / count)
+
+        return json.dumps([{
+            'count': c,
+            'severity': int(s),
+            'location': [sx / c, sy / c],
+        } for c, s, sx, sy in zip(count.tolist(), severity.tolist(), sum_x.tolist(), sum_y.tolist())]).encode("utf-8")
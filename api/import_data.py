@@ -2,20 +2,30 @@
 Process the CSVs from the open data portal and export into the postgresql database.
 
 To minimize memory usage for large files (such as the crash location files),
-the data will be processed as it is downloaded and processed in batches of
-100 records into the postgresql database.
+the data will be processed as it is downloaded and loaded in batches into
+the postgresql database, either with COPY (the default) or batched INSERTs.
 
 The datasets being used are:
 
 - Road crash locations
 - Road census data
 '''
+import argparse
 import json
 import asyncio
 import asyncpg
 import aiohttp
+import codecs
+import concurrent.futures
+import csv
 import datetime
+import decimal
+import hashlib
+import io
+import os
+import struct
 import sys
+import time
 
 import shapely.geometry
 import shapely.wkb
@@ -41,7 +51,7 @@ ROAD_CRASHES_URL = "https://www.data.qld.gov.au/dataset/f3e0ca94-2d7b-44ee-abef-
 
 CREATE_CRASH_LOCATIONS_TABLE = """
 CREATE TABLE IF NOT EXISTS CrashLocations (
-    ID INTEGER PRIMARY KEY,
+    ID INTEGER NOT NULL,
     SeverityIndex INTEGER NOT NULL,
     NearestAADT INTEGER,
     SeverityID SMALLINT NOT NULL,
@@ -94,13 +104,104 @@ CREATE TABLE IF NOT EXISTS CrashLocations (
         REFERENCES TrafficControl(ID),
     CONSTRAINT fk_atmospheric_condition
         FOREIGN KEY(AtmosphericConditionID)
-        REFERENCES AtmosphericCondition(ID)
+        REFERENCES AtmosphericCondition(ID),
+    -- The partition key has to be part of the primary key
+    PRIMARY KEY (ID, CrashDate)
+) PARTITION BY RANGE (CrashDate);
+"""
+
+# One partition per calendar year so year filters prune whole partitions.
+# Anything outside CRASH_PARTITION_YEARS lands in the default partition.
+CRASH_PARTITION_YEARS = range(2001, datetime.date.today().year + 1)
+
+CREATE_CRASH_LOCATIONS_PARTITION = """
+CREATE TABLE IF NOT EXISTS CrashLocations_{year}
+    PARTITION OF CrashLocations
+    FOR VALUES FROM ('{year}-01-01') TO ('{next_year}-01-01');
+"""
+
+CREATE_CRASH_LOCATIONS_DEFAULT_PARTITION = """
+CREATE TABLE IF NOT EXISTS CrashLocations_Default
+    PARTITION OF CrashLocations DEFAULT;
+"""
+
+# The viewport filter in api_server.list_crashes compares against
+# Location::geometry, so the spatial indexes are built on that expression.
+# The category indexes lead with the column being filtered and end with
+# SeverityIndex so the top-N ordering can be read off the index, and
+# (SeverityIndex, ID) serves the keyset pagination of list_crashes. The partial
+# indexes cover the common single vehicle type filters from the sidebar.
+CREATE_CRASH_LOCATIONS_INDEXES = """
+CREATE INDEX IF NOT EXISTS CrashLocations_CrashDate_idx
+    ON CrashLocations (CrashDate);
+CREATE INDEX IF NOT EXISTS CrashLocations_Location_idx
+    ON CrashLocations USING GIST ((Location::geometry));
+CREATE INDEX IF NOT EXISTS CrashLocations_SeverityIndex_ID_idx
+    ON CrashLocations (SeverityIndex, ID);
+CREATE INDEX IF NOT EXISTS CrashLocations_Severity_idx
+    ON CrashLocations (SeverityID, SeverityIndex DESC);
+CREATE INDEX IF NOT EXISTS CrashLocations_Nature_Type_idx
+    ON CrashLocations (NatureID, TypeID, SeverityIndex DESC);
+CREATE INDEX IF NOT EXISTS CrashLocations_Pedestrian_idx
+    ON CrashLocations USING GIST ((Location::geometry)) WHERE InvolvedPedestrian > 0;
+CREATE INDEX IF NOT EXISTS CrashLocations_Bicycle_idx
+    ON CrashLocations USING GIST ((Location::geometry)) WHERE InvolvedBicycle > 0;
+CREATE INDEX IF NOT EXISTS CrashLocations_Motorcycle_idx
+    ON CrashLocations USING GIST ((Location::geometry)) WHERE InvolvedMotorcycle > 0;
+"""
+
+# Crash counts and casualties rolled up by year, council, severity, nature,
+# type and vehicle involvement, so api_server's /stats endpoint can answer
+# group-by queries without scanning CrashLocations. Rebuilt by build_crash_stats.
+CREATE_CRASH_STATS_TABLE = """
+CREATE TABLE IF NOT EXISTS CrashStats (
+    Year SMALLINT NOT NULL,
+    Council VARCHAR(255),
+    SeverityID SMALLINT NOT NULL,
+    NatureID SMALLINT NOT NULL,
+    TypeID SMALLINT NOT NULL,
+    Car BOOLEAN NOT NULL,
+    Motorcycle BOOLEAN NOT NULL,
+    Truck BOOLEAN NOT NULL,
+    Bus BOOLEAN NOT NULL,
+    Bicycle BOOLEAN NOT NULL,
+    Pedestrian BOOLEAN NOT NULL,
+    Other BOOLEAN NOT NULL,
+    Crashes INTEGER NOT NULL,
+    CasualtyFatality INTEGER NOT NULL,
+    CasualtyHospital INTEGER NOT NULL,
+    CasualtyMedicallyTreated INTEGER NOT NULL,
+    CasualtyMinorInjury INTEGER NOT NULL
 );
+-- Tables created before these columns existed, refilled by build_crash_stats
+ALTER TABLE CrashStats
+    ADD COLUMN IF NOT EXISTS Car BOOLEAN NOT NULL DEFAULT FALSE,
+    ADD COLUMN IF NOT EXISTS Other BOOLEAN NOT NULL DEFAULT FALSE;
+CREATE INDEX IF NOT EXISTS CrashStats_Year_idx
+    ON CrashStats (Year);
+"""
+
+# DELETE rather than TRUNCATE: TRUNCATE takes an ACCESS EXCLUSIVE lock that
+# would block every /stats query until the rebuild commits, while with DELETE
+# they keep reading the previous rows. The table is small, so the dead rows
+# left for autovacuum are too.
+BUILD_CRASH_STATS = """
+DELETE FROM CrashStats;
+INSERT INTO CrashStats (Year, Council, SeverityID, NatureID, TypeID,
+    Car, Motorcycle, Truck, Bus, Bicycle, Pedestrian, Other,
+    Crashes, CasualtyFatality, CasualtyHospital, CasualtyMedicallyTreated, CasualtyMinorInjury)
+SELECT EXTRACT(YEAR FROM CrashDate)::smallint, Council, SeverityID, NatureID, TypeID,
+    InvolvedCar > 0, InvolvedMotorcycle > 0, InvolvedTruck > 0, InvolvedBus > 0,
+    InvolvedBicycle > 0, InvolvedPedestrian > 0, InvolvedOther > 0,
+    count(*), sum(CasualtyFatality), sum(CasualtyHospital),
+    sum(CasualtyMedicallyTreated), sum(CasualtyMinorInjury)
+FROM CrashLocations
+GROUP BY 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12;
 """
 
 CREATE_ROAD_CENSUS_TABLE = """
 CREATE TABLE IF NOT EXISTS CensusLocations (
-    ID INTEGER PRIMARY KEY, -- Record ID
+    ID INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY, -- Record ID
     SiteID INTEGER NOT NULL,
     Year SMALLINT NOT NULL,
     Location GEOGRAPHY NOT NULL,
@@ -109,6 +210,110 @@ CREATE TABLE IF NOT EXISTS CensusLocations (
 );
 """
 
+# One row per census file that has been fully loaded, written in the same
+# transaction as its rows so an interrupted import resumes where it stopped.
+CREATE_CENSUS_IMPORTS_TABLE = """
+CREATE TABLE IF NOT EXISTS CensusImports (
+    Source TEXT PRIMARY KEY, -- URL or path of the file
+    Rows INTEGER NOT NULL,
+    ImportedAt TIMESTAMP NOT NULL DEFAULT now()
+);
+"""
+
+# Accepted header names (upper case) of the census CSV columns, as the
+# yearly files are not consistent.
+CENSUS_COLUMN_NAMES = {
+    'SiteID': ('SITE_ID', 'SITEID', 'SITE'),
+    'Year': ('AADT_YEAR', 'TRAFFIC_YEAR', 'YEAR'),
+    'AADT': ('AADT', 'AADT_VALUE', 'ALL_VEHICLES_AADT'),
+    'PcntHV': ('PC_HV', 'PCNT_HV', 'PERCENT_HV', 'HV_PERCENT'),
+    'Longitude': ('LONGITUDE', 'LONG', 'GDA94_LONGITUDE', 'LONGITUDE_GDA94'),
+    'Latitude': ('LATITUDE', 'LAT', 'GDA94_LATITUDE', 'LATITUDE_GDA94'),
+}
+
+# The geography index serves the NearestAADT KNN join, the geometry index the
+# viewport filter of api_server.list_census_sites.
+CREATE_ROAD_CENSUS_INDEXES = """
+CREATE INDEX IF NOT EXISTS CensusLocations_Location_idx
+    ON CensusLocations USING GIST (Location);
+CREATE INDEX IF NOT EXISTS CensusLocations_Location_geom_idx
+    ON CensusLocations USING GIST ((Location::geometry));
+CREATE INDEX IF NOT EXISTS CensusLocations_SiteID_Year_idx
+    ON CensusLocations (SiteID, Year DESC);
+"""
+
+# Most recent census record of every site, so list_census_sites with
+# onlylatest is a spatial index scan instead of a DISTINCT ON over all years.
+# The unique index allows refreshing it concurrently.
+CREATE_LATEST_CENSUS_LOCATIONS_VIEW = """
+CREATE MATERIALIZED VIEW IF NOT EXISTS LatestCensusLocations AS
+    SELECT DISTINCT ON (SiteID) ID, SiteID, Year, Location, AADT, PcntHV
+    FROM CensusLocations
+    ORDER BY SiteID, Year DESC, ID DESC;
+CREATE UNIQUE INDEX IF NOT EXISTS LatestCensusLocations_SiteID_idx
+    ON LatestCensusLocations (SiteID);
+CREATE INDEX IF NOT EXISTS LatestCensusLocations_Location_idx
+    ON LatestCensusLocations USING GIST ((Location::geometry));
+"""
+
+REFRESH_LATEST_CENSUS_LOCATIONS_VIEW = """
+REFRESH MATERIALIZED VIEW CONCURRENTLY LatestCensusLocations;
+"""
+
+# Crashes get the AADT of the nearest census site counted within this many
+# years of the crash, preferring the closest year at that site.
+NEAREST_AADT_MAX_YEAR_GAP = 3
+
+# KNN join against the GiST index on CensusLocations.Location. {crashes} is
+# the table the crashes to update are read from, filtered by {condition} on
+# both sides so the update only touches the relevant partitions.
+UPDATE_NEAREST_AADT = """
+UPDATE CrashLocations c
+SET NearestAADT = nearest.AADT
+FROM (
+    SELECT crash.ID, crash.CrashDate, census.AADT
+    FROM {crashes} crash
+    CROSS JOIN LATERAL (
+        SELECT cl.AADT
+        FROM CensusLocations cl
+        WHERE cl.Year BETWEEN EXTRACT(YEAR FROM crash.CrashDate)::int - $1
+            AND EXTRACT(YEAR FROM crash.CrashDate)::int + $1
+        ORDER BY cl.Location <-> crash.Location, ABS(cl.Year - EXTRACT(YEAR FROM crash.CrashDate)::int)
+        LIMIT 1
+    ) census
+    WHERE {condition}
+) nearest
+WHERE c.ID = nearest.ID AND c.CrashDate = nearest.CrashDate
+AND {target_condition};
+"""
+
+# Crashes between $2 (inclusive) and $3 (exclusive)
+NEAREST_AADT_DATE_RANGE = "{alias}.CrashDate >= $2 AND {alias}.CrashDate < $3"
+
+# Hash of the raw CSV row of each crash, used by the incremental loader to
+# skip rows that have not changed since they were loaded.
+CREATE_CRASH_ROW_HASHES_TABLE = """
+CREATE TABLE IF NOT EXISTS CrashRowHashes (
+    ID INTEGER PRIMARY KEY, -- Crash_Ref_Number
+    RowHash BYTEA NOT NULL
+);
+"""
+
+# Staging tables of the incremental loader, emptied after every chunk
+CREATE_INCREMENTAL_STAGING_TABLES = """
+CREATE TEMPORARY TABLE IF NOT EXISTS CrashLocations_Staging
+    (LIKE CrashLocations INCLUDING DEFAULTS)
+    ON COMMIT DELETE ROWS;
+CREATE TEMPORARY TABLE IF NOT EXISTS CrashRowHashes_Staging
+    (LIKE CrashRowHashes)
+    ON COMMIT DELETE ROWS;
+"""
+
+# Notified once an import has finished, so the API server can drop its caches
+DATA_CHANGED_CHANNEL = 'data_changed'
+
+CENSUS_LOCATIONS_COLUMNS = ('siteid', 'year', 'location', 'aadt', 'pcnthv')
+
 CRASH_SEVERITIES = {
     1: "Fatal",
     2: "Hospitalisation",
@@ -215,6 +420,89 @@ CRASH_ATMOSPHERIC_CONDITIONS = {
     4: "Smoke/Dust",
 }
 
+# Name to ID lookups for the COPY loader, matching seed_data.sql by ID
+SEVERITY_IDS = {name: i for i, name in CRASH_SEVERITIES.items()}
+NATURE_IDS = {name: i for i, name in CRASH_NATURE.items()}
+TYPE_IDS = {name: i for i, name in CRASH_TYPES.items()}
+ROADWAY_FEATURE_IDS = {name: i for i, name in CRASH_ROADWAY_FEATURES.items()}
+TRAFFIC_CONTROL_IDS = {name: i for i, name in CRASH_TRAFFIC_CONTROL.items()}
+ATMOSPHERIC_CONDITION_IDS = {name: i for i, name in CRASH_ATMOSPHERIC_CONDITIONS.items()}
+
+# Column order of the records built by crash_copy_record
+CRASH_LOCATIONS_COLUMNS = (
+    'id',
+    'severityindex',
+    'nearestaadt',
+    'severityid',
+    'natureid',
+    'typeid',
+    'roadwayfeatureid',
+    'trafficcontrolid',
+    'atmosphericconditionid',
+    'crashdate',
+    'location',
+    'street',
+    'streetintersecting',
+    'suburb',
+    'council',
+    'postcode',
+    'speedlimit',
+    'sealed',
+    'dry',
+    'day',
+    'lit',
+    'partialdaylight',
+    'approachbearing',
+    'description',
+    'involvedgroupdescription',
+    'casualtyfatality',
+    'casualtyhospital',
+    'casualtymedicallytreated',
+    'casualtyminorinjury',
+    'involvedcar',
+    'involvedmotorcycle',
+    'involvedtruck',
+    'involvedbus',
+    'involvedbicycle',
+    'involvedpedestrian',
+    'involvedother',
+)
+
+# Month names as used in Crash_Month
+MONTH_NUMBERS = {
+    'January': 1, 'February': 2, 'March': 3, 'April': 4, 'May': 5, 'June': 6,
+    'July': 7, 'August': 8, 'September': 9, 'October': 10, 'November': 11, 'December': 12,
+}
+
+# Little endian EWKB point type with the SRID flag set
+EWKB_POINT_WITH_SRID = 0x20000001
+
+COPY_BATCH_SIZE = 10000
+
+# Blocks of the crash CSV queued per worker process in the copy loader
+TRANSFORM_QUEUE_PER_WORKER = 2
+
+# Rows per transaction of the incremental loader
+INCREMENTAL_CHUNK_SIZE = 5000
+
+# Moves the staged rows of the incremental loader into place
+UPSERT_STAGED_CRASHES = """
+DELETE FROM CrashLocations c
+USING CrashLocations_Staging s
+WHERE c.ID = s.ID AND c.CrashDate <> s.CrashDate;
+
+INSERT INTO CrashLocations
+SELECT * FROM CrashLocations_Staging
+ON CONFLICT (ID, CrashDate) DO UPDATE SET
+""" + ",\n".join(f"    {c} = EXCLUDED.{c}" for c in CRASH_LOCATIONS_COLUMNS if c not in ('id', 'crashdate')) + """;
+
+INSERT INTO CrashRowHashes
+SELECT * FROM CrashRowHashes_Staging
+ON CONFLICT (ID) DO UPDATE SET RowHash = EXCLUDED.RowHash;
+"""
+
+# Bytes read from the network or disk at a time when parsing CSVs
+CSV_CHUNK_SIZE = 1 << 20
 
 settings = {}
 
@@ -222,28 +510,493 @@ settings = {}
 with open('settings.json') as json_file:
     settings = json.load(json_file)
 
+# Where downloaded files are cached, None to always download
+download_cache_dir = settings.get('download_cache_dir', 'download_cache')
+
 '''
-CSV Line Generator.
+Chunk Generator.
 
-Accepts a URL and returns a series of dicts for each line in the CSV.
+Accepts a URL or a local file path and returns its contents in chunks of
+roughly CSV_CHUNK_SIZE bytes. URLs are kept in download_cache_dir and
+revalidated with ETag/Last-Modified, so unchanged files are read from disk.
 '''
-async def read_csv_by_line(url):
+async def read_chunks(source):
+    if not source.startswith(('http://', 'https://')):
+        for chunk in read_file_chunks(source):
+            yield chunk
+        return
+
+    headers = {}
+    if download_cache_dir is not None:
+        data_path, meta_path = download_cache_paths(source)
+        if os.path.exists(data_path) and os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+
     async with aiohttp.ClientSession(raise_for_status=True) as session:
-        keys = None
-        async with session.get(url) as r:
-            async for line in r.content:
-                dataline = line.decode("utf-8").strip().split(',')
-                if keys == None:
-                    keys = dataline
-                else:
-                    data = dict(zip(keys,dataline))
-                    yield data
+        async with session.get(source, headers=headers) as r:
+            if r.status == 304:
+                print(f"Using cached copy of {source}")
+                for chunk in read_file_chunks(data_path):
+                    yield chunk
+                return
+
+            if download_cache_dir is None:
+                async for chunk in r.content.iter_chunked(CSV_CHUNK_SIZE):
+                    yield chunk
+                return
+
+            # Written next to the cached copy and only swapped in once complete
+            os.makedirs(download_cache_dir, exist_ok=True)
+            partial_path = data_path + '.part'
+            complete = False
+            try:
+                with open(partial_path, 'wb') as f:
+                    async for chunk in r.content.iter_chunked(CSV_CHUNK_SIZE):
+                        f.write(chunk)
+                        yield chunk
+                complete = True
+            finally:
+                if complete:
+                    os.replace(partial_path, data_path)
+                    with open(meta_path, 'w') as f:
+                        json.dump({
+                            'url': source,
+                            'etag': r.headers.get('ETag'),
+                            'last_modified': r.headers.get('Last-Modified'),
+                        }, f)
+                elif os.path.exists(partial_path):
+                    os.remove(partial_path)
+
+'''
+Reads a local file in chunks of CSV_CHUNK_SIZE bytes
+'''
+def read_file_chunks(path):
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(CSV_CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+'''
+Paths of the cached copy of a URL and of its ETag/Last-Modified metadata
+'''
+def download_cache_paths(url):
+    key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+    return (os.path.join(download_cache_dir, key + '.data'),
+        os.path.join(download_cache_dir, key + '.json'))
+
+'''
+Returns the offset just past the last complete record in text, i.e. the last
+newline that is not inside a quoted field.
+'''
+def complete_records_end(text):
+    quotes_after = 0
+    end = len(text)
+    total_quotes = text.count('"')
+    newline = text.rfind('\n')
+    while newline >= 0:
+        quotes_after += text.count('"', newline, end)
+        if (total_quotes - quotes_after) % 2 == 0:
+            return newline + 1
+        end = newline
+        newline = text.rfind('\n', 0, newline)
+    return 0
+
+'''
+CSV Block Generator.
+
+Accepts a URL or local file path and returns its decoded text in blocks of
+whole CSV records, split at newlines outside quoted fields.
+'''
+async def read_csv_blocks(source):
+    decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    pending = ''
+
+    async for chunk in read_chunks(source):
+        text = pending + decoder.decode(chunk)
+        end = complete_records_end(text)
+        pending = text[end:]
+        if end:
+            yield text[:end]
+
+    text = pending + decoder.decode(b'', final=True)
+    if text:
+        yield text
+
+'''
+Parses a block of whole RFC 4180 CSV records (quoted fields may contain
+commas, quotes and newlines) into a list of rows, skipping blank lines.
+'''
+def parse_csv_block(text):
+    return [row for row in csv.reader(io.StringIO(text, newline='')) if row]
+
+'''
+Maps each header name of a CSV to its column index
+'''
+def csv_columns(header):
+    return {name.strip(): i for i, name in enumerate(header)}
+
+'''
+Splits the header row off the first block of a CSV. The header is assumed
+not to contain quoted newlines.
+'''
+def split_csv_header(text):
+    newline = text.find('\n')
+    if newline < 0:
+        newline = len(text)
+    return csv_columns(next(csv.reader([text[:newline]]))), text[newline + 1:]
+
+'''
+CSV Batch Generator.
+
+Accepts a URL or local file path and parses it as RFC 4180 CSV. Yields
+(columns, rows) once per block, where columns maps each header name to its
+index and rows is a list of rows, each a list of strings in header order.
+'''
+async def read_csv_batches(source):
+    columns = None
+    async for block in read_csv_blocks(source):
+        rows = parse_csv_block(block)
+
+        if columns is None and rows:
+            columns = csv_columns(rows[0])
+            rows = rows[1:]
+
+        if rows:
+            yield columns, rows
+
+'''
+Little endian EWKB of a GDA94 point, which is also the binary format of geography
+'''
+def ewkb_point(longitude, latitude):
+    return struct.pack('<BIIdd', 1, EWKB_POINT_WITH_SRID, 4283, longitude, latitude)
+
+'''
+Sends and receives geography as raw EWKB bytes, see ewkb_point
+'''
+async def set_ewkb_codec(conn):
+    await conn.set_type_codec('geography', encoder=bytes, decoder=bytes, format='binary')
+
+'''
+Unknown or blank counts and codes in the CSVs are treated as zero
+'''
+def int_or_zero(value):
+    try:
+        return int(value)
+    except ValueError:
+        return 0
+
+'''
+Converts a crash CSV row, with c mapping the header names to indexes, into the
+argument list of the INSERT statement in insert_crashdata. Lookup columns are
+still names at this point. Returns None for crashes without a location.
+'''
+def crash_insert_args(row, c):
+    if row[c['Crash_Longitude_GDA94']] == '0':
+        return None
+
+    return [
+            int_or_zero(row[c['Crash_Ref_Number']]),
+            row[c['Crash_Severity']],
+            row[c['Crash_Nature']],
+            row[c['Crash_Type']],
+            row[c['Crash_Roadway_Feature']],
+            row[c['Crash_Traffic_Control']],
+            row[c['Crash_Atmospheric_Condition']],
+            datetime.datetime(int(row[c['Crash_Year']]), MONTH_NUMBERS[row[c['Crash_Month']]], 1, int(row[c['Crash_Hour']])),
+            f"SRID=4283;POINT({row[c['Crash_Longitude_GDA94']]} {row[c['Crash_Latitude_GDA94']]})",
+            row[c['Crash_Street']],
+            row[c['Crash_Street_Intersecting']],
+            row[c['Loc_Suburb']],
+            row[c['Loc_Local_Government_Area']],
+            int_or_zero(row[c['Loc_Post_Code']]),
+            int(row[c['Crash_Speed_Limit']].split(' ')[-2]),
+            row[c['Crash_Road_Surface_Condition']].startswith('Sealed'),
+            row[c['Crash_Road_Surface_Condition']].endswith('Dry'),
+            row[c['Crash_Lighting_Condition']] == 'Daylight',
+            row[c['Crash_Lighting_Condition']] == 'Darkness - Lighted',
+            row[c['Crash_Lighting_Condition']] == 'Dawn/Dusk',
+            row[c['DCA_Key_Approach_Dir']],
+            row[c['Crash_DCA_Description']],
+            row[c['Crash_DCA_Group_Description']],
+            int_or_zero(row[c['Count_Casualty_Fatality']]),
+            int_or_zero(row[c['Count_Casualty_Hospitalised']]),
+            int_or_zero(row[c['Count_Casualty_MedicallyTreated']]),
+            int_or_zero(row[c['Count_Casualty_MinorInjury']]),
+            int_or_zero(row[c['Count_Unit_Car']]),
+            int_or_zero(row[c['Count_Unit_Motorcycle_Moped']]),
+            int_or_zero(row[c['Count_Unit_Truck']]),
+            int_or_zero(row[c['Count_Unit_Bus']]),
+            int_or_zero(row[c['Count_Unit_Bicycle']]),
+            int_or_zero(row[c['Count_Unit_Pedestrian']]),
+            int_or_zero(row[c['Count_Unit_Other']])
+        ]
+
+'''
+Fingerprint of a raw CSV row, to detect changed crashes between imports
+'''
+def crash_row_hash(row):
+    return hashlib.blake2b('\x1f'.join(row).encode('utf-8'), digest_size=16).digest()
+
+'''
+Converts a crash CSV row into a record matching CRASH_LOCATIONS_COLUMNS, with
+the lookup IDs resolved from the dictionaries above, the severity index
+calculated and the location encoded as EWKB. Returns None for crashes without
+a location and raises KeyError for unknown severities, natures and types.
+'''
+def crash_copy_record(row, c):
+    args = crash_insert_args(row, c)
+    if args is None:
+        return None
+
+    casualties = args[23:27]
+    units = args[27:34]
+    severity_index = 30*casualties[0] + 10*casualties[1] + 5*casualties[2] + casualties[3] + 2*sum(units)
+
+    location = ewkb_point(float(row[c['Crash_Longitude_GDA94']]), float(row[c['Crash_Latitude_GDA94']]))
+
+    return (
+        args[0],
+        severity_index,
+        None, # NearestAADT, filled in by update_nearest_aadt
+        SEVERITY_IDS[args[1]],
+        NATURE_IDS[args[2]],
+        TYPE_IDS[args[3]],
+        ROADWAY_FEATURE_IDS.get(args[4]),
+        TRAFFIC_CONTROL_IDS.get(args[5]),
+        ATMOSPHERIC_CONDITION_IDS.get(args[6]),
+        args[7],
+        location,
+        *args[9:],
+    )
+
+'''
+Reads crash data CSV and imports it with either loader, reporting the rows/sec.
+
+- copy: resolves everything client side, in workers processes, and streams it
+  with COPY through a staging table, see copy_crashdata
+- incremental: upserts only new and changed rows in small transactions,
+  see incremental_crashdata
+- insert: prepared INSERT in batches of 100 rows, see insert_crashdata
+'''
+async def import_crashdata(db, loader="copy", workers=0, source=ROAD_CRASHES_URL):
+    start = time.perf_counter()
+
+    if loader == "copy":
+        num_rows = await copy_crashdata(db, workers, source)
+    elif loader == "incremental":
+        num_rows = await incremental_crashdata(db, source)
+    else:
+        num_rows = await insert_crashdata(db, source)
+
+    elapsed = time.perf_counter() - start
+    print(f"\nCopied crashdata: {num_rows} rows in {elapsed:.1f}s ({num_rows / elapsed:.0f} rows/sec, {loader} loader)")
+    return num_rows
+
+'''
+Streams crash records into a temporary staging table with COPY in batches of
+COPY_BATCH_SIZE, then moves them into CrashLocations with a single INSERT.
+Rows already in CrashLocations are left untouched. The CSV is parsed and
+transformed by a pool of worker processes, see transform_crash_blocks.
+'''
+async def copy_crashdata(db, workers, source=ROAD_CRASHES_URL):
+    await set_ewkb_codec(db)
+
+    queue = []
+    hashes = []
+    num = 0
+    async with db.transaction():
+        await db.execute("""
+            CREATE TEMPORARY TABLE CrashLocations_Staging
+            (LIKE CrashLocations INCLUDING DEFAULTS)
+            ON COMMIT DROP;
+            CREATE TEMPORARY TABLE CrashRowHashes_Staging
+            (LIKE CrashRowHashes)
+            ON COMMIT DROP;
+        """)
+
+        async for records, record_hashes in transform_crash_blocks(source, workers):
+            queue.extend(records)
+            hashes.extend(record_hashes)
+            num += len(records)
+
+            if len(queue) >= COPY_BATCH_SIZE:
+                await copy_to_staging(db, queue, hashes)
+                queue = []
+                hashes = []
+                sys.stdout.write("\r Processing record: %i" % num)
+                sys.stdout.flush()
+
+        if queue:
+            await copy_to_staging(db, queue, hashes)
+
+        # Only insert crashes whose ID is new: the primary key includes
+        # CrashDate, so a crash whose date changed would otherwise be added a
+        # second time. Only record hashes of rows that were actually inserted,
+        # so rows that already existed are picked up by the next incremental
+        # import.
+        await db.execute("""
+            INSERT INTO CrashRowHashes
+            SELECT s.* FROM CrashRowHashes_Staging s
+            WHERE NOT EXISTS (SELECT 1 FROM CrashLocations c WHERE c.ID = s.ID)
+            ON CONFLICT DO NOTHING;
+            INSERT INTO CrashLocations
+            SELECT * FROM CrashLocations_Staging s
+            WHERE NOT EXISTS (SELECT 1 FROM CrashLocations c WHERE c.ID = s.ID)
+            ON CONFLICT DO NOTHING;
+        """)
+
+    return num
+
+'''
+Parses a block of crash CSV records and converts them with crash_copy_record.
+Returns the records and their (ID, row hash) pairs. Runs in the worker
+processes of transform_crash_blocks.
+'''
+def transform_crash_block(text, columns):
+    records = []
+    hashes = []
+    for row in parse_csv_block(text):
+        try:
+            record = crash_copy_record(row, columns)
+        except:
+            print(f"Record failed")
+            continue
+
+        if record is not None:
+            records.append(record)
+            hashes.append((record[0], crash_row_hash(row)))
+
+    return records, hashes
+
+'''
+Yields (records, hashes) batches from transform_crash_block for each block of
+the crash CSV, in file order.
+
+With workers > 0 the blocks are transformed in that many processes while the
+caller writes earlier batches to the database. At most TRANSFORM_QUEUE_PER_WORKER
+blocks per worker are in flight, so reading stops when the writer falls behind.
+With workers == 0 everything runs in this process.
+'''
+async def transform_crash_blocks(source, workers):
+    blocks = read_csv_blocks(source)
+    columns = None
+
+    if workers == 0:
+        async for block in blocks:
+            if columns is None:
+                columns, block = split_csv_header(block)
+            yield transform_crash_block(block, columns)
+        return
+
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=workers * TRANSFORM_QUEUE_PER_WORKER)
+    executor = concurrent.futures.ProcessPoolExecutor(workers)
+
+    async def submit_blocks():
+        columns = None
+        async for block in blocks:
+            if columns is None:
+                columns, block = split_csv_header(block)
+            await queue.put(loop.run_in_executor(executor, transform_crash_block, block, columns))
+        await queue.put(None)
+
+    reader = asyncio.ensure_future(submit_blocks())
+    try:
+        while True:
+            batch = await queue.get()
+            if batch is None:
+                break
+            yield await batch
+        await reader
+    finally:
+        reader.cancel()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+'''
+COPYs crash records and their row hashes into the staging tables
+'''
+async def copy_to_staging(db, records, hashes):
+    await db.copy_records_to_table('crashlocations_staging',
+        records=records, columns=CRASH_LOCATIONS_COLUMNS)
+    await db.copy_records_to_table('crashrowhashes_staging',
+        records=hashes, columns=('id', 'rowhash'))
+
+'''
+Only loads crashes that are new or whose CSV row changed since the last
+import, judged by CrashRowHashes. Changed rows are upserted in transactions
+of INCREMENTAL_CHUNK_SIZE rows together with their NearestAADT, so an error
+only loses the current chunk and a re-run continues from there.
+Crashes that disappeared from the file are kept.
+'''
+async def incremental_crashdata(db, source=ROAD_CRASHES_URL):
+    await set_ewkb_codec(db)
+    await db.execute(CREATE_INCREMENTAL_STAGING_TABLES)
+
+    known_hashes = dict(await db.fetch("SELECT ID, RowHash FROM CrashRowHashes"))
+
+    queue = []
+    hashes = []
+    num = 0
+    changed = 0
+    async for columns, rows in read_csv_batches(source):
+        id_index = columns['Crash_Ref_Number']
+        for row in rows:
+            row_hash = crash_row_hash(row)
+            if known_hashes.get(int_or_zero(row[id_index])) == row_hash:
+                num += 1
+                continue
+
+            try:
+                record = crash_copy_record(row, columns)
+            except:
+                print(f"Record failed")
+                continue
+
+            if record is not None:
+                queue.append(record)
+                hashes.append((record[0], row_hash))
+                num += 1
+
+            if len(queue) >= INCREMENTAL_CHUNK_SIZE:
+                await upsert_crash_chunk(db, queue, hashes)
+                changed += len(queue)
+                queue = []
+                hashes = []
+
+        sys.stdout.write("\r Processing record: %i, changed: %i" % (num, changed))
+        sys.stdout.flush()
+
+    if queue:
+        await upsert_crash_chunk(db, queue, hashes)
+        changed += len(queue)
+
+    print(f"\n{changed} new or changed crashes")
+    return num
+
+'''
+Upserts one chunk of new or changed crashes in a single transaction. A crash
+whose date moved to another year is deleted from its old partition first.
+'''
+async def upsert_crash_chunk(db, records, hashes):
+    async with db.transaction():
+        await copy_to_staging(db, records, hashes)
+        await db.execute(UPSERT_STAGED_CRASHES)
+        await db.execute(UPDATE_NEAREST_AADT.format(crashes="CrashLocations_Staging",
+                condition="TRUE", target_condition="c.ID IN (SELECT ID FROM CrashLocations_Staging)"),
+            NEAREST_AADT_MAX_YEAR_GAP)
 
 '''
 Reads crash data CSV, calculates the severity index, reformats where
 necessary and imports it in batches of 100 rows into the database
 '''
-async def import_crashdata(db):
+async def insert_crashdata(db, source=ROAD_CRASHES_URL):
     insert_row = """
         INSERT INTO CrashLocations
         (
@@ -302,15 +1055,7 @@ async def import_crashdata(db):
                     $34::int4
                 )
             ),
-            1,
-            --(
-            --    SELECT AADT
-            --    FROM CensusLocations cl
-            --    WHERE
-            --        EXTRACT(YEAR FROM TIMESTAMP $8) <= cl.Year
-            --    ORDER BY ST_Distance('SRID=4283;POINT($9 $10)', cl.Locations, false) DESC
-            --    LIMIT 1
-            --),
+            NULL, -- NearestAADT, filled in by update_nearest_aadt
             (SELECT ID FROM CrashSeverity WHERE NAME = $2),
             (SELECT ID FROM CrashNature WHERE NAME = $3),
             (SELECT ID FROM CrashType WHERE NAME = $4),
@@ -349,92 +1094,273 @@ async def import_crashdata(db):
     stmt = await db.prepare(insert_row)
 
     queue = []
-    num = 1
+    num = 0
     async with db.transaction():
-        async for data in read_csv_by_line(ROAD_CRASHES_URL):
-            try:
-                if data['Crash_Longitude_GDA94'] != '0':
-                    unknown_to_zero = (
-                            'Crash_Ref_Number',
-                            'Loc_Post_Code',
-                            'Count_Casualty_Fatality',
-                            'Count_Casualty_Hospitalised',
-                            'Count_Casualty_MedicallyTreated',
-                            'Count_Casualty_MinorInjury',
-                            'Count_Unit_Car',
-                            'Count_Unit_Motorcycle_Moped',
-                            'Count_Unit_Truck',
-                            'Count_Unit_Bus',
-                            'Count_Unit_Bicycle',
-                            'Count_Unit_Pedestrian',
-                            'Count_Unit_Other',
-                        )
-                    for key in unknown_to_zero:
-                        if key in data:
-                            try:
-                                data[key] = int(data[key])
-                            except:
-                                data[key] = 0
-
-                    args = [
-                            data['Crash_Ref_Number'],
-                            data['Crash_Severity'],
-                            data['Crash_Nature'],
-                            data['Crash_Type'],
-                            data['Crash_Roadway_Feature'],
-                            data['Crash_Traffic_Control'],
-                            data['Crash_Atmospheric_Condition'],
-                            datetime.datetime.strptime(f"{data['Crash_Year']} {data['Crash_Month']} {data['Crash_Hour']}", "%Y %B %H"),
-                            f"SRID=4283;POINT({data['Crash_Longitude_GDA94']} {data['Crash_Latitude_GDA94']})",
-                            data['Crash_Street'],
-                            data['Crash_Street_Intersecting'],
-                            data['Loc_Suburb'],
-                            data['Loc_Local_Government_Area'],
-                            data['Loc_Post_Code'],
-                            int(data['Crash_Speed_Limit'].split(' ')[-2]),
-                            data['Crash_Road_Surface_Condition'].startswith('Sealed'),
-                            data['Crash_Road_Surface_Condition'].endswith('Dry'),
-                            data['Crash_Lighting_Condition'] == 'Daylight',
-                            data['Crash_Lighting_Condition'] == 'Darkness - Lighted',
-                            data['Crash_Lighting_Condition'] == 'Dawn/Dusk',
-                            data['DCA_Key_Approach_Dir'],
-                            data['Crash_DCA_Description'],
-                            data['Crash_DCA_Group_Description'],
-                            data['Count_Casualty_Fatality'],
-                            data['Count_Casualty_Hospitalised'],
-                            data['Count_Casualty_MedicallyTreated'],
-                            data['Count_Casualty_MinorInjury'],
-                            data['Count_Unit_Car'],
-                            data['Count_Unit_Motorcycle_Moped'],
-                            data['Count_Unit_Truck'],
-                            data['Count_Unit_Bus'],
-                            data['Count_Unit_Bicycle'],
-                            data['Count_Unit_Pedestrian'],
-                            data['Count_Unit_Other']
-                        ]
-
-                    queue.append(args)
-
-                    if len(queue) >= 100:
-                        await stmt.executemany(queue)
-                        queue = []
-            except:
-                print(f"Record failed")
+        async for columns, rows in read_csv_batches(source):
+            for row in rows:
+                try:
+                    args = crash_insert_args(row, columns)
+                    if args is not None:
+                        queue.append(args)
+                        num += 1
+
+                        if len(queue) >= 100:
+                            await stmt.executemany(queue)
+                            queue = []
+                except:
+                    print(f"Record failed")
 
             sys.stdout.write("\r Processing record: %i" % num)
             sys.stdout.flush()
-            num += 1
 
-    print(f"Copied crashdata.")
+        if queue:
+            await stmt.executemany(queue)
 
-async def run():
-    db = await asyncpg.connect(user=settings['psql_user'], password=settings['psql_pass'],
-        database=settings['psql_dbname'], host=settings['psql_host'])
+    return num
 
+'''
+Finds the index of each CensusLocations column from the header names of a
+census CSV. Returns a dict of column to index, Year and PcntHV may be missing.
+'''
+def census_header_map(columns):
+    normalised = {name.strip().upper(): i for name, i in columns.items()}
+
+    header_map = {}
+    for column, names in CENSUS_COLUMN_NAMES.items():
+        for name in names:
+            if name in normalised:
+                header_map[column] = normalised[name]
+                break
+
+    missing = {'SiteID', 'AADT', 'Longitude', 'Latitude'} - header_map.keys()
+    if missing:
+        raise ValueError(f"Census file is missing columns: {', '.join(sorted(missing))}")
+
+    return header_map
+
+'''
+Converts a census CSV row into a record matching CENSUS_LOCATIONS_COLUMNS.
+Returns None for rows without a usable location or count.
+'''
+def census_record(row, header_map, default_year):
+    try:
+        longitude = float(row[header_map['Longitude']])
+        latitude = float(row[header_map['Latitude']])
+        aadt = int(float(row[header_map['AADT']]))
+        site_id = int(row[header_map['SiteID']])
+    except (ValueError, IndexError):
+        return None
+
+    if longitude == 0 or latitude == 0:
+        return None
+
+    year = default_year
+    if 'Year' in header_map:
+        try:
+            year = int(row[header_map['Year']])
+        except (ValueError, IndexError):
+            pass
+
+    pcnt_hv = None
+    if 'PcntHV' in header_map:
+        try:
+            pcnt_hv = decimal.Decimal(row[header_map['PcntHV']]).quantize(decimal.Decimal('0.01'))
+        except (decimal.InvalidOperation, IndexError):
+            pass
+
+    return (site_id, year, ewkb_point(longitude, latitude), aadt, pcnt_hv)
+
+'''
+Loads a single census file. The rows and the CensusImports checkpoint are
+written in one transaction, so a file is either fully loaded or not at all.
+'''
+async def import_census_file(pool, download_limit, year, source):
+    async with pool.acquire() as db:
+        if await db.fetchval("SELECT 1 FROM CensusImports WHERE Source = $1", source):
+            print(f"Census {year}: already imported, skipping")
+            return 0
+
+        num = 0
+        skipped = 0
+        async with download_limit, db.transaction():
+            header_map = None
+            queue = []
+            async for columns, rows in read_csv_batches(source):
+                if header_map is None:
+                    header_map = census_header_map(columns)
+
+                for row in rows:
+                    record = census_record(row, header_map, year)
+                    if record is None:
+                        skipped += 1
+                        continue
+
+                    queue.append(record)
+                    num += 1
+
+                if len(queue) >= COPY_BATCH_SIZE:
+                    await db.copy_records_to_table('censuslocations',
+                        records=queue, columns=CENSUS_LOCATIONS_COLUMNS)
+                    queue = []
+
+            if queue:
+                await db.copy_records_to_table('censuslocations',
+                    records=queue, columns=CENSUS_LOCATIONS_COLUMNS)
+
+            await db.execute("INSERT INTO CensusImports (Source, Rows) VALUES ($1, $2)", source, num)
+
+    print(f"Census {year}: imported {num} rows, skipped {skipped}")
+    return num
+
+'''
+Imports the census files concurrently, with at most max_downloads being
+fetched at once. Files that were already imported are skipped, so an
+interrupted run can simply be started again.
+
+sources maps the census year to a URL or a local file path.
+'''
+async def import_censusdata(pool, sources=ROAD_CENSUS_URLS, max_downloads=4):
+    start = time.perf_counter()
+    download_limit = asyncio.Semaphore(max_downloads)
+
+    results = await asyncio.gather(
+        *[import_census_file(pool, download_limit, year, source) for year, source in sorted(sources.items())],
+        return_exceptions=True)
+
+    num_rows = 0
+    for (year, source), result in zip(sorted(sources.items()), results):
+        if isinstance(result, Exception):
+            print(f"Census {year}: failed to import {source}: {result}")
+        else:
+            num_rows += result
+
+    elapsed = time.perf_counter() - start
+    print(f"Copied census data: {num_rows} rows in {elapsed:.1f}s ({num_rows / elapsed:.0f} rows/sec)")
+    return num_rows
+
+'''
+Fills CrashLocations.NearestAADT once both tables are loaded. The work is
+split into one chunk per crash partition and the chunks run concurrently on
+the pool.
+'''
+async def update_nearest_aadt(pool):
+    start = time.perf_counter()
+
+    years = list(CRASH_PARTITION_YEARS)
+    chunks = [(datetime.datetime(year, 1, 1), datetime.datetime(year + 1, 1, 1)) for year in years]
+    # Whatever ended up in the default partition
+    chunks.append((datetime.datetime.min, datetime.datetime(years[0], 1, 1)))
+    chunks.append((datetime.datetime(years[-1] + 1, 1, 1), datetime.datetime.max))
+
+    async def update_chunk(chunk_start, chunk_end):
+        async with pool.acquire() as db:
+            status = await db.execute(UPDATE_NEAREST_AADT.format(crashes="CrashLocations",
+                    condition=NEAREST_AADT_DATE_RANGE.format(alias="crash"),
+                    target_condition=NEAREST_AADT_DATE_RANGE.format(alias="c")),
+                NEAREST_AADT_MAX_YEAR_GAP, chunk_start, chunk_end)
+        return int(status.split()[-1])
+
+    results = await asyncio.gather(*[update_chunk(*chunk) for chunk in chunks])
+
+    elapsed = time.perf_counter() - start
+    print(f"Updated NearestAADT of {sum(results)} crashes in {elapsed:.1f}s")
+
+'''
+Rebuilds the CrashStats summary table from CrashLocations in one transaction.
+The old rows are deleted rather than truncated, so the API keeps reading the
+previous figures without waiting on a lock until the rebuild commits.
+'''
+async def build_crash_stats(db):
+    start = time.perf_counter()
+    async with db.transaction():
+        await db.execute(BUILD_CRASH_STATS)
+    await db.execute("ANALYZE CrashStats;")
+    num_rows = await db.fetchval("SELECT count(*) FROM CrashStats")
+    print(f"Built crash statistics: {num_rows} rows in {time.perf_counter() - start:.1f}s")
+
+'''
+Creates every table, partition, index and view the importer and the API use,
+if they don't exist yet
+'''
+async def create_tables(db):
     await db.execute(CREATE_CRASH_LOCATIONS_TABLE)
+    for year in CRASH_PARTITION_YEARS:
+        await db.execute(CREATE_CRASH_LOCATIONS_PARTITION.format(year=year, next_year=year + 1))
+    await db.execute(CREATE_CRASH_LOCATIONS_DEFAULT_PARTITION)
+    await db.execute(CREATE_CRASH_LOCATIONS_INDEXES)
+    await db.execute(CREATE_CRASH_ROW_HASHES_TABLE)
+    await db.execute(CREATE_CRASH_STATS_TABLE)
     await db.execute(CREATE_ROAD_CENSUS_TABLE)
+    await db.execute(CREATE_ROAD_CENSUS_INDEXES)
+    await db.execute(CREATE_CENSUS_IMPORTS_TABLE)
+    await db.execute(CREATE_LATEST_CENSUS_LOCATIONS_VIEW)
+
+async def run(args):
+    db = await asyncpg.connect(user=settings['psql_user'], password=settings['psql_pass'],
+        database=settings['psql_dbname'], host=settings['psql_host'])
+
+    await create_tables(db)
+
+    pool = await asyncpg.create_pool(user=settings['psql_user'], password=settings['psql_pass'],
+        database=settings['psql_dbname'], host=settings['psql_host'],
+        min_size=1, max_size=max(args.max_downloads, args.jobs), init=set_ewkb_codec)
+
+    if not args.skip_crashes:
+        await import_crashdata(db, args.loader, args.workers, args.crash_source)
+        await db.execute("ANALYZE CrashLocations;")
+        await build_crash_stats(db)
+
+    census_rows = 0
+    if not args.skip_census:
+        sources = dict(ROAD_CENSUS_URLS)
+        for override in args.census_source:
+            year, source = override.split('=', 1)
+            sources[int(year)] = source
+
+        census_rows = await import_censusdata(pool, sources, args.max_downloads)
+        await db.execute("ANALYZE CensusLocations;")
+        await db.execute(REFRESH_LATEST_CENSUS_LOCATIONS_VIEW)
+        await db.execute("ANALYZE LatestCensusLocations;")
+
+    if not args.skip_nearest_aadt:
+        # The incremental loader fills NearestAADT of the crashes it upserts, the
+        # rest only change when census files were added
+        if args.loader == "incremental" and not census_rows:
+            print("NearestAADT: no new census data, only the upserted crashes were updated")
+        else:
+            await update_nearest_aadt(pool)
+
+    await pool.close()
+
+    await db.execute(f"NOTIFY {DATA_CHANGED_CHANNEL};")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--loader', choices=("copy", "incremental", "insert"), default="copy",
+        help="load crashes with COPY through a staging table (default), upsert only new and "
+            "changed crashes, or use batched INSERTs")
+    parser.add_argument('--workers', type=int, default=max((os.cpu_count() or 1) - 1, 0),
+        help="processes parsing the crash CSV for the copy loader, 0 to parse in "
+            "the main process (default: one less than the number of CPUs)")
+    parser.add_argument('--skip-crashes', action='store_true', help="don't import the crash locations")
+    parser.add_argument('--skip-census', action='store_true', help="don't import the traffic census")
+    parser.add_argument('--crash-source', default=ROAD_CRASHES_URL, metavar='SOURCE',
+        help="load the crash locations from SOURCE (URL or file path) instead")
+    parser.add_argument('--census-source', action='append', default=[], metavar='YEAR=SOURCE',
+        help="load the census for YEAR from SOURCE (URL or file path) instead, can be repeated")
+    parser.add_argument('--max-downloads', type=int, default=4,
+        help="census files fetched and written concurrently (default 4)")
+    parser.add_argument('--skip-nearest-aadt', action='store_true',
+        help="don't fill in NearestAADT of the crashes from the census (with the incremental "
+            "loader it is only refilled for every crash when census rows were imported)")
+    parser.add_argument('--jobs', type=int, default=4,
+        help="concurrent database jobs for the NearestAADT update (default 4)")
+    parser.add_argument('--no-download-cache', action='store_true',
+        help="always download the files instead of revalidating the cached copies")
+    args = parser.parse_args()
 
-    await import_crashdata(db)
+    if args.no_download_cache:
+        download_cache_dir = None
 
-loop = asyncio.get_event_loop()
-loop.run_until_complete(run())
\ No newline at end of file
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(run(args))
\ No newline at end of file
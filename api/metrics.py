@@ -0,0 +1,124 @@
+'''
+Minimal Prometheus metrics: counters and histograms with labels, rendered in
+the text exposition format for the API server's /metrics endpoint.
+
+Metrics live in the process that records them, so with several workers every
+scrape of /metrics reports the worker that happened to answer it.
+'''
+import bisect
+import contextlib
+import time
+
+# Default histogram buckets, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Buckets for sizes, in bytes or rows
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+
+'''
+Renders a label set as {name="value",...}, or nothing if there are no labels
+'''
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for v in labels.values())
+    return '{' + ','.join(f'{k}="{v}"' for k, v in zip(labels, escaped)) + '}'
+
+class Counter:
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        # sorted label items -> value
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in self.values.items():
+            lines.append(f"{self.name}{format_labels(dict(key))} {value}")
+        return lines
+
+class Histogram:
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        # sorted label items -> [count per bucket (not cumulative), sum, count]
+        self.values = {}
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        entry = self.values.get(key)
+        if entry is None:
+            entry = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            entry[0][index] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    '''
+    Observes the seconds spent in the with block
+    '''
+    @contextlib.contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, (bucket_counts, total, count) in self.values.items():
+            labels = dict(key)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{format_labels(dict(labels, le=bound))} {cumulative}")
+            lines.append(f"{self.name}_bucket{format_labels(dict(labels, le='+Inf'))} {count}")
+            lines.append(f"{self.name}_sum{format_labels(labels)} {total}")
+            lines.append(f"{self.name}_count{format_labels(labels)} {count}")
+        return lines
+
+'''
+Values read when the metrics are rendered, e.g. counters kept by another
+object. function returns a list of (labels, value) pairs.
+'''
+class Callback:
+    def __init__(self, name, help, type, function):
+        self.name = name
+        self.help = help
+        self.type = type
+        self.function = function
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for labels, value in self.function():
+            lines.append(f"{self.name}{format_labels(labels)} {value}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, help):
+        return self.add(Counter(name, help))
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS):
+        return self.add(Histogram(name, help, buckets))
+
+    def callback(self, name, help, type, function):
+        return self.add(Callback(name, help, type, function))
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
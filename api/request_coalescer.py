@@ -0,0 +1,55 @@
+'''
+Shares the work of identical requests that arrive while the first one is
+still being answered, so a popular view missing the cache (e.g. just after
+an import cleared it) runs its query once rather than once per client.
+
+Every waiter is cancelled independently. The shared work is only cancelled,
+which cancels its Postgres query, once no client is waiting for it any more.
+'''
+import asyncio
+
+class RequestCoalescer:
+    def __init__(self, loop):
+        self.loop = loop
+        # key -> [task, number of waiters]
+        self.in_flight = {}
+        self.started = 0
+        self.coalesced = 0
+        self.cancelled = 0
+
+    '''
+    Returns the result of build(), a coroutine function, or of the build already
+    running under key
+    '''
+    async def run(self, key, build):
+        entry = self.in_flight.get(key)
+        if entry is None:
+            entry = self.in_flight[key] = [self.loop.create_task(build()), 0]
+            entry[0].add_done_callback(lambda task: self.finished(key, entry))
+            self.started += 1
+        else:
+            self.coalesced += 1
+
+        task = entry[0]
+        entry[1] += 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0 and not task.done():
+                # Later requests for key start again rather than share a cancelled build
+                self.finished(key, entry)
+                task.cancel()
+                self.cancelled += 1
+
+    def finished(self, key, entry):
+        if self.in_flight.get(key) is entry:
+            del self.in_flight[key]
+
+    def stats(self):
+        return {
+            'started': self.started,
+            'coalesced': self.coalesced,
+            'cancelled': self.cancelled,
+            'in_flight': len(self.in_flight),
+        }
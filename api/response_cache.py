@@ -0,0 +1,77 @@
+'''
+In-process cache of encoded API responses.
+
+Entries are evicted least recently used first once the total size of the
+cached bodies goes over the memory bound, and expire after an optional TTL.
+'''
+import collections
+import time
+
+class ResponseCache:
+    def __init__(self, max_bytes, ttl=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        # key -> (expiry time or None, body), least recently used first
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    '''
+    Returns the cached body for key, or None. Lookups with count=False, e.g.
+    for a variant of an entry already counted, are left out of the hit rate.
+    '''
+    def get(self, key, count=True):
+        entry = self.entries.get(key)
+        if entry is not None:
+            expires, body = entry
+            if expires is None or expires > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += count
+                return body
+            self.remove(key)
+
+        self.misses += count
+        return None
+
+    '''
+    Caches body under key. Bodies larger than the whole cache are not kept.
+    '''
+    def put(self, key, body):
+        if key in self.entries:
+            self.remove(key)
+        if len(body) > self.max_bytes:
+            return
+
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        self.entries[key] = (expires, body)
+        self.size += len(body)
+
+        while self.size > self.max_bytes:
+            _, (_, evicted) = self.entries.popitem(last=False)
+            self.size -= len(evicted)
+            self.evictions += 1
+
+    def remove(self, key):
+        _, body = self.entries.pop(key)
+        self.size -= len(body)
+
+    '''
+    Drops every entry, e.g. once an import has changed the data
+    '''
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'entries': len(self.entries),
+            'bytes': self.size,
+            'max_bytes': self.max_bytes,
+        }
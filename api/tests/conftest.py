@@ -0,0 +1,10 @@
+import os
+import sys
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+# The API modules are scripts run from the api directory, and read
+# settings.json from the working directory when imported
+sys.path.insert(0, API_DIR)
+os.chdir(API_DIR)
@@ -0,0 +1,74 @@
+'''
+Stand-ins for asyncpg connections and pools, so database code can be tested
+without Postgres
+'''
+import asyncio
+import contextlib
+
+class FakeConnection:
+    '''
+    results is a list of (SQL fragment, value): queries containing the
+    fragment return the value, others None. Every query is recorded, and with
+    a delay each one takes that many seconds.
+    '''
+    def __init__(self, results=(), delay=0):
+        self.results = list(results)
+        self.delay = delay
+        self.queries = []
+        self.copies = []
+        self.cancelled = 0
+
+    async def run(self, sql, args):
+        self.queries.append((sql, args))
+        if self.delay:
+            try:
+                await asyncio.sleep(self.delay)
+            except asyncio.CancelledError:
+                self.cancelled += 1
+                raise
+        for fragment, value in self.results:
+            if fragment in sql:
+                return value
+        return None
+
+    async def fetchval(self, sql, *args):
+        return await self.run(sql, args)
+
+    async def fetchrow(self, sql, *args):
+        return await self.run(sql, args)
+
+    async def fetch(self, sql, *args):
+        return await self.run(sql, args) or []
+
+    async def execute(self, sql, *args):
+        return await self.run(sql, args) or "OK"
+
+    async def copy_records_to_table(self, table, records, columns):
+        self.copies.append((table, list(records), columns))
+
+    @contextlib.asynccontextmanager
+    async def transaction(self):
+        yield
+
+    async def add_listener(self, channel, callback):
+        pass
+
+    async def close(self):
+        pass
+
+class FakePool:
+    def __init__(self, connection):
+        self.connection = connection
+
+    @contextlib.asynccontextmanager
+    async def acquire(self):
+        yield self.connection
+
+    def get_size(self):
+        return 1
+
+    def get_idle_size(self):
+        return 1
+
+    async def close(self):
+        pass
@@ -0,0 +1,114 @@
+import asyncio
+
+import aiohttp
+
+import api_server
+from fakes import FakeConnection, FakePool
+
+VIEWPORT = {"corner1": [152.9, -27.6], "corner2": [153.1, -27.4]}
+
+'''
+Runs test(session, url, connection, webserver) against a Webserver on a free
+local port, whose queries take delay seconds on a stand-in connection and
+return crashes as the JSON list
+'''
+def with_server(test, delay=0.5, crashes="[]"):
+    async def run():
+        connection = FakeConnection([("json_agg", crashes)], delay=delay)
+        webserver = api_server.Webserver(FakePool(connection), asyncio.get_running_loop())
+        await webserver.build_server('127.0.0.1', 0)
+        host, port = webserver.runner.addresses[0][:2]
+        try:
+            async with aiohttp.ClientSession() as session:
+                await test(session, f"http://{host}:{port}", connection, webserver)
+        finally:
+            await webserver.runner.cleanup()
+    asyncio.run(run())
+
+async def post(session, url, body, headers=None):
+    async with session.post(url, json=body, headers=headers) as r:
+        await r.read()
+        return r.status, r.headers.get('Retry-After')
+
+def test_identical_requests_share_one_query(monkeypatch):
+    monkeypatch.setitem(api_server.settings, 'client_max_requests', 0)
+
+    async def test(session, url, connection, webserver):
+        results = await asyncio.gather(*[post(session, url + "/list_crashes", VIEWPORT) for _ in range(12)])
+        assert [status for status, _ in results] == [200] * 12
+        assert len(connection.queries) == 1
+        assert webserver.coalescer.coalesced == 11
+    with_server(test)
+
+def test_disconnecting_client_cancels_its_query():
+    async def test(session, url, connection, webserver):
+        request = asyncio.ensure_future(post(session, url + "/list_crashes", VIEWPORT))
+        await asyncio.sleep(0.1)
+        request.cancel()
+        await asyncio.sleep(0.2)
+
+        assert connection.cancelled == 1
+        assert webserver.coalescer.in_flight == {}
+        assert 'db_queries_cancelled_total{query="list_crash_points"} 1' in webserver.metrics.render()
+    with_server(test)
+
+def test_query_keeps_running_for_remaining_clients():
+    async def test(session, url, connection, webserver):
+        leaving = asyncio.ensure_future(post(session, url + "/list_crashes", VIEWPORT))
+        staying = asyncio.ensure_future(post(session, url + "/list_crashes", VIEWPORT))
+        await asyncio.sleep(0.1)
+        leaving.cancel()
+
+        assert await staying == (200, None)
+        assert connection.cancelled == 0
+        assert len(connection.queries) == 1
+    with_server(test)
+
+def test_builds_started_before_data_changed_are_not_shared_or_cached():
+    async def test(session, url, connection, webserver):
+        stale = asyncio.ensure_future(post(session, url + "/list_crashes", VIEWPORT))
+        await asyncio.sleep(0.1)
+        webserver.on_data_changed(None, None, None, None)
+        fresh = asyncio.ensure_future(post(session, url + "/list_crashes", VIEWPORT))
+
+        assert await stale == (200, None)
+        assert webserver.response_cache.entries == {}
+        assert await fresh == (200, None)
+        assert len(connection.queries) == 2
+        assert len(webserver.response_cache.entries) == 1
+    with_server(test)
+
+def test_compressed_variants_do_not_count_as_misses():
+    large = "[" + ", ".join(f'{{"id": {i}, "severityindex": {i % 100}}}' for i in range(200)) + "]"
+    for crashes, variants in (("[]", 0), (large, 1)):
+        async def test(session, url, connection, webserver):
+            for _ in range(10):
+                async with session.post(url + "/list_crashes", json=VIEWPORT,
+                        headers={'Accept-Encoding': 'gzip'}) as r:
+                    assert r.status == 200
+                    assert await r.text() == crashes
+            stats = webserver.response_cache.stats()
+            assert (stats['hits'], stats['misses'], stats['hit_rate']) == (9, 1, 0.9)
+            assert stats['entries'] == 1 + variants
+        with_server(test, delay=0, crashes=crashes)
+
+def test_clients_over_the_limit_get_429(monkeypatch):
+    monkeypatch.setitem(api_server.settings, 'client_max_requests', 4)
+
+    async def test(session, url, connection, webserver):
+        bodies = [dict(VIEWPORT, yearmin=2000 + i) for i in range(6)]
+        results = await asyncio.gather(*[post(session, url + "/list_crashes", body) for body in bodies])
+        assert sorted(results) == [(200, None)] * 4 + [(429, '1')] * 2
+        assert webserver.client_requests == {}
+
+        # Another client, told apart by client_address_header, is not affected
+        monkeypatch.setitem(api_server.settings, 'client_address_header', 'X-Forwarded-For')
+        others = [post(session, url + "/list_crashes", dict(VIEWPORT, yearmin=2010 + i),
+            {'X-Forwarded-For': f'10.0.0.{i}'}) for i in range(6)]
+        assert [status for status, _ in await asyncio.gather(*others)] == [200] * 6
+
+        # Monitoring is never limited
+        async with session.get(url + "/metrics") as r:
+            assert r.status == 200
+            assert 'http_client_rejections_total{route="/list_crashes"} 2' in await r.text()
+    with_server(test)
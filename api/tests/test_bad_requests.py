@@ -0,0 +1,27 @@
+import pytest
+
+from test_api_concurrency import with_server
+
+'''
+Malformed request bodies and filters are answered with 400 before any query
+runs, whichever route they reach
+'''
+@pytest.mark.parametrize('method, path, body', [
+    ('GET', '/tiles/3/1/1.mvt?filters=[1,2]', None),
+    ('GET', '/tiles/3/1/1.mvt?filters={"severity":"fatal"}', None),
+    ('POST', '/stream_crashes', [1, 2]),
+    ('POST', '/stream_crashes', {"severity": "fatal"}),
+    ('POST', '/stream_crashes', {"after": [10]}),
+    ('POST', '/stats', [1, 2]),
+    ('POST', '/stats', {"groupby": 5}),
+    ('POST', '/stats', {"yearmin": "last year"}),
+    ('POST', '/stats', {"severity": ["fatal"]}),
+    ('POST', '/stats', {"region": 5}),
+])
+def test_malformed_requests_are_bad_requests(method, path, body):
+    async def test(session, url, connection, webserver):
+        async with session.request(method, url + path, json=body) as r:
+            assert r.status == 400, await r.text()
+        # /stats checks which source it answers from before validating
+        assert [sql for sql, _ in connection.queries if 'FROM CrashStats)' not in sql] == []
+    with_server(test, delay=0)
@@ -0,0 +1,70 @@
+import asyncio
+import decimal
+import os
+
+import pytest
+
+import import_data
+from conftest import FIXTURES_DIR
+from fakes import FakeConnection, FakePool
+
+CENSUS_CSV = os.path.join(FIXTURES_DIR, 'census_nonstandard.csv')
+
+async def read_fixture():
+    batches = [batch async for batch in import_data.read_csv_batches(CENSUS_CSV)]
+    columns = batches[0][0]
+    return columns, [row for _, rows in batches for row in rows]
+
+def test_census_header_map_accepts_alternative_names():
+    columns, _ = asyncio.run(read_fixture())
+    header_map = import_data.census_header_map(columns)
+    assert header_map == {'SiteID': 0, 'Year': 1, 'AADT': 2, 'PcntHV': 3, 'Longitude': 4, 'Latitude': 5}
+
+def test_census_header_map_rejects_missing_columns():
+    with pytest.raises(ValueError, match="AADT, Latitude"):
+        import_data.census_header_map({'SITE_ID': 0, 'LONGITUDE': 1})
+
+def test_census_record():
+    columns, rows = asyncio.run(read_fixture())
+    header_map = import_data.census_header_map(columns)
+    records = {row[0]: import_data.census_record(row, header_map, 2018) for row in rows}
+
+    assert records['10001'] == (10001, 2019, import_data.ewkb_point(153.0251, -27.4698), 12500, decimal.Decimal('7.46'))
+    # Decimal AADT, no heavy vehicle percentage
+    assert records['10002'][3:] == (830, None)
+    # The file's year is used when the row has none
+    assert records['10003'][1] == 2018
+    # No count, or no location
+    assert records['10004'] is None
+    assert records['10005'] is None
+    # Quoted field with a newline does not split the row
+    assert records['10006'][0] == 10006
+    assert len(rows) == 6
+
+def test_import_census_file_loads_rows_and_checkpoint():
+    connection = FakeConnection()
+    num = asyncio.run(import_data.import_census_file(FakePool(connection), asyncio.Semaphore(1), 2018, CENSUS_CSV))
+
+    assert num == 4
+    [(table, records, columns)] = connection.copies
+    assert table == 'censuslocations' and columns == import_data.CENSUS_LOCATIONS_COLUMNS
+    assert [r[0] for r in records] == [10001, 10002, 10003, 10006]
+    assert ("INSERT INTO CensusImports (Source, Rows) VALUES ($1, $2)", (CENSUS_CSV, 4)) in connection.queries
+
+def test_import_census_file_skips_imported_files():
+    connection = FakeConnection([("FROM CensusImports", 1)])
+    num = asyncio.run(import_data.import_census_file(FakePool(connection), asyncio.Semaphore(1), 2018, CENSUS_CSV))
+
+    assert num == 0
+    assert connection.copies == []
+    assert len(connection.queries) == 1
+
+def test_import_censusdata_continues_past_failed_files(tmp_path):
+    broken = tmp_path / 'broken.csv'
+    broken.write_text("SITE_ID,LONGITUDE\n1,153.0\n")
+    connection = FakeConnection()
+
+    num = asyncio.run(import_data.import_censusdata(FakePool(connection), {2017: str(broken), 2018: CENSUS_CSV}))
+
+    assert num == 4
+    assert len(connection.copies) == 1
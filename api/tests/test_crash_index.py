@@ -0,0 +1,135 @@
+import json
+import random
+
+import pytest
+
+import columnar
+import crash_index
+from api_server import LIGHTING_CONDITIONS, compile_crash_filters, normalise_crash_request
+from crash_index import LOAD_COLUMNS, CrashIndex
+
+ROWS = 20000
+
+@pytest.fixture(scope='module')
+def columns():
+    rng = random.Random(1)
+    columns = {name: [] for name in LOAD_COLUMNS}
+    for i in range(ROWS):
+        columns['id'].append(i + 1)
+        columns['severityindex'].append(rng.randint(1, 60))
+        columns['nearestaadt'].append(None if rng.random() < 0.3 else rng.randint(100, 50000))
+        # Mostly around Brisbane so small boxes go through the grid
+        if rng.random() < 0.7:
+            columns['x'].append(rng.gauss(153.03, 0.1))
+            columns['y'].append(rng.gauss(-27.47, 0.1))
+        else:
+            columns['x'].append(rng.uniform(138.0, 153.5))
+            columns['y'].append(rng.uniform(-29.0, -10.7))
+        columns['year'].append(rng.randint(2001, 2020))
+        for field in ('severity', 'nature', 'type'):
+            columns[field].append(rng.randint(1, 5))
+        columns['weather'].append(None if rng.random() < 0.1 else rng.randint(1, 4))
+        for field in ('sealed', 'dry', 'lit'):
+            columns[field].append(None if rng.random() < 0.05 else rng.random() < 0.5)
+        light = rng.choice(('day', 'partialday', 'dark'))
+        columns['day'].append(light == 'day')
+        columns['partialday'].append(light == 'partialday')
+        for field in crash_index.VEHICLE_FIELDS:
+            columns[field].append(rng.randint(0, 2) if rng.random() < 0.3 else 0)
+    return columns
+
+@pytest.fixture(scope='module')
+def index(columns):
+    return CrashIndex(columns)
+
+'''
+Whether crash i matches a normalised request, checked one field at a time
+the way the SQL of compile_crash_filters reads
+'''
+def matches(columns, i, request_json):
+    if 'corner1' in request_json:
+        (x1, y1), (x2, y2) = request_json['corner1'], request_json['corner2']
+        if not (x1 <= columns['x'][i] <= x2 and y1 <= columns['y'][i] <= y2):
+            return False
+    if 'yearmin' in request_json and columns['year'][i] < request_json['yearmin']:
+        return False
+    if 'yearmax' in request_json and columns['year'][i] > request_json['yearmax']:
+        return False
+    for field in crash_index.CATEGORY_FIELDS:
+        if field in request_json and columns[field][i] not in request_json[field]:
+            return False
+    for field in crash_index.BOOLEAN_FIELDS:
+        # NULL never equals anything
+        if field in request_json and columns[field][i] is not request_json[field]:
+            return False
+    if 'vehicle_types' in request_json and not any(columns[v][i] > 0 for v in request_json['vehicle_types']):
+        return False
+    if 'lighting' in request_json:
+        day, partial_day, lit = columns['day'][i], columns['partialday'][i], columns['lit'][i]
+        dark = day is False and partial_day is False
+        light = {'daylight': day, 'darknesslit': dark and lit is True,
+            'darknessunlit': dark and lit is False, 'dawndusk': partial_day}
+        if not any(light[l] for l in request_json['lighting']):
+            return False
+    if 'after' in request_json and (columns['severityindex'][i], columns['id'][i]) >= tuple(request_json['after']):
+        return False
+    return True
+
+def reference(columns, request_json, limit=None):
+    found = sorted(((columns['severityindex'][i], columns['id'][i]) for i in range(ROWS)
+        if matches(columns, i, request_json)), reverse=True)
+    return [crash_id for _, crash_id in found[:limit]]
+
+REQUESTS = [
+    {},
+    {"corner1": [153.02, -27.47], "corner2": [153.05, -27.45]},
+    {"corner1": [152.85, -27.65], "corner2": [153.25, -27.30], "severity": [1, 2], "dry": True},
+    {"corner1": [137.9, -29.2], "corner2": [153.6, -10.0], "yearmin": 2015, "vehicle_types": ["bus", "truck"]},
+    {"yearmax": 2005, "weather": [2, 3], "sealed": False},
+    {"lighting": ["darknesslit", "dawndusk"], "nature": [4]},
+    {"corner1": [152.9, -27.6], "corner2": [153.1, -27.4], "limit": 50, "after": [40, 15000]},
+    {"after": [10, 0], "limit": 200, "vehicle_types": ["pedestrian"]},
+    {"corner1": [100.0, 0.0], "corner2": [101.0, 1.0]},
+]
+
+@pytest.mark.parametrize('request_json', REQUESTS)
+@pytest.mark.parametrize('chunk_rows', [crash_index.SCAN_CHUNK_ROWS, 997])
+def test_points_match_reference(columns, index, monkeypatch, request_json, chunk_rows):
+    monkeypatch.setattr(crash_index, 'SCAN_CHUNK_ROWS', chunk_rows)
+    request_json = normalise_crash_request(request_json)
+    compile_crash_filters(request_json)
+    limit = request_json.get('limit', 1000)
+
+    body = json.loads(index.list_crash_points(request_json, limit))
+    crashes = body['crashes'] if 'limit' in request_json else body
+    expected = reference(columns, request_json, limit)
+    assert [crash['id'] for crash in crashes] == expected
+
+    if 'limit' in request_json:
+        assert body['next'] == (len(expected) == limit and [crashes[-1]['severityindex'], crashes[-1]['id']] or None)
+
+    # The columnar encoding carries the same rows
+    kind, decoded, next = columnar.decode(index.list_crash_points(request_json, limit, columns=True))
+    assert kind == columnar.KIND_CRASHES
+    assert decoded['id'] == expected
+    assert decoded['nearestaadt'] == [-1 if c['nearestaadt'] is None else c['nearestaadt'] for c in crashes]
+    assert next == (body['next'] if 'limit' in request_json else None)
+
+def test_every_lighting_condition_matches_everything(columns, index):
+    request_json = normalise_crash_request({"lighting": list(LIGHTING_CONDITIONS)})
+    assert len(index.matching_rows(request_json)) == ROWS
+
+@pytest.mark.parametrize('request_json', REQUESTS[:6])
+def test_clusters_add_up(columns, index, request_json):
+    request_json = normalise_crash_request(dict(request_json, aggregate=True, zoom=8))
+    expected = reference(columns, request_json)
+    severity = {columns['id'][i]: columns['severityindex'][i] for i in range(ROWS)}
+
+    cells = json.loads(index.list_crash_clusters(request_json, 0.5))
+    assert sum(cell['count'] for cell in cells) == len(expected)
+    assert sum(cell['severity'] for cell in cells) == sum(severity[crash_id] for crash_id in expected)
+
+    kind, decoded, _ = columnar.decode(index.list_crash_clusters(request_json, 0.5, columns=True))
+    assert kind == columnar.KIND_CELLS
+    assert decoded['count'] == [cell['count'] for cell in cells]
+    assert decoded['severity'] == [cell['severity'] for cell in cells]
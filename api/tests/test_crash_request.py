@@ -0,0 +1,36 @@
+import pytest
+from aiohttp import web
+
+from api_server import compile_crash_filters, normalise_crash_request
+
+def test_category_lists_are_converted_to_int():
+    normalised = normalise_crash_request({"severity": ["1", 2, 2], "nature": [3.0]})
+    assert normalised == {"severity": [1, 2], "nature": [3]}
+
+    conditions, variables = compile_crash_filters(normalised)
+    assert conditions == "SeverityID = ANY($1::smallint[])\nAND NatureID = ANY($2::smallint[])"
+    assert variables == [[1, 2], [3]]
+
+def test_equivalent_requests_normalise_equal():
+    assert normalise_crash_request({"severity": [2, "1"], "vehicle_types": ["bus", "car", "bus"], "dry": 1}) == \
+        normalise_crash_request({"severity": [1, 2], "vehicle_types": ["car", "bus"], "dry": True})
+
+@pytest.mark.parametrize('request_json', [
+    {"severity": ["fatal"]},
+    {"severity": 1},
+    {"weather": [None]},
+    {"yearmin": "last year"},
+    {"limit": None},
+    {"after": [10]},
+    {"corner1": "here", "corner2": [153, -27]},
+    {"aggregate": True, "zoom": "close"},
+    [1, 2],
+])
+def test_invalid_values_are_bad_requests(request_json):
+    with pytest.raises(web.HTTPBadRequest):
+        normalise_crash_request(request_json)
+
+def test_unknown_names_are_bad_requests():
+    for request_json in ({"vehicle_types": ["tank"]}, {"lighting": ["moonlight"]}, {"vehicle_types": [1]}):
+        with pytest.raises(web.HTTPBadRequest):
+            compile_crash_filters(normalise_crash_request(request_json))
@@ -0,0 +1,117 @@
+import asyncio
+import json
+import os
+
+import aiohttp
+import pytest
+from aiohttp import web
+
+import import_data
+
+'''
+Local stand-in for the open data portal, serving body with an ETag and
+answering If-None-Match with 304. With truncate set the connection is closed
+half way through the body.
+'''
+class FileServer:
+    def __init__(self, body, etag):
+        self.body = body
+        self.etag = etag
+        self.truncate = False
+        self.statuses = []
+
+    async def handle(self, request):
+        if request.headers.get('If-None-Match') == self.etag:
+            self.statuses.append(304)
+            return web.Response(status=304, headers={'ETag': self.etag})
+
+        self.statuses.append(200)
+        if not self.truncate:
+            return web.Response(body=self.body, headers={'ETag': self.etag})
+
+        response = web.StreamResponse(headers={'ETag': self.etag})
+        response.content_length = len(self.body)
+        await response.prepare(request)
+        await response.write(self.body[:len(self.body) // 2])
+        request.transport.close()
+        return response
+
+async def with_server(server, test):
+    app = web.Application()
+    app.router.add_get('/census.csv', server.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    host, port = runner.addresses[0][:2]
+    try:
+        await test(f"http://{host}:{port}/census.csv")
+    finally:
+        await runner.cleanup()
+
+async def read(url):
+    return b''.join([chunk async for chunk in import_data.read_chunks(url)])
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(import_data, 'download_cache_dir', str(tmp_path))
+    return tmp_path
+
+def test_unchanged_file_is_revalidated(cache_dir):
+    server = FileServer(b"SITE_ID,AADT\n1,100\n", '"v1"')
+
+    async def test(url):
+        assert await read(url) == server.body
+        assert await read(url) == server.body
+
+        data_path, meta_path = import_data.download_cache_paths(url)
+        with open(meta_path) as f:
+            assert json.load(f)['etag'] == '"v1"'
+
+    asyncio.run(with_server(server, test))
+    assert server.statuses == [200, 304]
+
+def test_changed_file_is_downloaded_again(cache_dir):
+    server = FileServer(b"SITE_ID,AADT\n1,100\n", '"v1"')
+
+    async def test(url):
+        await read(url)
+        server.body = b"SITE_ID,AADT\n1,200\n"
+        server.etag = '"v2"'
+        assert await read(url) == server.body
+        assert await read(url) == server.body
+
+        data_path, _ = import_data.download_cache_paths(url)
+        with open(data_path, 'rb') as f:
+            assert f.read() == server.body
+
+    asyncio.run(with_server(server, test))
+    assert server.statuses == [200, 200, 304]
+
+def test_partial_download_is_discarded(cache_dir):
+    server = FileServer(b"SITE_ID,AADT\n" + b"1,100\n" * 1000, '"v1"')
+
+    async def test(url):
+        await read(url)
+        data_path, meta_path = import_data.download_cache_paths(url)
+
+        # A newer version of the file fails half way through
+        complete = server.body
+        server.body = b"SITE_ID,AADT\n" + b"1,200\n" * 1000
+        server.etag = '"v2"'
+        server.truncate = True
+        with pytest.raises(aiohttp.ClientPayloadError):
+            await read(url)
+
+        assert not os.path.exists(data_path + '.part')
+        with open(data_path, 'rb') as f:
+            assert f.read() == complete
+        with open(meta_path) as f:
+            assert json.load(f)['etag'] == '"v1"'
+
+        # The next run downloads it in full
+        server.truncate = False
+        assert await read(url) == server.body
+
+    asyncio.run(with_server(server, test))
+    assert server.statuses == [200, 200, 200]
@@ -0,0 +1,48 @@
+import argparse
+import asyncio
+
+import pytest
+
+import import_data
+from fakes import FakeConnection, FakePool
+
+'''
+Runs import_data.run against a fake database with the loaders replaced, and
+returns whether the full NearestAADT update ran
+'''
+def run_import(monkeypatch, loader, census_rows):
+    connection = FakeConnection()
+    calls = []
+
+    async def connect(**kwargs):
+        return connection
+    async def create_pool(**kwargs):
+        return FakePool(connection)
+    async def import_crashdata(db, loader, workers, source):
+        return 10
+    async def import_censusdata(pool, sources, max_downloads):
+        return census_rows
+    async def build_crash_stats(db):
+        pass
+    async def update_nearest_aadt(pool):
+        calls.append('update_nearest_aadt')
+
+    monkeypatch.setattr(import_data, 'settings', {'psql_user': 'u', 'psql_pass': 'p', 'psql_dbname': 'd', 'psql_host': 'h'})
+    monkeypatch.setattr(import_data.asyncpg, 'connect', connect)
+    monkeypatch.setattr(import_data.asyncpg, 'create_pool', create_pool)
+    for function in (import_crashdata, import_censusdata, build_crash_stats, update_nearest_aadt):
+        monkeypatch.setattr(import_data, function.__name__, function)
+
+    args = argparse.Namespace(loader=loader, workers=0, skip_crashes=False, skip_census=False,
+        crash_source='crashes.csv', census_source=[], max_downloads=1, jobs=1, skip_nearest_aadt=False)
+    asyncio.run(import_data.run(args))
+    return calls == ['update_nearest_aadt']
+
+@pytest.mark.parametrize('loader, census_rows, full_update', [
+    ("copy", 0, True),
+    ("insert", 0, True),
+    ("incremental", 0, False),
+    ("incremental", 250, True),
+])
+def test_full_nearest_aadt_update(monkeypatch, loader, census_rows, full_update):
+    assert run_import(monkeypatch, loader, census_rows) == full_update
@@ -0,0 +1,28 @@
+import pytest
+
+import api_server
+from api_server import pool_sizes
+
+@pytest.fixture
+def settings(monkeypatch):
+    settings = {}
+    monkeypatch.setattr(api_server, 'settings', settings)
+    return settings
+
+@pytest.mark.parametrize('workers', [1, 2, 4, 8, 16, 32, 64])
+def test_workers_share_the_connection_budget(settings, workers):
+    min_size, max_size = pool_sizes(workers)
+    assert min_size == 1
+    assert 1 <= max_size <= api_server.DEFAULT_POOL_MAX_SIZE
+    # Pools plus one LISTEN connection per worker
+    if workers <= api_server.DB_CONNECTION_BUDGET // 2:
+        assert workers * (max_size + 1) <= api_server.DB_CONNECTION_BUDGET
+
+def test_single_worker_keeps_the_default_pool(settings):
+    assert pool_sizes(1) == (1, api_server.DEFAULT_POOL_MAX_SIZE)
+
+def test_settings_override_the_budget(settings):
+    settings.update(db_connection_budget=400)
+    assert pool_sizes(32) == (1, 10)
+    settings.update(pool_max_size=3, pool_min_size=5)
+    assert pool_sizes(32) == (3, 3)
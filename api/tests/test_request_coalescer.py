@@ -0,0 +1,86 @@
+import asyncio
+
+from request_coalescer import RequestCoalescer
+
+'''
+A build that counts how often it started and was cancelled, and finishes
+when release is set
+'''
+class Build:
+    def __init__(self):
+        self.started = 0
+        self.cancelled = 0
+        self.release = asyncio.Event()
+
+    async def __call__(self):
+        self.started += 1
+        try:
+            await self.release.wait()
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return b"body"
+
+def test_concurrent_requests_share_one_build():
+    async def test():
+        coalescer = RequestCoalescer(asyncio.get_running_loop())
+        build = Build()
+        waiters = [asyncio.ensure_future(coalescer.run('key', build)) for _ in range(5)]
+        await asyncio.sleep(0)
+        build.release.set()
+        assert await asyncio.gather(*waiters) == [b"body"] * 5
+        assert build.started == 1
+        assert coalescer.stats() == {'started': 1, 'coalesced': 4, 'cancelled': 0, 'in_flight': 0}
+
+        # Once finished the next request builds again
+        assert await coalescer.run('key', build) == b"body"
+        assert build.started == 2
+    asyncio.run(test())
+
+def test_build_continues_while_anyone_waits():
+    async def test():
+        coalescer = RequestCoalescer(asyncio.get_running_loop())
+        build = Build()
+        first = asyncio.ensure_future(coalescer.run('key', build))
+        second = asyncio.ensure_future(coalescer.run('key', build))
+        await asyncio.sleep(0)
+
+        first.cancel()
+        await asyncio.sleep(0)
+        build.release.set()
+        assert await second == b"body"
+        assert first.cancelled()
+        assert build.cancelled == 0
+    asyncio.run(test())
+
+def test_build_is_cancelled_when_everyone_leaves():
+    async def test():
+        coalescer = RequestCoalescer(asyncio.get_running_loop())
+        build = Build()
+        waiters = [asyncio.ensure_future(coalescer.run('key', build)) for _ in range(3)]
+        await asyncio.sleep(0)
+
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.sleep(0.01)
+        assert build.cancelled == 1
+        assert coalescer.stats()['cancelled'] == 1
+        assert coalescer.in_flight == {}
+
+        # A later request does not share the cancelled build
+        build.release.set()
+        assert await coalescer.run('key', build) == b"body"
+        assert build.started == 2
+    asyncio.run(test())
+
+def test_errors_reach_every_waiter():
+    async def test():
+        coalescer = RequestCoalescer(asyncio.get_running_loop())
+        async def failing():
+            await asyncio.sleep(0)
+            raise ValueError("no database")
+
+        results = await asyncio.gather(*[coalescer.run('key', failing) for _ in range(3)], return_exceptions=True)
+        assert [type(r) for r in results] == [ValueError] * 3
+        assert coalescer.in_flight == {}
+    asyncio.run(test())
@@ -0,0 +1,39 @@
+import asyncio
+import os
+import signal
+import time
+
+import api_server
+
+class SlowStoppingWebserver:
+    def __init__(self, stopped_path):
+        self.stopped_path = stopped_path
+
+    async def stop(self):
+        await asyncio.sleep(0.5)
+        with open(self.stopped_path, 'w') as f:
+            f.write("stopped")
+
+def test_second_signal_does_not_interrupt_shutdown(monkeypatch, tmp_path):
+    stopped_path = tmp_path / "stopped"
+
+    async def start_webserver(loop, address, port, reuse_port, workers):
+        return SlowStoppingWebserver(stopped_path)
+    monkeypatch.setattr(api_server, 'start_webserver', start_webserver)
+
+    pid = os.fork()
+    if pid == 0:
+        try:
+            api_server.run_worker('127.0.0.1', 0)
+            os._exit(0)
+        except BaseException:
+            os._exit(1)
+
+    time.sleep(0.5)
+    os.kill(pid, signal.SIGINT)
+    time.sleep(0.1)
+    os.kill(pid, signal.SIGTERM)
+    _, status = os.waitpid(pid, 0)
+
+    assert os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0
+    assert stopped_path.read_text() == "stopped"
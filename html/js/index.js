@@ -32,11 +32,19 @@ idList = {
     "extLoad": 14,
     "intLoad": 15
   },
+  // IDs of the CrashType lookup table, see seed_data.sql
   "crashType": {
     "ped": 1,
-    "singleVeh": 2,
-    "multiVeh": 3,
-    "type_other": 4
+    "multiVeh": 2,
+    "type_other": 3,
+    "singleVeh": 4
+  },
+  // Lighting conditions, a crash matches if it happened in any of the ticked ones
+  "lighting": {
+    "daylight": "daylight",
+    "darkness1": "darknesslit",
+    "darkness2": "darknessunlit",
+    "dawndusk": "dawndusk"
   },
   "weather": {
     "clear": 1,
@@ -46,6 +54,9 @@ idList = {
   }
 }
 
+// Below this zoom level the API is asked for aggregated grid cells instead of points
+aggregateBelowZoom = 10;
+
 document.getElementById("dateMax").addEventListener("change", updateYearBounds);
 document.getElementById("dateMin").addEventListener("change", updateYearBounds);
 document.getElementById("applyFilters").addEventListener("pointerup", updateMap);
@@ -53,6 +64,8 @@ document.getElementById("showFilter").addEventListener("pointerup", showFilter);
 
 initControls();
 var map;
+// list_crashes request of the last updateMap, until it completes
+var pendingRequest = null;
 initMap();
 
 function initControls() {
@@ -91,6 +104,35 @@ function initMap() {
   updateMap();
 }
 
+// Decodes a list_crashes response in the columnar encoding described in
+// api/columnar.py. The columns are viewed in place, typed arrays use the
+// platform byte order which is little-endian in every browser.
+function decodeCrashColumns(buffer) {
+  var header = new DataView(buffer, 0, 20);
+  var count = header.getUint32(8, true);
+  var offset = 20;
+  function column(type) {
+    var values = new type(buffer, offset, count);
+    offset += values.byteLength;
+    return values;
+  }
+
+  if (header.getUint8(5) == 0) {
+    var id = column(Int32Array);
+    var nearestAADT = column(Int32Array);
+    var longitude = column(Float32Array);
+    var latitude = column(Float32Array);
+    return {count: count, id: id, nearestAADT: nearestAADT, longitude: longitude, latitude: latitude,
+      weight: column(Uint16Array)};
+  }
+
+  var crashes = column(Uint32Array);
+  // Aggregated cells carry the summed severity of every crash in them
+  var weight = column(Uint32Array);
+  return {count: count, crashes: crashes, weight: weight,
+    longitude: column(Float32Array), latitude: column(Float32Array)};
+}
+
 function parseData(returnedData) {
   // var heatmapLayers = map.getLayers().getArray()
   //     .filter(layer => layer.get('name') == 'heatmap' || layer.get('name') == 'bubble')
@@ -103,15 +145,25 @@ function parseData(returnedData) {
   //   vector = new ol.source.Vector();
   // }
 
+  // Summed cell severities grow with the cell size, so scale them against the
+  // heaviest cell in this response rather than a fixed divisor
+  var scale = 10;
+  if (returnedData.crashes) {
+    scale = 1;
+    for (var i = 0; i < returnedData.count; i++) {
+      scale = Math.max(scale, returnedData.weight[i]);
+    }
+  }
+
   var vector = new ol.source.Vector();
-  returnedData.forEach((item, i) => {
-    var point = new ol.geom.Point(ol.proj.fromLonLat([item.location[0], item.location[1]]));
+  for (var i = 0; i < returnedData.count; i++) {
+    var point = new ol.geom.Point(ol.proj.fromLonLat([returnedData.longitude[i], returnedData.latitude[i]]));
     var pointFeature = new ol.Feature({
       geometry: point,
-      weight: item.severityindex/10
+      weight: returnedData.weight[i]/scale
     });
     vector.addFeature(pointFeature);
-  });
+  }
 
   // var heatmapLayer;
   // if (heatmapLayers.length > 0) {
@@ -210,6 +262,8 @@ function updateMap() {
   // These are commented out so that data from the entire state is fetched.
   requestBody.corner1 = ol.proj.toLonLat(boundingBox.slice(0,2));
   requestBody.corner2 = ol.proj.toLonLat(boundingBox.slice(2,4));
+  requestBody.zoom = map.getView().getZoom();
+  requestBody.aggregate = requestBody.zoom < aggregateBelowZoom;
   requestBody.yearmax = parseInt(document.getElementById("dateMax").value);
   requestBody.yearmin = parseInt(document.getElementById("dateMin").value);
   requestBody.vehicle_types = [];
@@ -228,27 +282,18 @@ function updateMap() {
     requestBody.sealed = document.getElementById("sealed").checked;
   }
 
-  // Handle lighting conditions
-  if(!document.getElementById("daylight").checked && !document.getElementById("darkness1").checked
-        && !document.getElementById("darkness2").checked
-        && !document.getElementById("dawndusk").checked) {
+  // Handle list of lighting conditions
+  requestBody.lighting = [];
+  for (const [key, value] of Object.entries(idList.lighting)) {
+    if (document.getElementById(key).checked) {
+      requestBody.lighting.push(value);
+    }
+  }
+  if (requestBody.lighting.length == 0) {
     generateWarning("lighting conditions");
     M.Collapsible.getInstance(document.getElementById("sidebar")).open(5);
     return;
   }
-  if(!(document.getElementById("daylight").checked && document.getElementById("darkness1").checked
-        && document.getElementById("darkness2").checked && document.getElementById("dawndusk").checked)) {
-    if(document.getElementById("darkness1").checked != document.getElementById("darkness2").checked) {
-      requestBody.lit = document.getElementById("darkness1").checked;
-    }
-
-    if(document.getElementById("daylight").checked
-        && !(document.getElementById("darkness1").checked || document.getElementById("darkness2"))) {
-      requestBody.day = document.getElementById("daylight").checked;
-    }
-
-    requestBody.partialDaylight = document.getElementById("dawndusk").checked;
-  }
 
 
   // Handle list of vehicles
@@ -312,14 +357,26 @@ function updateMap() {
   }
   console.dir(requestBody);
 
+  // Only the latest filters matter, and the server cancels the query of an aborted request
+  if (pendingRequest !== null) {
+    pendingRequest.abort();
+  }
+
   var xhttp = new XMLHttpRequest();
+  pendingRequest = xhttp;
   // xhttp.addEventListener("readystatechange", parseData);
   xhttp.onreadystatechange = function () {
+      if (xhttp.readyState === 4 && pendingRequest === xhttp) {
+          pendingRequest = null;
+      }
       if (xhttp.readyState === 4 && xhttp.status === 200) {
-          parseData(JSON.parse(xhttp.responseText));
+          parseData(decodeCrashColumns(xhttp.response));
       }
   };
   xhttp.open("POST", "http://api.crashmap.xyz/list_crashes", true);
+  // Packed typed arrays instead of JSON, a fraction of the size and decoded without parsing
+  xhttp.responseType = "arraybuffer";
+  xhttp.setRequestHeader("Accept", "application/vnd.crashmap.columns");
   xhttp.send(JSON.stringify(requestBody));
 
   // Finally start the request